@@ -46,6 +46,28 @@ CREATE TABLE images_5 PARTITION OF images FOR VALUES WITH (MODULUS 8, REMAINDER
 CREATE TABLE images_6 PARTITION OF images FOR VALUES WITH (MODULUS 8, REMAINDER 6);
 CREATE TABLE images_7 PARTITION OF images FOR VALUES WITH (MODULUS 8, REMAINDER 7);
 
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Versões redimensionadas geradas no upload (images.image_url aponta para a 'full')
+
+CREATE TYPE image_variant AS ENUM (
+    'thumbnail',
+    'feed',
+    'full'
+);
+
+CREATE TABLE image_variants (
+    image_id BIGINT NOT NULL,
+    variant image_variant NOT NULL,
+    image_url TEXT NOT NULL,
+    public_id TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    PRIMARY KEY (image_id, variant),
+    CONSTRAINT image_variants_fk_image FOREIGN KEY (image_id) REFERENCES images (image_id) ON DELETE CASCADE,
+    CONSTRAINT image_variants_chk_positive_size CHECK (width > 0 AND height > 0)
+);
+
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
 
@@ -106,7 +128,7 @@ CREATE TABLE posts (
     CONSTRAINT posts_fk_language FOREIGN KEY (language) REFERENCES languages (code)
 );
 CREATE INDEX idx_posts_user_id ON posts(user_id);
-CREATE INDEX idx_posts_user_created_at ON posts (user_id, created_at DESC);
+CREATE INDEX idx_posts_user_created_at ON posts (user_id, created_at DESC, post_id DESC);
 CREATE INDEX idx_posts_status_order ON posts (status, created_at DESC);
 CREATE INDEX idx_posts_language ON posts(language);
 CREATE INDEX idx_posts_created_at ON posts(created_at);
@@ -114,8 +136,7 @@ CREATE INDEX idx_posts_published ON posts(status) WHERE status = 'published';
 CREATE INDEX idx_posts_published_created_at ON posts(created_at) WHERE status = 'published';
 CREATE INDEX idx_posts_updated_at ON posts(updated_at);
 CREATE INDEX idx_posts_user_status ON posts(user_id, status);
-CREATE INDEX idx_posts_title_fulltext_br ON posts USING GIN (to_tsvector('portuguese', title));
-CREATE INDEX idx_posts_title_fulltext_en ON posts USING GIN (to_tsvector('english', title));
+-- Índice de busca textual (idx_posts_search) é criado junto com post_search_vector()
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
@@ -149,7 +170,9 @@ CREATE TABLE post_likes_0 PARTITION OF post_likes FOR VALUES WITH (MODULUS 4, RE
 CREATE TABLE post_likes_1 PARTITION OF post_likes FOR VALUES WITH (MODULUS 4, REMAINDER 1);
 CREATE TABLE post_likes_2 PARTITION OF post_likes FOR VALUES WITH (MODULUS 4, REMAINDER 2);
 CREATE TABLE post_likes_3 PARTITION OF post_likes FOR VALUES WITH (MODULUS 4, REMAINDER 3);
-CREATE INDEX idx_post_likes_post ON post_likes(post_id);
+-- Lista paginada de quem curtiu, mais recentes primeiro
+CREATE INDEX idx_post_likes_post ON post_likes(post_id, created_at DESC, user_id DESC);
+CREATE INDEX idx_post_likes_user ON post_likes(user_id, created_at DESC);
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
@@ -166,7 +189,7 @@ CREATE TABLE user_viewed_posts_0 PARTITION OF user_viewed_posts FOR VALUES WITH
 CREATE TABLE user_viewed_posts_1 PARTITION OF user_viewed_posts FOR VALUES WITH (MODULUS 4, REMAINDER 1);
 CREATE TABLE user_viewed_posts_2 PARTITION OF user_viewed_posts FOR VALUES WITH (MODULUS 4, REMAINDER 2);
 CREATE TABLE user_viewed_posts_3 PARTITION OF user_viewed_posts FOR VALUES WITH (MODULUS 4, REMAINDER 3);
-CREATE INDEX idx_user_viewed_posts ON user_viewed_posts(user_id, viewed_at DESC);
+CREATE INDEX idx_user_viewed_posts ON user_viewed_posts(user_id, viewed_at DESC, post_id DESC);
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
@@ -182,7 +205,9 @@ CREATE TABLE comments (
     updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,    
     CONSTRAINT comments_fk_user FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
     CONSTRAINT comments_fk_post FOREIGN KEY (post_id) REFERENCES posts (post_id) ON DELETE CASCADE,
-    CONSTRAINT comments_fk_parent FOREIGN KEY (parent_comment_id) REFERENCES comments (comment_id) ON DELETE CASCADE
+    CONSTRAINT comments_fk_parent FOREIGN KEY (parent_comment_id) REFERENCES comments (comment_id) ON DELETE CASCADE,
+    -- Alvo da FK composta de comment_likes
+    CONSTRAINT comments_unique_post UNIQUE (comment_id, post_id)
 );
 CREATE INDEX idx_comments_post ON comments (post_id);
 CREATE INDEX idx_comments_parent ON comments (parent_comment_id);
@@ -199,13 +224,15 @@ CREATE TABLE comment_likes (
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY(user_id, post_id, comment_id),
     CONSTRAINT comment_likes_fk_user FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
-    CONSTRAINT comment_likes_fk_comment FOREIGN KEY (comment_id) REFERENCES comments(comment_id) ON DELETE CASCADE
+    -- Garante que o comentário existe e pertence à postagem (substitui o trigger validate_comment_likes)
+    CONSTRAINT comment_likes_fk_comment FOREIGN KEY (comment_id, post_id) REFERENCES comments(comment_id, post_id) ON DELETE CASCADE
 ) PARTITION BY HASH (post_id);
 CREATE TABLE comment_likes_0 PARTITION OF comment_likes FOR VALUES WITH (MODULUS 4, REMAINDER 0);
 CREATE TABLE comment_likes_1 PARTITION OF comment_likes FOR VALUES WITH (MODULUS 4, REMAINDER 1);
 CREATE TABLE comment_likes_2 PARTITION OF comment_likes FOR VALUES WITH (MODULUS 4, REMAINDER 2);
 CREATE TABLE comment_likes_3 PARTITION OF comment_likes FOR VALUES WITH (MODULUS 4, REMAINDER 3);
 CREATE INDEX idx_comment_likes ON comment_likes (post_id);
+CREATE INDEX idx_comment_likes_comment ON comment_likes (comment_id, created_at DESC, user_id DESC);
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
@@ -215,6 +242,8 @@ CREATE TABLE hashtags (
     name CITEXT UNIQUE NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
 );
+-- Busca por prefixo (LIKE 'abc%') ordenada por nome, o índice UNIQUE de CITEXT não atende LIKE
+CREATE INDEX idx_hashtags_name_prefix ON hashtags ((LOWER(name::text) COLLATE "C"));
 
 CREATE TABLE post_hashtags (
     user_id INTEGER NOT NULL,
@@ -230,6 +259,10 @@ CREATE TABLE post_hashtags_0 PARTITION OF post_hashtags FOR VALUES WITH (MODULUS
 CREATE TABLE post_hashtags_1 PARTITION OF post_hashtags FOR VALUES WITH (MODULUS 4, REMAINDER 1);
 CREATE TABLE post_hashtags_2 PARTITION OF post_hashtags FOR VALUES WITH (MODULUS 4, REMAINDER 2);
 CREATE TABLE post_hashtags_3 PARTITION OF post_hashtags FOR VALUES WITH (MODULUS 4, REMAINDER 3);
+CREATE INDEX idx_post_hashtags_hashtag ON post_hashtags (hashtag_id, created_at DESC);
+CREATE INDEX idx_post_hashtags_created_at ON post_hashtags (created_at);
+-- Hashtags de um post (a PK começa por user_id e não atende busca só por post_id)
+CREATE INDEX idx_post_hashtags_post ON post_hashtags (post_id, hashtag_id);
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
@@ -278,6 +311,54 @@ ALTER TABLE comment_metrics_impressions SET (fillfactor = 80);
 CREATE TABLE comment_metrics_views PARTITION OF comment_metrics FOR VALUES IN ('views');
 ALTER TABLE  comment_metrics_views  SET (fillfactor = 80);
 
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Contadores desnormalizados por post (evita COUNT(*) em get_post_metrics)
+
+CREATE TABLE post_counters (
+    post_id INTEGER PRIMARY KEY NOT NULL,
+    likes BIGINT NOT NULL DEFAULT 0,
+    comments BIGINT NOT NULL DEFAULT 0,
+    impressions BIGINT NOT NULL DEFAULT 0,
+    views BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT post_counters_fk_post FOREIGN KEY (post_id) REFERENCES posts (post_id) ON DELETE CASCADE,
+    CONSTRAINT post_counters_chk_positive_counters CHECK (likes >= 0 AND comments >= 0 AND impressions >= 0 AND views >= 0)
+);
+ALTER TABLE post_counters SET (fillfactor = 80);
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Contadores desnormalizados por usuário (evita COUNT(*) em follows e posts)
+
+CREATE TABLE user_counters (
+    user_id INTEGER PRIMARY KEY NOT NULL,
+    posts BIGINT NOT NULL DEFAULT 0,
+    followers BIGINT NOT NULL DEFAULT 0,
+    following BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT user_counters_fk_user FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+    CONSTRAINT user_counters_chk_positive_counters CHECK (posts >= 0 AND followers >= 0 AND following >= 0)
+);
+ALTER TABLE user_counters SET (fillfactor = 80);
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Contadores desnormalizados por comentário (evita COUNT(*) em get_comment_metrics)
+-- comments conta as respostas diretas do comentário
+
+CREATE TABLE comment_counters (
+    comment_id INTEGER PRIMARY KEY NOT NULL,
+    likes BIGINT NOT NULL DEFAULT 0,
+    comments BIGINT NOT NULL DEFAULT 0,
+    impressions BIGINT NOT NULL DEFAULT 0,
+    views BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT comment_counters_fk_comment FOREIGN KEY (comment_id) REFERENCES comments (comment_id) ON DELETE CASCADE,
+    CONSTRAINT comment_counters_chk_positive_counters CHECK (likes >= 0 AND comments >= 0 AND impressions >= 0 AND views >= 0)
+);
+ALTER TABLE comment_counters SET (fillfactor = 80);
+
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
 
@@ -286,14 +367,31 @@ CREATE TABLE direct_conversations (
     user1_id INTEGER NOT NULL,
     user2_id INTEGER NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    last_interaction_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    last_interaction_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     UNIQUE (user1_id, user2_id),
     CONSTRAINT direct_conversations_fk_user1 FOREIGN KEY (user1_id) REFERENCES users(user_id),
     CONSTRAINT direct_conversations_fk_user2 FOREIGN KEY (user2_id) REFERENCES users(user_id),
     CONSTRAINT direct_conversations_chk_user_order CHECK (user1_id < user2_id)
 );
-CREATE INDEX idx_direct_conversations_user1 ON direct_conversations(user1_id);
-CREATE INDEX idx_direct_conversations_user2 ON direct_conversations(user2_id);
+-- Inbox de cada participante ordenado por interação (keyset em last_interaction_at, conversation_id)
+CREATE INDEX idx_direct_conversations_user1 ON direct_conversations(user1_id, last_interaction_at DESC, conversation_id DESC);
+CREATE INDEX idx_direct_conversations_user2 ON direct_conversations(user2_id, last_interaction_at DESC, conversation_id DESC);
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Mensagens não lidas por participante da conversa (mantido por triggers)
+
+CREATE TABLE direct_conversation_members (
+    conversation_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (conversation_id, user_id),
+    CONSTRAINT direct_conversation_members_fk_conversation FOREIGN KEY (conversation_id) REFERENCES direct_conversations(conversation_id) ON DELETE CASCADE,
+    CONSTRAINT direct_conversation_members_fk_user FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    CONSTRAINT direct_conversation_members_chk_positive_unread CHECK (unread_count >= 0)
+);
+ALTER TABLE direct_conversation_members SET (fillfactor = 80);
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
@@ -334,6 +432,8 @@ CREATE TABLE blocks_1 PARTITION OF blocks FOR VALUES WITH (MODULUS 4, REMAINDER
 CREATE TABLE blocks_2 PARTITION OF blocks FOR VALUES WITH (MODULUS 4, REMAINDER 2);
 CREATE TABLE blocks_3 PARTITION OF blocks FOR VALUES WITH (MODULUS 4, REMAINDER 3);
 CREATE INDEX idx_blocks_blocker ON blocks (blocker_id);
+-- Quem bloqueou um usuário (filtro de conteúdo), sem varrer todas as partições
+CREATE INDEX idx_blocks_blocked ON blocks (blocked_id, blocker_id);
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
@@ -351,7 +451,10 @@ CREATE TABLE follows_0 PARTITION OF follows FOR VALUES WITH (MODULUS 4, REMAINDE
 CREATE TABLE follows_1 PARTITION OF follows FOR VALUES WITH (MODULUS 4, REMAINDER 1);
 CREATE TABLE follows_2 PARTITION OF follows FOR VALUES WITH (MODULUS 4, REMAINDER 2);
 CREATE TABLE follows_3 PARTITION OF follows FOR VALUES WITH (MODULUS 4, REMAINDER 3);
-CREATE INDEX idx_follower ON follows(follower_id);
+-- Listas paginadas por (created_at, id) em ordem decrescente, mais recentes primeiro
+CREATE INDEX idx_follower ON follows(follower_id, created_at DESC, followed_id DESC);
+-- Lista reversa (seguidores de um usuário): um index scan por partição em vez de seq scan
+CREATE INDEX idx_followed ON follows(followed_id, created_at DESC, follower_id DESC);
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
@@ -367,27 +470,95 @@ CREATE TABLE user_search_history (
 CREATE INDEX idx_user_search_history_user_searched_at ON user_search_history (user_id, searched_at DESC);
 CREATE INDEX idx_user_search_history_query ON user_search_history(search_query);
 
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Timelines de /feed/following compartilhadas por todos os processos
+-- (PostgresTimelineStore em src/timeline.py)
+
+CREATE TABLE timelines (
+    user_id INTEGER PRIMARY KEY,
+    materialized_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE timeline_entries (
+    user_id INTEGER NOT NULL,
+    post_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (user_id, post_id),
+    FOREIGN KEY (user_id) REFERENCES timelines(user_id) ON DELETE CASCADE,
+    FOREIGN KEY (post_id) REFERENCES posts(post_id) ON DELETE CASCADE
+) PARTITION BY HASH (user_id);
+CREATE TABLE timeline_entries_0 PARTITION OF timeline_entries FOR VALUES WITH (MODULUS 4, REMAINDER 0);
+CREATE TABLE timeline_entries_1 PARTITION OF timeline_entries FOR VALUES WITH (MODULUS 4, REMAINDER 1);
+CREATE TABLE timeline_entries_2 PARTITION OF timeline_entries FOR VALUES WITH (MODULUS 4, REMAINDER 2);
+CREATE TABLE timeline_entries_3 PARTITION OF timeline_entries FOR VALUES WITH (MODULUS 4, REMAINDER 3);
+CREATE INDEX idx_timeline_entries_order ON timeline_entries (user_id, created_at DESC, post_id DESC);
+-- Remoção de um post de todas as timelines
+CREATE INDEX idx_timeline_entries_post ON timeline_entries (post_id);
+
+-- Autores com seguidores demais para o fan-out na escrita
+CREATE TABLE timeline_celebrities (
+    author_id INTEGER PRIMARY KEY,
+    FOREIGN KEY (author_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Fila de jobs executados pelo worker (src/worker.py)
+
+CREATE TYPE job_status AS ENUM (
+    'pending',
+    'running',
+    'done',
+    'failed'
+);
+
+CREATE TABLE jobs (
+    job_id BIGSERIAL PRIMARY KEY,
+    type VARCHAR(64) NOT NULL,
+    payload JSONB NOT NULL DEFAULT '{}',
+    idempotency_key TEXT,
+    status job_status NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT jobs_chk_attempts CHECK (attempts >= 0 AND max_attempts > 0)
+);
+ALTER TABLE jobs SET (fillfactor = 70);
+-- Só pode existir um job pendente por chave de idempotência
+CREATE UNIQUE INDEX idx_jobs_idempotency_key ON jobs (idempotency_key) WHERE status = 'pending';
+-- Busca dos próximos jobs de cada tipo pelo worker
+CREATE INDEX idx_jobs_pending ON jobs (type, run_at) WHERE status = 'pending';
+CREATE INDEX idx_jobs_running ON jobs (type, locked_at) WHERE status = 'running';
+-- Jobs com a mesma chave de idempotência nunca rodam ao mesmo tempo
+CREATE INDEX idx_jobs_running_key ON jobs (idempotency_key) WHERE status = 'running';
+CREATE INDEX idx_jobs_done ON jobs (updated_at) WHERE status = 'done';
+
 -------------------------------------------------------------------------------
 -----------------------------FUNCTIONS AND TRIGGERS----------------------------
 -------------------------------------------------------------------------------
 
 CREATE OR REPLACE FUNCTION get_post_metrics(target_post_id INT)
 RETURNS JSONB AS $$
-WITH base_metrics AS (
-    SELECT COALESCE(
-        jsonb_object_agg(m::text, COALESCE(pm.counter, 0)),
-        '{}'::jsonb
-    ) AS metrics
-    FROM unnest(enum_range(NULL::metric_type)) AS m
-    LEFT JOIN post_metrics pm 
-        ON pm.post_id = target_post_id 
-       AND pm.type = m
-)
-SELECT metrics || jsonb_build_object(
-    'comments', (SELECT COUNT(*) FROM comments WHERE post_id = target_post_id),
-    'likes',    (SELECT COUNT(*) FROM post_likes WHERE post_id = target_post_id)
-)
-FROM base_metrics;
+SELECT COALESCE(
+    (
+        SELECT jsonb_build_object(
+            'impressions', pc.impressions,
+            'views', pc.views,
+            'comments', pc.comments,
+            'likes', pc.likes
+        )
+        FROM post_counters pc
+        WHERE pc.post_id = target_post_id
+    ),
+    jsonb_build_object('impressions', 0, 'views', 0, 'comments', 0, 'likes', 0)
+);
 $$ LANGUAGE sql STABLE;
 
 -------------------------------------------------------------------------------
@@ -395,23 +566,55 @@ $$ LANGUAGE sql STABLE;
 
 CREATE OR REPLACE FUNCTION get_comment_metrics(target_comment_id INT)
 RETURNS JSONB AS $$
-WITH base_metrics AS (
-    SELECT COALESCE(
-        jsonb_object_agg(m::text, COALESCE(cm.counter, 0)),
-        '{}'::jsonb
-    ) AS metrics
-    FROM unnest(enum_range(NULL::metric_type)) AS m
-    LEFT JOIN comment_metrics cm 
-        ON cm.comment_id = target_comment_id 
-       AND cm.type = m
-)
-SELECT metrics || jsonb_build_object(
-    'comments', (SELECT COUNT(*) FROM comments WHERE parent_comment_id = target_comment_id),
-    'likes',    (SELECT COUNT(*) FROM comment_likes WHERE comment_id = target_comment_id)
-)
-FROM base_metrics;
+SELECT COALESCE(
+    (
+        SELECT jsonb_build_object(
+            'impressions', cc.impressions,
+            'views', cc.views,
+            'comments', cc.comments,
+            'likes', cc.likes
+        )
+        FROM comment_counters cc
+        WHERE cc.comment_id = target_comment_id
+    ),
+    jsonb_build_object('impressions', 0, 'views', 0, 'comments', 0, 'likes', 0)
+);
 $$ LANGUAGE sql STABLE;
 
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Busca textual de posts
+-- Cada post é indexado com a configuração do seu idioma (posts.language) e a
+-- consulta é montada nas mesmas configurações, então um único índice GIN
+-- atende posts de qualquer idioma. Título tem peso maior que o conteúdo.
+
+CREATE OR REPLACE FUNCTION post_search_config(language VARCHAR)
+RETURNS regconfig AS $$
+SELECT CASE split_part(language, '-', 1)
+    WHEN 'pt' THEN 'portuguese'::regconfig
+    WHEN 'en' THEN 'english'::regconfig
+    ELSE 'simple'::regconfig
+END;
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION post_search_vector(language VARCHAR, title VARCHAR, content TEXT)
+RETURNS tsvector AS $$
+SELECT
+    setweight(to_tsvector(post_search_config(language), COALESCE(title, '')), 'A') ||
+    setweight(to_tsvector(post_search_config(language), COALESCE(content, '')), 'B');
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION post_search_query(query TEXT)
+RETURNS tsquery AS $$
+SELECT
+    websearch_to_tsquery('portuguese', query) ||
+    websearch_to_tsquery('english', query) ||
+    websearch_to_tsquery('simple', query);
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Consultas devem usar exatamente esta expressão para o índice ser escolhido
+CREATE INDEX idx_posts_search ON posts USING GIN (post_search_vector(language, title, content));
+
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
 -- Atualiza o campo path da tabela comments (hierarquia de comentários)
@@ -529,6 +732,32 @@ FOR EACH ROW
 WHEN (NEW.parent_comment_id IS NOT NULL)
 EXECUTE FUNCTION ensure_same_post();
 
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Hashtags mais usadas nos últimos day_interval dias, da mais usada para a menos
+-- Usada por /metrics/trending/hashtags e pelo pool de trending do /feed/for_you
+
+CREATE OR REPLACE FUNCTION trending_hashtags(day_interval INTEGER, max_hashtags INTEGER DEFAULT NULL)
+RETURNS TABLE (hashtag_id INTEGER, name CITEXT, count BIGINT) AS $$
+    SELECT
+        h.hashtag_id,
+        h.name,
+        COUNT(*) AS count
+    FROM
+        post_hashtags ph
+    INNER JOIN
+        hashtags h ON h.hashtag_id = ph.hashtag_id
+    WHERE
+        ph.created_at >= CURRENT_TIMESTAMP - make_interval(days => day_interval)
+    GROUP BY
+        h.hashtag_id,
+        h.name
+    ORDER BY
+        COUNT(*) DESC,
+        h.hashtag_id
+    LIMIT max_hashtags;
+$$ LANGUAGE sql STABLE;
+
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
 -- Mantem o histórico de posts vistos por cada usuário em até 40 posts
@@ -557,40 +786,30 @@ $$ LANGUAGE plpgsql;
 
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
--- Verifica se o usuário está dando like em um comentário
---  1. Que existe
---  2. Que pertence a postagem correta
+-- Mantem cada timeline materializada em até max_entries posts
+-- Função para ser executada todos os dias as 3:00 de manhã via cron
 
-CREATE OR REPLACE FUNCTION validate_comment_likes()
-RETURNS TRIGGER AS $$
-DECLARE
-    comment_post_id INTEGER;
+CREATE OR REPLACE FUNCTION prune_timeline_entries(max_entries INTEGER DEFAULT 800)
+RETURNS VOID AS $$
 BEGIN
-    -- Recupera o post_id do comentário referenciado
-    SELECT post_id 
-      INTO comment_post_id 
-      FROM comments 
-     WHERE comment_id = NEW.comment_id;
-
-    -- Verifica se o comentário existe; caso não exista, gera uma exceção
-    IF NOT FOUND THEN
-        RAISE EXCEPTION 'O comentário com ID % não existe.', NEW.comment_id;
-    END IF;
-
-    -- Verifica se o post_id do comentário é igual ao post_id da linha em comment_likes
-    IF comment_post_id <> NEW.post_id THEN
-        RAISE EXCEPTION 'O comentário com ID % não pertence ao post com ID %.', NEW.comment_id, NEW.post_id;
-    END IF;
-
-    RETURN NEW;
+    WITH ranked AS (
+        SELECT
+            user_id,
+            post_id,
+            row_number() OVER (PARTITION BY user_id ORDER BY created_at DESC, post_id DESC) AS rn
+        FROM timeline_entries
+    )
+    DELETE FROM
+        timeline_entries te
+    USING
+        ranked r
+    WHERE
+        te.user_id = r.user_id AND
+        te.post_id = r.post_id AND
+        r.rn > max_entries;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER trg_validate_comment_likes
-BEFORE INSERT OR UPDATE ON comment_likes
-FOR EACH ROW
-EXECUTE FUNCTION validate_comment_likes();
-
 -------------------------------------------------------------------------------
 -------------------------------------------------------------------------------
 -- Verifica se o usuário que está enviando a mensagem
@@ -716,3 +935,731 @@ CREATE TRIGGER trg_unfollow_on_block
 AFTER INSERT ON blocks
 FOR EACH ROW
 EXECUTE FUNCTION unfollow_on_block();
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Mantém a tabela post_counters atualizada
+--  1. Cria a linha de contadores quando um post é criado
+--  2. Aplica os deltas de likes e comentários agregados por statement
+--  3. Espelha impressions/views gravados em post_metrics
+
+CREATE OR REPLACE FUNCTION create_post_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO post_counters (post_id)
+    VALUES (NEW.post_id)
+    ON CONFLICT (post_id) DO NOTHING;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_create_post_counters
+AFTER INSERT ON posts
+FOR EACH ROW
+EXECUTE FUNCTION create_post_counters();
+
+
+CREATE OR REPLACE FUNCTION increment_post_likes_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO post_counters (post_id, likes)
+    SELECT post_id, COUNT(*)
+      FROM new_rows
+     GROUP BY post_id
+     ORDER BY post_id
+    ON CONFLICT (post_id) DO UPDATE SET
+        likes = post_counters.likes + EXCLUDED.likes,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_increment_post_likes_counter
+AFTER INSERT ON post_likes
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION increment_post_likes_counter();
+
+
+CREATE OR REPLACE FUNCTION decrement_post_likes_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE post_counters pc SET
+        likes = GREATEST(pc.likes - d.total, 0),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT post_id, COUNT(*) AS total
+          FROM old_rows
+         GROUP BY post_id
+    ) d
+    WHERE pc.post_id = d.post_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_decrement_post_likes_counter
+AFTER DELETE ON post_likes
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION decrement_post_likes_counter();
+
+
+CREATE OR REPLACE FUNCTION increment_post_comments_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO post_counters (post_id, comments)
+    SELECT post_id, COUNT(*)
+      FROM new_rows
+     GROUP BY post_id
+     ORDER BY post_id
+    ON CONFLICT (post_id) DO UPDATE SET
+        comments = post_counters.comments + EXCLUDED.comments,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_increment_post_comments_counter
+AFTER INSERT ON comments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION increment_post_comments_counter();
+
+
+CREATE OR REPLACE FUNCTION decrement_post_comments_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE post_counters pc SET
+        comments = GREATEST(pc.comments - d.total, 0),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT post_id, COUNT(*) AS total
+          FROM old_rows
+         GROUP BY post_id
+    ) d
+    WHERE pc.post_id = d.post_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_decrement_post_comments_counter
+AFTER DELETE ON comments
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION decrement_post_comments_counter();
+
+
+CREATE OR REPLACE FUNCTION sync_post_metric_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO post_counters (post_id, impressions, views)
+    VALUES (
+        NEW.post_id,
+        CASE WHEN NEW.type = 'impressions' THEN NEW.counter ELSE 0 END,
+        CASE WHEN NEW.type = 'views' THEN NEW.counter ELSE 0 END
+    )
+    ON CONFLICT (post_id) DO UPDATE SET
+        impressions = CASE WHEN NEW.type = 'impressions' THEN NEW.counter ELSE post_counters.impressions END,
+        views = CASE WHEN NEW.type = 'views' THEN NEW.counter ELSE post_counters.views END,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_sync_post_metric_counter
+AFTER INSERT OR UPDATE OF counter ON post_metrics
+FOR EACH ROW
+EXECUTE FUNCTION sync_post_metric_counter();
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Recalcula post_counters a partir das tabelas de origem e corrige divergências
+-- Função para ser executada todos os dias as 4:00 de manhã via cron
+-- Retorna o número de posts corrigidos
+
+CREATE OR REPLACE FUNCTION reconcile_post_counters()
+RETURNS INTEGER AS $$
+DECLARE
+    fixed INTEGER;
+BEGIN
+    WITH actual AS (
+        SELECT
+            p.post_id,
+            COALESCE(l.total, 0) AS likes,
+            COALESCE(c.total, 0) AS comments,
+            COALESCE(i.counter, 0) AS impressions,
+            COALESCE(v.counter, 0) AS views
+        FROM posts p
+        LEFT JOIN (
+            SELECT post_id, COUNT(*) AS total FROM post_likes GROUP BY post_id
+        ) l ON l.post_id = p.post_id
+        LEFT JOIN (
+            SELECT post_id, COUNT(*) AS total FROM comments GROUP BY post_id
+        ) c ON c.post_id = p.post_id
+        LEFT JOIN post_metrics i ON i.post_id = p.post_id AND i.type = 'impressions'
+        LEFT JOIN post_metrics v ON v.post_id = p.post_id AND v.type = 'views'
+    ),
+    upserted AS (
+        INSERT INTO post_counters AS pc
+            (post_id, likes, comments, impressions, views)
+        SELECT post_id, likes, comments, impressions, views
+          FROM actual
+        ON CONFLICT (post_id) DO UPDATE SET
+            likes = EXCLUDED.likes,
+            comments = EXCLUDED.comments,
+            impressions = EXCLUDED.impressions,
+            views = EXCLUDED.views,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE
+            (pc.likes, pc.comments, pc.impressions, pc.views) IS DISTINCT FROM
+            (EXCLUDED.likes, EXCLUDED.comments, EXCLUDED.impressions, EXCLUDED.views)
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO fixed FROM upserted;
+
+    RETURN fixed;
+END;
+$$ LANGUAGE plpgsql;
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Mantém a tabela user_counters atualizada
+--  1. Cria a linha de contadores quando um usuário é criado
+--  2. Aplica os deltas de posts agregados por statement
+--  3. Aplica os deltas de followers/following agregados por statement
+--     (inclui os follows removidos por unfollow_on_block)
+-- As linhas são atualizadas em ordem de user_id para evitar deadlocks
+
+CREATE OR REPLACE FUNCTION create_user_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_counters (user_id)
+    VALUES (NEW.user_id)
+    ON CONFLICT (user_id) DO NOTHING;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_create_user_counters
+AFTER INSERT ON users
+FOR EACH ROW
+EXECUTE FUNCTION create_user_counters();
+
+
+CREATE OR REPLACE FUNCTION increment_user_posts_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_counters (user_id, posts)
+    SELECT user_id, COUNT(*)
+      FROM new_rows
+     GROUP BY user_id
+     ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        posts = user_counters.posts + EXCLUDED.posts,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_increment_user_posts_counter
+AFTER INSERT ON posts
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION increment_user_posts_counter();
+
+
+CREATE OR REPLACE FUNCTION decrement_user_posts_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE user_counters uc SET
+        posts = GREATEST(uc.posts - d.total, 0),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT user_id, COUNT(*) AS total
+          FROM old_rows
+         GROUP BY user_id
+    ) d
+    WHERE uc.user_id = d.user_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_decrement_user_posts_counter
+AFTER DELETE ON posts
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION decrement_user_posts_counter();
+
+
+CREATE OR REPLACE FUNCTION increment_user_follows_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_counters (user_id, followers, following)
+    SELECT user_id, SUM(followers), SUM(following)
+      FROM (
+            SELECT followed_id AS user_id, 1 AS followers, 0 AS following FROM new_rows
+            UNION ALL
+            SELECT follower_id AS user_id, 0 AS followers, 1 AS following FROM new_rows
+      ) d
+     GROUP BY user_id
+     ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        followers = user_counters.followers + EXCLUDED.followers,
+        following = user_counters.following + EXCLUDED.following,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_increment_user_follows_counters
+AFTER INSERT ON follows
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION increment_user_follows_counters();
+
+
+CREATE OR REPLACE FUNCTION decrement_user_follows_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE user_counters uc SET
+        followers = GREATEST(uc.followers - d.followers, 0),
+        following = GREATEST(uc.following - d.following, 0),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT user_id, SUM(followers) AS followers, SUM(following) AS following
+          FROM (
+                SELECT followed_id AS user_id, 1 AS followers, 0 AS following FROM old_rows
+                UNION ALL
+                SELECT follower_id AS user_id, 0 AS followers, 1 AS following FROM old_rows
+          ) u
+         GROUP BY user_id
+         ORDER BY user_id
+    ) d
+    WHERE uc.user_id = d.user_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_decrement_user_follows_counters
+AFTER DELETE ON follows
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION decrement_user_follows_counters();
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Recalcula user_counters a partir das tabelas de origem e corrige divergências
+-- Função para ser executada todos os dias as 4:00 de manhã via cron
+-- Retorna o número de usuários corrigidos
+
+CREATE OR REPLACE FUNCTION reconcile_user_counters()
+RETURNS INTEGER AS $$
+DECLARE
+    fixed INTEGER;
+BEGIN
+    WITH actual AS (
+        SELECT
+            u.user_id,
+            COALESCE(p.total, 0) AS posts,
+            COALESCE(fr.total, 0) AS followers,
+            COALESCE(fg.total, 0) AS following
+        FROM users u
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) AS total FROM posts GROUP BY user_id
+        ) p ON p.user_id = u.user_id
+        LEFT JOIN (
+            SELECT followed_id, COUNT(*) AS total FROM follows GROUP BY followed_id
+        ) fr ON fr.followed_id = u.user_id
+        LEFT JOIN (
+            SELECT follower_id, COUNT(*) AS total FROM follows GROUP BY follower_id
+        ) fg ON fg.follower_id = u.user_id
+    ),
+    upserted AS (
+        INSERT INTO user_counters AS uc
+            (user_id, posts, followers, following)
+        SELECT user_id, posts, followers, following
+          FROM actual
+         ORDER BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            posts = EXCLUDED.posts,
+            followers = EXCLUDED.followers,
+            following = EXCLUDED.following,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE
+            (uc.posts, uc.followers, uc.following) IS DISTINCT FROM
+            (EXCLUDED.posts, EXCLUDED.followers, EXCLUDED.following)
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO fixed FROM upserted;
+
+    RETURN fixed;
+END;
+$$ LANGUAGE plpgsql;
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Mantém a tabela comment_counters atualizada
+--  1. Cria a linha de contadores quando um comentário é criado
+--  2. Aplica os deltas de likes e respostas agregados por statement
+--  3. Espelha impressions/views gravados em comment_metrics
+
+CREATE OR REPLACE FUNCTION create_comment_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO comment_counters (comment_id)
+    VALUES (NEW.comment_id)
+    ON CONFLICT (comment_id) DO NOTHING;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_create_comment_counters
+AFTER INSERT ON comments
+FOR EACH ROW
+EXECUTE FUNCTION create_comment_counters();
+
+
+CREATE OR REPLACE FUNCTION increment_comment_likes_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO comment_counters (comment_id, likes)
+    SELECT comment_id, COUNT(*)
+      FROM new_rows
+     GROUP BY comment_id
+     ORDER BY comment_id
+    ON CONFLICT (comment_id) DO UPDATE SET
+        likes = comment_counters.likes + EXCLUDED.likes,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_increment_comment_likes_counter
+AFTER INSERT ON comment_likes
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION increment_comment_likes_counter();
+
+
+CREATE OR REPLACE FUNCTION decrement_comment_likes_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE comment_counters cc SET
+        likes = GREATEST(cc.likes - d.total, 0),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT comment_id, COUNT(*) AS total
+          FROM old_rows
+         GROUP BY comment_id
+    ) d
+    WHERE cc.comment_id = d.comment_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_decrement_comment_likes_counter
+AFTER DELETE ON comment_likes
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION decrement_comment_likes_counter();
+
+
+CREATE OR REPLACE FUNCTION increment_comment_replies_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO comment_counters (comment_id, comments)
+    SELECT parent_comment_id, COUNT(*)
+      FROM new_rows
+     WHERE parent_comment_id IS NOT NULL
+     GROUP BY parent_comment_id
+     ORDER BY parent_comment_id
+    ON CONFLICT (comment_id) DO UPDATE SET
+        comments = comment_counters.comments + EXCLUDED.comments,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_increment_comment_replies_counter
+AFTER INSERT ON comments
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION increment_comment_replies_counter();
+
+
+CREATE OR REPLACE FUNCTION decrement_comment_replies_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Pais removidos no mesmo statement já não têm linha para atualizar
+    UPDATE comment_counters cc SET
+        comments = GREATEST(cc.comments - d.total, 0),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT parent_comment_id, COUNT(*) AS total
+          FROM old_rows
+         WHERE parent_comment_id IS NOT NULL
+         GROUP BY parent_comment_id
+    ) d
+    WHERE cc.comment_id = d.parent_comment_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_decrement_comment_replies_counter
+AFTER DELETE ON comments
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION decrement_comment_replies_counter();
+
+
+CREATE OR REPLACE FUNCTION sync_comment_metric_counter()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO comment_counters (comment_id, impressions, views)
+    VALUES (
+        NEW.comment_id,
+        CASE WHEN NEW.type = 'impressions' THEN NEW.counter ELSE 0 END,
+        CASE WHEN NEW.type = 'views' THEN NEW.counter ELSE 0 END
+    )
+    ON CONFLICT (comment_id) DO UPDATE SET
+        impressions = CASE WHEN NEW.type = 'impressions' THEN NEW.counter ELSE comment_counters.impressions END,
+        views = CASE WHEN NEW.type = 'views' THEN NEW.counter ELSE comment_counters.views END,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_sync_comment_metric_counter
+AFTER INSERT OR UPDATE OF counter ON comment_metrics
+FOR EACH ROW
+EXECUTE FUNCTION sync_comment_metric_counter();
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Recalcula comment_counters a partir das tabelas de origem e corrige divergências
+-- Função para ser executada todos os dias as 4:00 de manhã via cron
+-- Retorna o número de comentários corrigidos
+
+CREATE OR REPLACE FUNCTION reconcile_comment_counters()
+RETURNS INTEGER AS $$
+DECLARE
+    fixed INTEGER;
+BEGIN
+    WITH actual AS (
+        SELECT
+            c.comment_id,
+            COALESCE(l.total, 0) AS likes,
+            COALESCE(r.total, 0) AS comments,
+            COALESCE(i.counter, 0) AS impressions,
+            COALESCE(v.counter, 0) AS views
+        FROM comments c
+        LEFT JOIN (
+            SELECT comment_id, COUNT(*) AS total FROM comment_likes GROUP BY comment_id
+        ) l ON l.comment_id = c.comment_id
+        LEFT JOIN (
+            SELECT parent_comment_id, COUNT(*) AS total FROM comments GROUP BY parent_comment_id
+        ) r ON r.parent_comment_id = c.comment_id
+        LEFT JOIN comment_metrics i ON i.comment_id = c.comment_id AND i.type = 'impressions'
+        LEFT JOIN comment_metrics v ON v.comment_id = c.comment_id AND v.type = 'views'
+    ),
+    upserted AS (
+        INSERT INTO comment_counters AS cc
+            (comment_id, likes, comments, impressions, views)
+        SELECT comment_id, likes, comments, impressions, views
+          FROM actual
+         ORDER BY comment_id
+        ON CONFLICT (comment_id) DO UPDATE SET
+            likes = EXCLUDED.likes,
+            comments = EXCLUDED.comments,
+            impressions = EXCLUDED.impressions,
+            views = EXCLUDED.views,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE
+            (cc.likes, cc.comments, cc.impressions, cc.views) IS DISTINCT FROM
+            (EXCLUDED.likes, EXCLUDED.comments, EXCLUDED.impressions, EXCLUDED.views)
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO fixed FROM upserted;
+
+    RETURN fixed;
+END;
+$$ LANGUAGE plpgsql;
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Mantém direct_conversation_members.unread_count atualizado
+--  1. Cria as linhas dos dois participantes quando a conversa é criada
+--  2. Mensagens novas não lidas contam para o destinatário
+--  3. Mudanças de is_read (leitura ou edição) aplicam o delta
+--  4. Mensagens não lidas removidas deixam de contar
+-- O destinatário é sempre o participante que não enviou a mensagem
+
+CREATE OR REPLACE FUNCTION create_direct_conversation_members()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO direct_conversation_members (conversation_id, user_id)
+    VALUES (NEW.conversation_id, NEW.user1_id), (NEW.conversation_id, NEW.user2_id)
+    ON CONFLICT (conversation_id, user_id) DO NOTHING;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_create_direct_conversation_members
+AFTER INSERT ON direct_conversations
+FOR EACH ROW
+EXECUTE FUNCTION create_direct_conversation_members();
+
+
+CREATE OR REPLACE FUNCTION increment_unread_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO direct_conversation_members AS cm (conversation_id, user_id, unread_count)
+    SELECT
+        n.conversation_id,
+        CASE WHEN n.sender_id = dc.user1_id THEN dc.user2_id ELSE dc.user1_id END,
+        COUNT(*)
+      FROM new_rows n
+      JOIN direct_conversations dc ON dc.conversation_id = n.conversation_id
+     WHERE n.is_read IS NOT TRUE
+     GROUP BY 1, 2
+     ORDER BY 1, 2
+    ON CONFLICT (conversation_id, user_id) DO UPDATE SET
+        unread_count = cm.unread_count + EXCLUDED.unread_count,
+        updated_at = CURRENT_TIMESTAMP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_increment_unread_counters
+AFTER INSERT ON messages
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION increment_unread_counters();
+
+
+CREATE OR REPLACE FUNCTION update_unread_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE direct_conversation_members cm SET
+        unread_count = GREATEST(cm.unread_count + d.delta, 0),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT
+            n.conversation_id,
+            CASE WHEN n.sender_id = dc.user1_id THEN dc.user2_id ELSE dc.user1_id END AS user_id,
+            SUM(CASE WHEN n.is_read IS TRUE THEN -1 ELSE 1 END) AS delta
+          FROM new_rows n
+          JOIN old_rows o ON o.message_id = n.message_id
+          JOIN direct_conversations dc ON dc.conversation_id = n.conversation_id
+         WHERE (n.is_read IS TRUE) <> (o.is_read IS TRUE)
+         GROUP BY 1, 2
+    ) d
+    WHERE cm.conversation_id = d.conversation_id
+      AND cm.user_id = d.user_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables não podem ser usadas com UPDATE OF, o filtro de is_read fica na função
+CREATE TRIGGER trg_update_unread_counters
+AFTER UPDATE ON messages
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION update_unread_counters();
+
+
+CREATE OR REPLACE FUNCTION decrement_unread_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE direct_conversation_members cm SET
+        unread_count = GREATEST(cm.unread_count - d.total, 0),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT
+            o.conversation_id,
+            CASE WHEN o.sender_id = dc.user1_id THEN dc.user2_id ELSE dc.user1_id END AS user_id,
+            COUNT(*) AS total
+          FROM old_rows o
+          JOIN direct_conversations dc ON dc.conversation_id = o.conversation_id
+         WHERE o.is_read IS NOT TRUE
+         GROUP BY 1, 2
+    ) d
+    WHERE cm.conversation_id = d.conversation_id
+      AND cm.user_id = d.user_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_decrement_unread_counters
+AFTER DELETE ON messages
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION decrement_unread_counters();
+
+-------------------------------------------------------------------------------
+-------------------------------------------------------------------------------
+-- Recalcula direct_conversation_members a partir de messages e corrige divergências
+-- Função para ser executada todos os dias as 4:00 de manhã via cron
+-- Retorna o número de participantes corrigidos
+
+CREATE OR REPLACE FUNCTION reconcile_unread_counters()
+RETURNS INTEGER AS $$
+DECLARE
+    fixed INTEGER;
+BEGIN
+    WITH members AS (
+        SELECT conversation_id, user1_id AS user_id FROM direct_conversations
+        UNION ALL
+        SELECT conversation_id, user2_id AS user_id FROM direct_conversations
+    ),
+    actual AS (
+        SELECT
+            mb.conversation_id,
+            mb.user_id,
+            COUNT(m.message_id) AS unread_count
+        FROM members mb
+        LEFT JOIN messages m ON
+            m.conversation_id = mb.conversation_id AND
+            m.sender_id <> mb.user_id AND
+            m.is_read IS NOT TRUE
+        GROUP BY mb.conversation_id, mb.user_id
+    ),
+    upserted AS (
+        INSERT INTO direct_conversation_members AS cm
+            (conversation_id, user_id, unread_count)
+        SELECT conversation_id, user_id, unread_count
+          FROM actual
+         ORDER BY conversation_id, user_id
+        ON CONFLICT (conversation_id, user_id) DO UPDATE SET
+            unread_count = EXCLUDED.unread_count,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE
+            cm.unread_count <> EXCLUDED.unread_count
+        RETURNING 1
+    )
+    SELECT COUNT(*) INTO fixed FROM upserted;
+
+    RETURN fixed;
+END;
+$$ LANGUAGE plpgsql;
@@ -12,9 +12,19 @@ from src.route.follows import follows_route
 from src.route.blocks import blocks_router
 from src.route.feed import feed_router
 from src.route.history import history_router
+from src.route.files import files_router
+from src.route.realtime import realtime_router
+from src.route.search import search_router
 from dotenv import load_dotenv
+from src import cache
 from src import database
+from src import image_processing
+from src import like_buffer
+from src import metrics_buffer
+from src import realtime
+from src import social_graph
 from src import storage
+from src import timeline
 import uvicorn
 import os
 
@@ -24,12 +34,36 @@ load_dotenv()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):    
-    database.db_open()
-    storage.create_storage(storage.CloudinaryStorage())
+    await database.db_open()
+    image_processing.create_image_processor(image_processing.ImageProcessor())
+    image_processing.get_image_processor().open()
+    # Per process: invalidations only reach this worker's cache, other workers
+    # serve their copy until its TTL (CACHE_DEFAULT_TTL) runs out
+    cache.create_cache(cache.MemoryCache())
+    await cache.get_cache().open()
+    storage.create_storage(storage.storage_from_env())
     storage.get_storage().open()
+    # TIMELINE_STORE=memory keeps timelines per process and misses the worker's fan-out
+    timeline.create_timeline_store(timeline.timeline_store_from_env())
+    await timeline.get_timeline_store().open()
+    metrics_buffer.create_metrics_buffer(metrics_buffer.MetricsBuffer())
+    await metrics_buffer.get_metrics_buffer().start()
+    like_buffer.create_like_buffer(like_buffer.LikeBuffer())
+    await like_buffer.get_like_buffer().start()
+    realtime.create_hub(realtime.Hub(realtime.broker_from_env()))
+    await realtime.get_hub().open()
+    social_graph.create_social_graph(social_graph.SocialGraph())
+    await social_graph.get_social_graph().start()
     yield
-    database.db_close()
+    await social_graph.get_social_graph().stop()
+    await realtime.get_hub().close()
+    await metrics_buffer.get_metrics_buffer().stop()
+    await like_buffer.get_like_buffer().stop()
+    await database.db_close()
     storage.get_storage().close()
+    await timeline.get_timeline_store().close()
+    await cache.get_cache().close()
+    image_processing.get_image_processor().close()
 
 
 app = FastAPI(lifespan=lifespan, version="1.0.0")
@@ -47,6 +81,9 @@ app.include_router(follows_route, prefix="/api", tags=["follows"])
 app.include_router(blocks_router, prefix="/api", tags=["blocks"])
 app.include_router(feed_router, prefix="/api", tags=["feed"])
 app.include_router(history_router, prefix="/api", tags=["history"])
+app.include_router(files_router, prefix="/api", tags=["files"])
+app.include_router(realtime_router, prefix="/api", tags=["realtime"])
+app.include_router(search_router, prefix="/api", tags=["search"])
 
 
 def main() -> None:    
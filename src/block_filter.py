@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from fastapi import status
+from src import database
+import numpy as np
+import time
+import os
+
+
+# Each viewer's hidden set is every user they blocked or were blocked by,
+# kept as a sorted int32 array. Read paths fetch their page as usual and
+# drop the hidden authors afterwards, so pages can come back short but the
+# cursors stay valid. Other processes see a new block once their entry expires.
+
+HIDDEN_TTL: float = float(os.getenv("BLOCK_FILTER_TTL", 60))
+MAX_CACHED_USERS: int = int(os.getenv("BLOCK_FILTER_MAX_USERS", 100_000))
+
+hidden_users: OrderedDict[int, tuple[float, np.ndarray]] = OrderedDict()
+
+
+async def load_hidden(user_id: int) -> np.ndarray | None:
+    r: database.DataBaseResponse = await database.db_read_one(
+        """
+            SELECT
+                COALESCE(array_agg(DISTINCT h.user_id ORDER BY h.user_id), '{}') AS hidden
+            FROM (
+                SELECT blocked_id AS user_id FROM blocks WHERE blocker_id = %s
+                UNION ALL
+                SELECT blocker_id AS user_id FROM blocks WHERE blocked_id = %s
+            ) h;
+        """,
+        (str(user_id), str(user_id))
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    return np.asarray(r.content['hidden'], dtype=np.int32)
+
+
+async def get_hidden(user_id: int) -> np.ndarray | None:
+    now: float = time.monotonic()
+    cached = hidden_users.get(user_id)
+    if cached is not None and cached[0] >= now:
+        hidden_users.move_to_end(user_id)
+        return cached[1]
+    hidden = await load_hidden(user_id)
+    if hidden is None:
+        return None
+    hidden_users[user_id] = (now + HIDDEN_TTL, hidden)
+    hidden_users.move_to_end(user_id)
+    while len(hidden_users) > MAX_CACHED_USERS:
+        hidden_users.popitem(last=False)
+    return hidden
+
+
+def invalidate(*user_ids: int) -> None:
+    for user_id in user_ids:
+        hidden_users.pop(user_id, None)
+
+
+def _visible(hidden: np.ndarray, user_id: int) -> bool:
+    i: int = int(np.searchsorted(hidden, user_id))
+    return i == len(hidden) or hidden[i] != user_id
+
+
+def _filter_comments(hidden: np.ndarray, comments: list[dict]) -> list[dict]:
+    # A hidden comment takes its replies with it
+    kept: list[dict] = [c for c in comments if _visible(hidden, c['user_id'])]
+    for comment in kept:
+        if comment.get('replies'):
+            comment['replies'] = _filter_comments(hidden, comment['replies'])
+    return kept
+
+
+async def filter_rows(viewer_id: int | None, rows: list[dict], column: str = 'user_id') -> list[dict] | None:
+    # Drops rows authored by users hidden from the viewer, including comments
+    # nested under them. Anonymous reads are not filtered
+    if viewer_id is None or not rows:
+        return rows
+    hidden: np.ndarray | None = await get_hidden(viewer_id)
+    if hidden is None:
+        return None
+    if not len(hidden):
+        return rows
+    kept: list[dict] = [row for row in rows if _visible(hidden, row[column])]
+    for row in kept:
+        if row.get('comments'):
+            row['comments'] = _filter_comments(hidden, row['comments'])
+        if row.get('replies'):
+            row['replies'] = _filter_comments(hidden, row['replies'])
+    return kept
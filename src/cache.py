@@ -0,0 +1,191 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from fastapi import status
+from src import database
+import json
+import time
+import os
+
+
+DEFAULT_TTL: float = float(os.getenv("CACHE_DEFAULT_TTL", 60))
+MAX_TOMBSTONES: int = int(os.getenv("CACHE_MAX_TOMBSTONES", 100_000))
+
+
+class CacheStats:
+
+    def __init__(self):
+        self.hits: int = 0
+        self.misses: int = 0
+        self.sets: int = 0
+        self.evictions: int = 0
+        self.invalidations: int = 0
+
+    def to_dict(self) -> dict[str, int | float]:
+        lookups: int = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "sets": self.sets,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+# Values are stored serialized, the same way a networked cache would
+# hold them, so callers always get their own copy back.
+#
+# Invalidations leave a tombstone holding the sequence number they got. A
+# read-through fill only stores its row when no invalidation of the key
+# happened after the read started, so a read racing with a write can not
+# put the pre-write row back into the cache.
+class Cache(ABC):
+
+    def __init__(self, max_tombstones: int = MAX_TOMBSTONES):
+        self.stats = CacheStats()
+        self.__max_tombstones = max_tombstones
+        self.__sequence: int = 0
+        # Tombstones evicted so far are all at or below this sequence
+        self.__evicted_sequence: int = 0
+        self.__tombstones: OrderedDict[str, int] = OrderedDict()
+
+    def begin_read(self) -> int:
+        return self.__sequence
+
+    def mark_invalidated(self, *keys: str) -> None:
+        self.__sequence += 1
+        for key in keys:
+            self.__tombstones[key] = self.__sequence
+            self.__tombstones.move_to_end(key)
+        while len(self.__tombstones) > self.__max_tombstones:
+            _, self.__evicted_sequence = self.__tombstones.popitem(last=False)
+
+    def may_fill(self, key: str, read_started: int) -> bool:
+        # A read older than the oldest evicted tombstone can not be checked
+        if read_started < self.__evicted_sequence:
+            return False
+        return self.__tombstones.get(key, 0) <= read_started
+
+    @abstractmethod
+    async def open(self) -> None:
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def get(self, key: str) -> str | None:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        pass
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None:
+        pass
+
+    @abstractmethod
+    async def size(self) -> dict[str, int]:
+        pass
+
+
+class MemoryCache(Cache):
+
+    def __init__(self, max_entries: int = 100_000, max_bytes: int = 256 * 1024 * 1024):
+        super().__init__()
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+        self.__bytes: int = 0
+        # key -> (expires_at, value), least recently used first
+        self.__entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        self.__entries.clear()
+        self.__bytes = 0
+
+    def __remove(self, key: str) -> None:
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__bytes -= len(entry[1])
+
+    async def get(self, key: str) -> str | None:
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self.__remove(key)
+            return None
+        self.__entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, value: str, ttl: float) -> None:
+        if len(value) > self.__max_bytes:
+            return
+        self.__remove(key)
+        self.__entries[key] = (time.monotonic() + ttl, value)
+        self.__bytes += len(value)
+        while len(self.__entries) > self.__max_entries or self.__bytes > self.__max_bytes:
+            _, (_, oldest_value) = self.__entries.popitem(last=False)
+            self.__bytes -= len(oldest_value)
+            self.stats.evictions += 1
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.__remove(key)
+
+    async def size(self) -> dict[str, int]:
+        return {"entries": len(self.__entries), "bytes": self.__bytes}
+
+
+cache = None
+
+
+def create_cache(new_cache: Cache) -> None:
+    global cache
+    cache = new_cache
+
+
+def get_cache() -> Cache:
+    global cache
+    return cache
+
+
+async def _read(key: str, ttl: float, read, query: str, params: tuple) -> database.DataBaseResponse:
+    c: Cache = get_cache()
+    value: str | None = await c.get(key)
+    if value is not None:
+        c.stats.hits += 1
+        return database.DataBaseResponse(content=json.loads(value))
+
+    c.stats.misses += 1
+    read_started: int = c.begin_read()
+    r: database.DataBaseResponse = await read(query, params)
+    if r.status_code == status.HTTP_200_OK and c.may_fill(key, read_started):
+        await c.set(key, json.dumps(r.content, default=str), ttl)
+        c.stats.sets += 1
+    return r
+
+
+async def db_read_one(key: str, query: str, params: tuple = None, ttl: float = DEFAULT_TTL) -> database.DataBaseResponse:
+    return await _read(key, ttl, database.db_read_one, query, params)
+
+
+async def db_read_all(key: str, query: str, params: tuple = None, ttl: float = DEFAULT_TTL) -> database.DataBaseResponse:
+    return await _read(key, ttl, database.db_read_all, query, params)
+
+
+async def invalidate(*keys: str) -> None:
+    c: Cache = get_cache()
+    c.mark_invalidated(*keys)
+    await c.delete(*keys)
+    c.stats.invalidations += len(keys)
+
+
+async def stats() -> dict[str, int | float]:
+    c: Cache = get_cache()
+    return c.stats.to_dict() | await c.size()
@@ -0,0 +1,249 @@
+from fastapi import status
+from src.models.comment import CommentProjection
+from src import database
+from src import util
+
+
+PREVIEW_SIZE: int = 3
+
+
+# Expects the comment as "c" and its comment_counters row as "cc"
+NODE_COLUMNS: str = """
+    c.comment_id,
+    c.user_id,
+    c.post_id,
+    c.content,
+    TO_CHAR(c.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
+    TO_CHAR(c.updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
+    c.parent_comment_id,
+    COALESCE(cc.likes, 0) AS likes,
+    COALESCE(cc.impressions, 0) AS impressions,
+    COALESCE(cc.views, 0) AS views,
+    COALESCE(cc.comments, 0) AS comments
+"""
+
+
+def _node(row: dict) -> dict:
+    return {
+        "comment_id": row['comment_id'],
+        "user_id": row['user_id'],
+        "content": row['content'],
+        "created_at": row['created_at'],
+        "updated_at": row['updated_at'],
+        "metrics": {
+            "impressions": row['impressions'],
+            "views": row['views'],
+            "comments": row['comments'],
+            "likes": row['likes']
+        },
+        "replies": [],
+        "parent_comment_id": row['parent_comment_id']
+    }
+
+
+def build_trees(rows: list[dict]) -> dict[int, list[dict]]:
+    # Rows must be ordered so that every parent comes before its replies
+    # (nlevel(path) ascending). Reply counts are filled in as the tree grows.
+    nodes: dict[int, dict] = {}
+    trees: dict[int, list[dict]] = {}
+    for row in rows:
+        node: dict = _node(row)
+        nodes[row['comment_id']] = node
+        if row['parent_comment_id'] is None:
+            trees.setdefault(row['post_id'], []).append(node)
+            continue
+        parent: dict | None = nodes.get(row['parent_comment_id'])
+        if parent is not None:
+            parent['replies'].append(node)
+            parent['metrics']['comments'] += 1
+    return trees
+
+
+async def read_comment_trees(post_ids: list[int]) -> dict[int, list[dict]] | None:
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                c.comment_id,
+                c.user_id,
+                c.post_id,
+                c.content,
+                TO_CHAR(c.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
+                TO_CHAR(c.updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
+                c.parent_comment_id,
+                COALESCE(cc.likes, 0) AS likes,
+                COALESCE(cc.impressions, 0) AS impressions,
+                COALESCE(cc.views, 0) AS views,
+                0 AS comments
+            FROM
+                comments c
+            LEFT JOIN
+                comment_counters cc ON cc.comment_id = c.comment_id
+            WHERE
+                c.post_id = ANY(%s::int[])
+            ORDER BY
+                nlevel(c.path),
+                c.created_at;
+        """,
+        (post_ids, )
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    return build_trees(r.content)
+
+
+async def read_comment_previews(post_ids: list[int], size: int) -> dict[int, list[dict]] | None:
+    r: database.DataBaseResponse = await database.db_read_all(
+        f"""
+            SELECT
+                {NODE_COLUMNS}
+            FROM
+                unnest(%s::int[]) AS t(post_id)
+            CROSS JOIN LATERAL (
+                SELECT
+                    *
+                FROM
+                    comments
+                WHERE
+                    post_id = t.post_id AND
+                    parent_comment_id IS NULL
+                ORDER BY
+                    created_at DESC
+                LIMIT %s
+            ) c
+            LEFT JOIN
+                comment_counters cc ON cc.comment_id = c.comment_id
+            ORDER BY
+                c.created_at;
+        """,
+        (post_ids, size)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    return build_trees(r.content)
+
+
+def build_thread(roots: list[dict], descendants: list[dict]) -> list[dict]:
+    # descendants must be ordered by nlevel(path); replies whose parent was
+    # cut by the per-level limit are dropped
+    nodes: dict[int, dict] = {}
+    thread: list[dict] = []
+    for row in roots:
+        node: dict = _node(row)
+        nodes[row['comment_id']] = node
+        thread.append(node)
+    for row in descendants:
+        parent: dict | None = nodes.get(row['parent_comment_id'])
+        if parent is None:
+            continue
+        node: dict = _node(row)
+        nodes[row['comment_id']] = node
+        parent['replies'].append(node)
+    for node in nodes.values():
+        node['more_replies'] = max(node['metrics']['comments'] - len(node['replies']), 0)
+    return thread
+
+
+async def read_thread(
+    post_id: int,
+    parent_comment_id: int | None,
+    position: tuple,
+    limit: int,
+    max_depth: int,
+    replies: int
+) -> tuple[list[dict], str | None] | None:
+    if parent_comment_id is None:
+        level_filter, params = "c.parent_comment_id IS NULL", (str(post_id), )
+    else:
+        level_filter, params = "c.parent_comment_id = %s", (str(post_id), str(parent_comment_id))
+
+    r: database.DataBaseResponse = await database.db_read_all(
+        f"""
+            SELECT
+                {NODE_COLUMNS},
+                c.path::text AS path,
+                c.created_at AS cursor_created_at
+            FROM (
+                SELECT
+                    *
+                FROM
+                    comments c
+                WHERE
+                    c.post_id = %s AND
+                    {level_filter} AND
+                    (c.created_at, c.comment_id) > (%s::timestamptz, %s)
+                ORDER BY
+                    c.created_at,
+                    c.comment_id
+                LIMIT %s
+            ) c
+            LEFT JOIN
+                comment_counters cc ON cc.comment_id = c.comment_id
+            ORDER BY
+                c.created_at,
+                c.comment_id;
+        """,
+        params + (position[0], position[1], limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    roots, next_cursor = util.paginate(r.content, limit, "cursor_created_at", "comment_id")
+
+    descendants: list[dict] = []
+    if roots and max_depth > 1 and replies > 0:
+        # root.path.*{1,n} matches the replies at most n levels below root
+        lqueries: list[str] = [f"{row['path']}.*{{1,{max_depth - 1}}}" for row in roots]
+        d: database.DataBaseResponse = await database.db_read_all(
+            f"""
+                SELECT
+                    {NODE_COLUMNS}
+                FROM (
+                    SELECT
+                        *
+                    FROM (
+                        SELECT
+                            c.*,
+                            row_number() OVER (
+                                PARTITION BY c.parent_comment_id
+                                ORDER BY c.created_at, c.comment_id
+                            ) AS rn
+                        FROM
+                            comments c
+                        WHERE
+                            c.path ? %s::lquery[]
+                    ) ranked
+                    WHERE
+                        ranked.rn <= %s
+                ) c
+                LEFT JOIN
+                    comment_counters cc ON cc.comment_id = c.comment_id
+                ORDER BY
+                    nlevel(c.path),
+                    c.created_at,
+                    c.comment_id;
+            """,
+            (lqueries, replies)
+        )
+        if d.status_code != status.HTTP_200_OK:
+            return None
+        descendants = d.content
+
+    return build_thread(roots, descendants), next_cursor
+
+
+async def attach_comments(
+    posts: list[dict],
+    projection: CommentProjection,
+    preview_size: int = PREVIEW_SIZE
+) -> bool:
+    # Fills the "comments" field of every post row in place
+    trees: dict[int, list[dict]] | None = {}
+    post_ids: list[int] = [p['post_id'] for p in posts]
+    if post_ids and projection == CommentProjection.full:
+        trees = await read_comment_trees(post_ids)
+    elif post_ids and projection == CommentProjection.preview:
+        trees = await read_comment_previews(post_ids, preview_size)
+    if trees is None:
+        return False
+    for post in posts:
+        post['comments'] = trees.get(post['post_id'], [])
+    return True
@@ -1,6 +1,6 @@
 from fastapi import status
 from fastapi.responses import JSONResponse, Response
-from psycopg_pool import ConnectionPool
+from psycopg_pool import AsyncConnectionPool
 from psycopg.rows import dict_row
 from dotenv import load_dotenv
 import psycopg
@@ -30,38 +30,38 @@ class DataBaseResponse:
         )
     
 
-pool = ConnectionPool(
+pool = AsyncConnectionPool(
     conninfo=f"dbname={os.getenv('DB_NAME')} user={os.getenv('DB_USER')} password={os.getenv('DB_PASSWORD')}",
-    min_size=1,
-    max_size=10,
+    min_size=int(os.getenv("DB_POOL_MIN_SIZE", 4)),
+    max_size=int(os.getenv("DB_POOL_MAX_SIZE", 32)),
     timeout=30,
     open=False    
 )
 
 
-def db_get_pool() -> ConnectionPool:
+def db_get_pool() -> AsyncConnectionPool:
     global pool
     return pool
         
         
-def db_open() -> None:
+async def db_open() -> None:
     global pool
-    pool.open()
+    await pool.open()
 
 
-def db_close() -> None:
+async def db_close() -> None:
     global pool
-    pool.close()
+    await pool.close()
 
 
-def db_read_one(query: str, params: tuple[str] = None) -> DataBaseResponse:
+async def db_read_one(query: str, params: tuple[str] = None) -> DataBaseResponse:
     global pool
-    with pool.connection() as conn:        
-        with conn.cursor() as cur:            
+    async with pool.connection() as conn:        
+        async with conn.cursor() as cur:            
             cur.row_factory = dict_row
             try:                
-                cur.execute(query, params)
-                r = cur.fetchone()
+                await cur.execute(query, params)
+                r = await cur.fetchone()
                 if r is None:
                     return DataBaseResponse(status.HTTP_404_NOT_FOUND)
                 return DataBaseResponse(content=r)
@@ -69,14 +69,14 @@ def db_read_one(query: str, params: tuple[str] = None) -> DataBaseResponse:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
                 return DataBaseResponse(status.HTTP_500_INTERNAL_SERVER_ERROR)
             
-def db_read_all(query: str, params: tuple[str] = None) -> DataBaseResponse:
+async def db_read_all(query: str, params: tuple[str] = None) -> DataBaseResponse:
     global pool
-    with pool.connection() as conn:        
-        with conn.cursor() as cur:            
+    async with pool.connection() as conn:        
+        async with conn.cursor() as cur:            
             cur.row_factory = dict_row
             try:                
-                cur.execute(query, params)
-                r = cur.fetchall()
+                await cur.execute(query, params)
+                r = await cur.fetchall()
                 if r is None:
                     return DataBaseResponse(status.HTTP_404_NOT_FOUND)
                 return DataBaseResponse(content=r)
@@ -85,74 +85,106 @@ def db_read_all(query: str, params: tuple[str] = None) -> DataBaseResponse:
                 return DataBaseResponse(status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-def db_create(query: str, params: tuple[str] = None) -> DataBaseResponse:
+async def db_create(query: str, params: tuple[str] = None) -> DataBaseResponse:
     global pool
-    with pool.connection() as conn:        
-        with conn.cursor() as cur:
+    async with pool.connection() as conn:        
+        async with conn.cursor() as cur:
             cur.row_factory = dict_row
             try:
-                cur.execute(query, params)
-                r = cur.fetchone()
-                conn.commit()
+                await cur.execute(query, params)
+                r = await cur.fetchone()
+                await conn.commit()
                 return DataBaseResponse(status.HTTP_201_CREATED, r)
             except psycopg.errors.UniqueViolation as e:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status_code=status.HTTP_409_CONFLICT)
             except psycopg.errors.CheckViolation as e:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status_code=status.HTTP_400_BAD_REQUEST)
             except psycopg.errors.RaiseException as e:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status_code=status.HTTP_400_BAD_REQUEST)
             except psycopg.errors.ForeignKeyViolation as e:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status_code=status.HTTP_404_NOT_FOUND)
             except Exception as e:
                 print(type(e))
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-def db_update(query: str, params: tuple[str] = None) -> DataBaseResponse:
-    with pool.connection() as conn:        
-        with conn.cursor() as cur:
+async def db_update(query: str, params: tuple[str] = None) -> DataBaseResponse:
+    async with pool.connection() as conn:        
+        async with conn.cursor() as cur:
             cur.row_factory = dict_row
             try:
-                cur.execute(query, params)
-                r = cur.fetchone()
-                conn.commit()
+                await cur.execute(query, params)
+                r = await cur.fetchone()
+                await conn.commit()
                 if r is None:
-                    conn.rollback()
+                    await conn.rollback()
                     return DataBaseResponse(status.HTTP_404_NOT_FOUND)
                 return DataBaseResponse(status.HTTP_201_CREATED, r)
             except psycopg.errors.UniqueViolation as e:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status.HTTP_409_CONFLICT)
             except psycopg.IntegrityError as e:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
-def db_delete(query: str, params: tuple[str] = None) -> DataBaseResponse:
-    with pool.connection() as conn:        
-        with conn.cursor() as cur:
+async def db_delete(query: str, params: tuple[str] = None) -> DataBaseResponse:
+    async with pool.connection() as conn:        
+        async with conn.cursor() as cur:
             cur.row_factory = dict_row            
             try:
-                cur.execute(query, params)                
-                conn.commit()                
-                return DataBaseResponse(status.HTTP_204_NO_CONTENT)
+                await cur.execute(query, params)                
+                r = await cur.fetchone() if cur.description else None
+                await conn.commit()                
+                return DataBaseResponse(status.HTTP_204_NO_CONTENT, r)
             except Exception as e:
                 print(f"[DATABASE EXCEPTION] -> [{e}]")
-                conn.rollback()
+                await conn.rollback()
                 return DataBaseResponse(status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+
+async def db_transaction(statements: list[tuple[str, tuple]]) -> DataBaseResponse:
+    # Runs every (query, params) in a single transaction. Content holds the
+    # rows returned by each statement (None for statements without a result).
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            cur.row_factory = dict_row
+            try:
+                results: list[list[dict] | None] = []
+                for query, params in statements:
+                    await cur.execute(query, params)
+                    results.append(await cur.fetchall() if cur.description else None)
+                await conn.commit()
+                return DataBaseResponse(status.HTTP_201_CREATED, results)
+            except psycopg.errors.UniqueViolation as e:
+                print(f"[DATABASE EXCEPTION] -> [{e}]")
+                await conn.rollback()
+                return DataBaseResponse(status.HTTP_409_CONFLICT)
+            except (psycopg.errors.CheckViolation, psycopg.errors.RaiseException) as e:
+                print(f"[DATABASE EXCEPTION] -> [{e}]")
+                await conn.rollback()
+                return DataBaseResponse(status.HTTP_400_BAD_REQUEST)
+            except psycopg.errors.ForeignKeyViolation as e:
+                print(f"[DATABASE EXCEPTION] -> [{e}]")
+                await conn.rollback()
+                return DataBaseResponse(status.HTTP_404_NOT_FOUND)
+            except Exception as e:
+                print(f"[DATABASE EXCEPTION] -> [{e}]")
+                await conn.rollback()
+                return DataBaseResponse(status.HTTP_500_INTERNAL_SERVER_ERROR)
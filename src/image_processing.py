@@ -0,0 +1,74 @@
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+import asyncio
+import io
+import os
+
+
+# Longest side, in pixels, of every variant generated at upload time
+VARIANTS: dict[str, int] = {
+    "thumbnail": 160,
+    "feed": 720,
+    "full": 1920
+}
+VARIANT_FORMAT: str = "WEBP"
+VARIANT_EXTENSION: str = ".webp"
+VARIANT_QUALITY: int = int(os.getenv("IMAGE_VARIANT_QUALITY", 80))
+MAX_IMAGE_BYTES: int = int(os.getenv("IMAGE_MAX_BYTES", 20 * 1024 * 1024))
+PROCESS_WORKERS: int = int(os.getenv("IMAGE_PROCESS_WORKERS", os.cpu_count() or 1))
+
+
+# variant -> (encoded bytes, width, height)
+Variants = dict[str, tuple[bytes, int, int]]
+
+
+def render_variants(path: str) -> Variants | None:
+    # Runs inside the worker processes, reading the upload from disk so it is
+    # never held whole in memory. None means the file is not an image
+    try:
+        with Image.open(path) as source:
+            image = ImageOps.exif_transpose(source)
+            image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+            variants: Variants = {}
+            for name, max_side in VARIANTS.items():
+                variant = image.copy()
+                variant.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                variant.save(buffer, format=VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+                variants[name] = (buffer.getvalue(), variant.width, variant.height)
+            return variants
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+class ImageProcessor:
+
+    def __init__(self, max_workers: int = PROCESS_WORKERS):
+        self.__max_workers = max_workers
+        self.__executor: ProcessPoolExecutor | None = None
+
+    def open(self) -> None:
+        if self.__executor is None:
+            self.__executor = ProcessPoolExecutor(max_workers=self.__max_workers)
+
+    def close(self) -> None:
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True, cancel_futures=True)
+            self.__executor = None
+
+    async def process(self, path: str) -> Variants | None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor, render_variants, path)
+
+
+image_processor = None
+
+
+def create_image_processor(new_processor: ImageProcessor) -> None:
+    global image_processor
+    image_processor = new_processor
+
+
+def get_image_processor() -> ImageProcessor:
+    global image_processor
+    return image_processor
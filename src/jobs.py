@@ -0,0 +1,304 @@
+from fastapi import status
+from fastapi.concurrency import run_in_threadpool
+from src.database import db_read_one, db_transaction, DataBaseResponse
+from src.storage import get_storage, StorageResponse
+from typing import Awaitable, Callable
+from src import timeline
+from src import util
+import json
+import os
+
+
+# Jobs live in the "jobs" table and are executed by src/worker.py.
+# API processes only enqueue them. Jobs sharing an idempotency key never
+# run at the same time, and every handler reads the current state of its
+# entity, so a late or repeated job converges instead of undoing newer work.
+
+SYNC_POST_FOLDER: str = "storage.sync_post_folder"
+SYNC_USER_FOLDER: str = "storage.sync_user_folder"
+INDEX_POST_HASHTAGS: str = "posts.index_hashtags"
+SYNC_POST_TIMELINES: str = "timeline.sync_post"
+
+BACKOFF_BASE: float = float(os.getenv("JOBS_BACKOFF_BASE", 5))
+BACKOFF_MAX: float = float(os.getenv("JOBS_BACKOFF_MAX", 3600))
+
+
+# (type, payload, idempotency key)
+Job = tuple[str, dict, str | None]
+
+
+class JobType:
+
+    def __init__(
+            self,
+            handler: Callable[[dict], Awaitable[None]],
+            concurrency: int,
+            max_attempts: int = 5
+        ):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+
+async def _storage_call(method, dir: str) -> None:
+    r: StorageResponse = await run_in_threadpool(method, dir)
+    if not r.success:
+        raise RuntimeError(str(r))
+
+
+async def _sync_folder(dir: str, query: str, entity_id: int) -> None:
+    # The folder exists exactly while its row does, whichever of the create
+    # and delete jobs runs last
+    r: DataBaseResponse = await db_read_one(query, (str(entity_id), ))
+    if r.status_code == status.HTTP_200_OK:
+        await _storage_call(get_storage().mkdir, dir)
+    elif r.status_code == status.HTTP_404_NOT_FOUND:
+        await _storage_call(get_storage().rmdir, dir)
+    else:
+        raise RuntimeError(f"could not read the owner of {dir}")
+
+
+async def sync_post_folder(payload: dict) -> None:
+    await _sync_folder(
+        get_storage().get_post_folder(payload['post_id']),
+        "SELECT post_id FROM posts WHERE post_id = %s;",
+        payload['post_id']
+    )
+
+
+async def sync_user_folder(payload: dict) -> None:
+    await _sync_folder(
+        get_storage().get_user_folder(payload['user_id']),
+        "SELECT user_id FROM users WHERE user_id = %s;",
+        payload['user_id']
+    )
+
+
+async def sync_post_timelines(payload: dict) -> None:
+    if not await timeline.sync_post(payload['post_id']):
+        raise RuntimeError(f"could not update the timelines of post {payload['post_id']}")
+
+
+async def index_post_hashtags(payload: dict) -> None:
+    # Reads the current content so a late retry never indexes stale text
+    post: DataBaseResponse = await db_read_one(
+        """
+            SELECT
+                post_id,
+                user_id,
+                content
+            FROM
+                posts
+            WHERE
+                post_id = %s;
+        """,
+        (str(payload['post_id']), )
+    )
+    if post.status_code == status.HTTP_404_NOT_FOUND:
+        return
+    if post.status_code != status.HTTP_200_OK:
+        raise RuntimeError(f"could not read post {payload['post_id']}")
+    r: DataBaseResponse = await util.register_post_hashtags(
+        post.content['user_id'],
+        post.content['post_id'],
+        post.content['content']
+    )
+    if r.status_code != status.HTTP_201_CREATED:
+        raise RuntimeError(f"could not index post {payload['post_id']}")
+
+
+JOB_TYPES: dict[str, JobType] = {
+    SYNC_POST_FOLDER: JobType(sync_post_folder, concurrency=int(os.getenv("JOBS_FOLDERS_CONCURRENCY", 8))),
+    SYNC_USER_FOLDER: JobType(sync_user_folder, concurrency=int(os.getenv("JOBS_FOLDERS_CONCURRENCY", 8))),
+    INDEX_POST_HASHTAGS: JobType(
+        index_post_hashtags,
+        concurrency=int(os.getenv("JOBS_HASHTAGS_CONCURRENCY", 4))
+    ),
+    SYNC_POST_TIMELINES: JobType(
+        sync_post_timelines,
+        concurrency=int(os.getenv("JOBS_TIMELINES_CONCURRENCY", 8))
+    )
+}
+
+
+# Creating and deleting an entity enqueue the same job, keyed by the entity
+
+def post_folder_job(post_id: int) -> Job:
+    return (SYNC_POST_FOLDER, {"post_id": post_id}, f"{SYNC_POST_FOLDER}:{post_id}")
+
+
+def user_folder_job(user_id: int) -> Job:
+    return (SYNC_USER_FOLDER, {"user_id": user_id}, f"{SYNC_USER_FOLDER}:{user_id}")
+
+
+def index_post_hashtags_job(post_id: int) -> Job:
+    return (INDEX_POST_HASHTAGS, {"post_id": post_id}, f"{INDEX_POST_HASHTAGS}:{post_id}")
+
+
+def sync_post_timelines_job(post_id: int) -> Job:
+    return (SYNC_POST_TIMELINES, {"post_id": post_id}, f"{SYNC_POST_TIMELINES}:{post_id}")
+
+
+# Status of a job that did not finish. A job superseded by a pending one
+# with the same idempotency key is closed instead of queued twice
+RETRY_STATUS: str = """
+    CASE
+        WHEN attempts >= max_attempts THEN 'failed'
+        WHEN idempotency_key IS NOT NULL AND EXISTS (
+            SELECT 1 FROM jobs j WHERE j.idempotency_key = jobs.idempotency_key AND j.status = 'pending'
+        ) THEN 'done'
+        ELSE 'pending'
+    END::job_status
+"""
+
+
+def backoff(attempts: int) -> float:
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+async def enqueue(*jobs: Job) -> DataBaseResponse:
+    # A job whose idempotency key matches one still pending is dropped;
+    # once that job starts running the same key can be queued again
+    return await db_transaction([(
+        """
+            INSERT INTO jobs (
+                type,
+                payload,
+                idempotency_key,
+                max_attempts
+            )
+            SELECT
+                *
+            FROM
+                unnest(%s::text[], %s::jsonb[], %s::text[], %s::int[])
+            ON CONFLICT
+                (idempotency_key) WHERE status = 'pending'
+            DO NOTHING
+            RETURNING
+                job_id;
+        """,
+        (
+            [job[0] for job in jobs],
+            [json.dumps(job[1]) for job in jobs],
+            [job[2] for job in jobs],
+            [JOB_TYPES[job[0]].max_attempts for job in jobs]
+        )
+    )])
+
+
+async def claim(job_type: str, limit: int) -> list[dict] | None:
+    # The advisory lock serializes claims of one type, so the running count
+    # enforces the concurrency limit across every worker process. A job is
+    # not claimed while another one with its idempotency key is running
+    r: DataBaseResponse = await db_transaction([
+        ("SELECT pg_advisory_xact_lock(hashtext(%s));", (job_type, )),
+        (
+            """
+                UPDATE
+                    jobs
+                SET
+                    status = 'running',
+                    attempts = attempts + 1,
+                    locked_at = CURRENT_TIMESTAMP,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE
+                    job_id IN (
+                        SELECT
+                            job_id
+                        FROM
+                            jobs
+                        WHERE
+                            type = %s AND
+                            status = 'pending' AND
+                            run_at <= CURRENT_TIMESTAMP AND
+                            NOT EXISTS (
+                                SELECT 1 FROM jobs r WHERE r.idempotency_key = jobs.idempotency_key AND r.status = 'running'
+                            )
+                        ORDER BY
+                            run_at
+                        LIMIT GREATEST(
+                            %s - (SELECT COUNT(*) FROM jobs WHERE type = %s AND status = 'running'),
+                            0
+                        )
+                        FOR UPDATE SKIP LOCKED
+                    )
+                RETURNING
+                    job_id,
+                    type,
+                    payload,
+                    attempts,
+                    max_attempts;
+            """,
+            (job_type, min(limit, JOB_TYPES[job_type].concurrency), job_type)
+        )
+    ])
+    if r.status_code != status.HTTP_201_CREATED:
+        return None
+    return r.content[1]
+
+
+async def complete(job_id: int) -> DataBaseResponse:
+    return await db_transaction([(
+        """
+            UPDATE
+                jobs
+            SET
+                status = 'done',
+                locked_at = NULL,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE
+                job_id = %s;
+        """,
+        (str(job_id), )
+    )])
+
+
+async def fail(job: dict, error: str) -> DataBaseResponse:
+    # Retries with exponential backoff until max_attempts is reached
+    return await db_transaction([(
+        f"""
+            UPDATE
+                jobs
+            SET
+                status = {RETRY_STATUS},
+                run_at = CURRENT_TIMESTAMP + (%s || ' seconds')::interval,
+                locked_at = NULL,
+                last_error = %s,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE
+                job_id = %s;
+        """,
+        (str(backoff(job['attempts'])), error, str(job['job_id']))
+    )])
+
+
+async def release_stale(timeout: float) -> DataBaseResponse:
+    # Jobs left running by a worker that died go back to the queue
+    return await db_transaction([(
+        f"""
+            UPDATE
+                jobs
+            SET
+                status = {RETRY_STATUS},
+                locked_at = NULL,
+                last_error = 'worker timed out',
+                updated_at = CURRENT_TIMESTAMP
+            WHERE
+                status = 'running' AND
+                locked_at < CURRENT_TIMESTAMP - (%s || ' seconds')::interval;
+        """,
+        (str(timeout), )
+    )])
+
+
+async def purge_done(days: int) -> DataBaseResponse:
+    return await db_transaction([(
+        """
+            DELETE FROM
+                jobs
+            WHERE
+                status = 'done' AND
+                updated_at < CURRENT_TIMESTAMP - (%s || ' days')::interval;
+        """,
+        (str(days), )
+    )])
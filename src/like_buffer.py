@@ -0,0 +1,194 @@
+from fastapi import status
+from src import cache
+from src import database
+import asyncio
+import os
+
+
+FLUSH_INTERVAL: float = float(os.getenv("LIKES_FLUSH_INTERVAL", 1))
+MAX_PENDING_KEYS: int = int(os.getenv("LIKES_MAX_PENDING_KEYS", 100_000))
+MAX_FLUSH_ATTEMPTS: int = int(os.getenv("LIKES_MAX_FLUSH_ATTEMPTS", 5))
+
+
+# (user_id, post_id)
+PostLikeKey = tuple[int, int]
+# (user_id, post_id, comment_id)
+CommentLikeKey = tuple[int, int, int]
+
+
+# Rows whose user, post or comment no longer exists are skipped instead of
+# failing the whole batch. post_counters is updated by the statement-level
+# triggers on post_likes, inside the same transaction
+FLUSH_QUERIES: dict[str, tuple[str, str]] = {
+    "post": (
+        """
+            INSERT INTO post_likes
+                (post_id, user_id)
+            SELECT
+                e.post_id, e.user_id
+            FROM
+                unnest(%s::int[], %s::int[]) AS e(user_id, post_id)
+            WHERE
+                EXISTS (SELECT 1 FROM users u WHERE u.user_id = e.user_id) AND
+                EXISTS (SELECT 1 FROM posts p WHERE p.post_id = e.post_id)
+            ORDER BY
+                e.post_id, e.user_id
+            ON CONFLICT
+                (post_id, user_id)
+            DO NOTHING;
+        """,
+        """
+            DELETE FROM
+                post_likes pl
+            USING
+                unnest(%s::int[], %s::int[]) AS e(user_id, post_id)
+            WHERE
+                pl.post_id = e.post_id AND
+                pl.user_id = e.user_id;
+        """
+    ),
+    "comment": (
+        """
+            INSERT INTO comment_likes
+                (user_id, post_id, comment_id)
+            SELECT
+                e.user_id, e.post_id, e.comment_id
+            FROM
+                unnest(%s::int[], %s::int[], %s::int[]) AS e(user_id, post_id, comment_id)
+            INNER JOIN
+                comments c ON c.comment_id = e.comment_id AND c.post_id = e.post_id
+            WHERE
+                EXISTS (SELECT 1 FROM users u WHERE u.user_id = e.user_id)
+            ORDER BY
+                e.user_id, e.post_id, e.comment_id
+            ON CONFLICT
+                (user_id, post_id, comment_id)
+            DO NOTHING;
+        """,
+        """
+            DELETE FROM
+                comment_likes cl
+            USING
+                unnest(%s::int[], %s::int[], %s::int[]) AS e(user_id, post_id, comment_id)
+            WHERE
+                cl.user_id = e.user_id AND
+                cl.post_id = e.post_id AND
+                cl.comment_id = e.comment_id;
+        """
+    )
+}
+
+
+# Keeps only the last like/unlike of each (user, target) seen during the
+# window, so a burst of toggles costs at most one row change
+class LikeBuffer:
+
+    def __init__(
+            self,
+            flush_interval: float = FLUSH_INTERVAL,
+            max_pending_keys: int = MAX_PENDING_KEYS,
+            max_flush_attempts: int = MAX_FLUSH_ATTEMPTS
+        ):
+        self.__flush_interval = flush_interval
+        self.__max_pending_keys = max_pending_keys
+        self.__max_flush_attempts = max_flush_attempts
+        # target -> key -> liked
+        self.__pending: dict[str, dict[tuple, bool]] = {"post": {}, "comment": {}}
+        # (target, key) -> failed flushes it already went through
+        self.__attempts: dict[tuple[str, tuple], int] = {}
+        self.__lock = asyncio.Lock()
+        self.__task: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return sum(len(keys) for keys in self.__pending.values())
+
+    def liked(self, target: str, key: tuple) -> bool | None:
+        # State not yet written to the database, if any
+        return self.__pending[target].get(key)
+
+    async def set(self, target: str, key: tuple, liked: bool) -> bool:
+        # Returns False when the buffer is full even after flushing,
+        # so the caller can ask the client to retry later
+        if key not in self.__pending[target] and self.pending >= self.__max_pending_keys:
+            await self.flush()
+            if key not in self.__pending[target] and self.pending >= self.__max_pending_keys:
+                return False
+        self.__pending[target][key] = liked
+        return True
+
+    async def flush(self) -> bool:
+        async with self.__lock:
+            if not self.pending:
+                return True
+            batch, self.__pending = self.__pending, {"post": {}, "comment": {}}
+
+            statements: list[tuple[str, tuple]] = []
+            for target, (like_query, unlike_query) in FLUSH_QUERIES.items():
+                for query, liked in ((like_query, True), (unlike_query, False)):
+                    keys = [k for k, v in batch[target].items() if v is liked]
+                    if keys:
+                        statements.append((query, tuple(list(column) for column in zip(*keys))))
+
+            r: database.DataBaseResponse = await database.db_transaction(statements)
+            if r.status_code != status.HTTP_201_CREATED:
+                # A toggle made during the flush is newer than the batch.
+                # Keys that already failed too often are dropped so a row
+                # the database keeps rejecting cannot block every later batch
+                dropped: int = 0
+                for target, keys in batch.items():
+                    for key, liked in keys.items():
+                        attempts: int = self.__attempts.get((target, key), 0) + 1
+                        if attempts < self.__max_flush_attempts:
+                            self.__attempts[(target, key)] = attempts
+                            self.__pending[target].setdefault(key, liked)
+                        else:
+                            self.__attempts.pop((target, key), None)
+                            dropped += 1
+                if dropped:
+                    print(f"[LIKES DROPPED] -> [{dropped} keys after {self.__max_flush_attempts} failed flushes]")
+                return False
+
+            for target, keys in batch.items():
+                for key in keys:
+                    self.__attempts.pop((target, key), None)
+
+            post_ids: set[int] = {k[1] for k in batch["post"]}
+            if post_ids:
+                await cache.invalidate(
+                    *(f"post:{post_id}" for post_id in post_ids),
+                    *(f"post_metrics:{post_id}" for post_id in post_ids)
+                )
+            return True
+
+    async def __run(self) -> None:
+        while True:
+            await asyncio.sleep(self.__flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        await self.flush()
+
+
+like_buffer = None
+
+
+def create_like_buffer(new_buffer: LikeBuffer) -> None:
+    global like_buffer
+    like_buffer = new_buffer
+
+
+def get_like_buffer() -> LikeBuffer:
+    global like_buffer
+    return like_buffer
@@ -0,0 +1,166 @@
+from fastapi import status
+from src import cache
+from src import database
+import asyncio
+import os
+
+
+FLUSH_INTERVAL: float = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+MAX_PENDING_KEYS: int = int(os.getenv("METRICS_MAX_PENDING_KEYS", 100_000))
+MAX_FLUSH_ATTEMPTS: int = int(os.getenv("METRICS_MAX_FLUSH_ATTEMPTS", 5))
+
+
+# (target, id, type) -> counter
+MetricKey = tuple[str, int, str]
+
+
+FLUSH_QUERIES: dict[str, str] = {
+    "post": """
+        INSERT INTO post_metrics AS pm
+            (post_id, type, counter)
+        SELECT
+            e.id, e.type, e.counter
+        FROM
+            unnest(%s::int[], %s::metric_type[], %s::bigint[]) AS e(id, type, counter)
+        WHERE
+            EXISTS (SELECT 1 FROM posts p WHERE p.post_id = e.id)
+        ORDER BY
+            e.id, e.type
+        ON CONFLICT
+            (post_id, type)
+        DO UPDATE SET
+            counter = pm.counter + EXCLUDED.counter,
+            updated_at = CURRENT_TIMESTAMP;
+    """,
+    "comment": """
+        INSERT INTO comment_metrics AS cm
+            (comment_id, type, counter)
+        SELECT
+            e.id, e.type, e.counter
+        FROM
+            unnest(%s::int[], %s::metric_type[], %s::bigint[]) AS e(id, type, counter)
+        WHERE
+            EXISTS (SELECT 1 FROM comments c WHERE c.comment_id = e.id)
+        ORDER BY
+            e.id, e.type
+        ON CONFLICT
+            (comment_id, type)
+        DO UPDATE SET
+            counter = cm.counter + EXCLUDED.counter,
+            updated_at = CURRENT_TIMESTAMP;
+    """
+}
+
+
+class MetricsBuffer:
+
+    def __init__(
+            self,
+            flush_interval: float = FLUSH_INTERVAL,
+            max_pending_keys: int = MAX_PENDING_KEYS,
+            max_flush_attempts: int = MAX_FLUSH_ATTEMPTS
+        ):
+        self.__flush_interval = flush_interval
+        self.__max_pending_keys = max_pending_keys
+        self.__max_flush_attempts = max_flush_attempts
+        self.__pending: dict[MetricKey, int] = {}
+        # Failed flushes each pending key already went through
+        self.__attempts: dict[MetricKey, int] = {}
+        self.__lock = asyncio.Lock()
+        self.__task: asyncio.Task | None = None
+
+    @property
+    def pending(self) -> int:
+        return len(self.__pending)
+
+    def __merge(self, events: dict[MetricKey, int]) -> None:
+        for key, counter in events.items():
+            self.__pending[key] = self.__pending.get(key, 0) + counter
+
+    async def add(self, events: dict[MetricKey, int]) -> bool:
+        # Returns False when the buffer is full even after flushing,
+        # so the caller can ask the client to retry later
+        new_keys: int = sum(1 for key in events if key not in self.__pending)
+        if self.pending + new_keys > self.__max_pending_keys:
+            await self.flush()
+            new_keys = sum(1 for key in events if key not in self.__pending)
+            if self.pending + new_keys > self.__max_pending_keys:
+                return False
+        self.__merge(events)
+        return True
+
+    async def flush(self) -> bool:
+        async with self.__lock:
+            if not self.__pending:
+                return True
+            batch, self.__pending = self.__pending, {}
+
+            statements: list[tuple[str, tuple]] = []
+            for target, query in FLUSH_QUERIES.items():
+                keys = [k for k in batch if k[0] == target]
+                if keys:
+                    statements.append((
+                        query,
+                        ([k[1] for k in keys], [k[2] for k in keys], [batch[k] for k in keys])
+                    ))
+
+            r: database.DataBaseResponse = await database.db_transaction(statements)
+            if r.status_code != status.HTTP_201_CREATED:
+                # Keep the counts for the next flush instead of dropping them,
+                # unless they already failed too often: a row the database
+                # keeps rejecting must not block every later batch
+                retry: dict[MetricKey, int] = {}
+                for key, counter in batch.items():
+                    attempts: int = self.__attempts.get(key, 0) + 1
+                    if attempts < self.__max_flush_attempts:
+                        self.__attempts[key] = attempts
+                        retry[key] = counter
+                    else:
+                        self.__attempts.pop(key, None)
+                if len(retry) < len(batch):
+                    print(f"[METRICS DROPPED] -> [{len(batch) - len(retry)} keys after {self.__max_flush_attempts} failed flushes]")
+                self.__merge(retry)
+                return False
+            for key in batch:
+                self.__attempts.pop(key, None)
+
+            # read_post embeds the metrics in post:{id}
+            post_ids: set[int] = {k[1] for k in batch if k[0] == "post"}
+            if post_ids:
+                await cache.invalidate(
+                    *(f"post:{post_id}" for post_id in post_ids),
+                    *(f"post_metrics:{post_id}" for post_id in post_ids)
+                )
+            return True
+
+    async def __run(self) -> None:
+        while True:
+            await asyncio.sleep(self.__flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self.__task is None:
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        await self.flush()
+
+
+metrics_buffer = None
+
+
+def create_metrics_buffer(new_buffer: MetricsBuffer) -> None:
+    global metrics_buffer
+    metrics_buffer = new_buffer
+
+
+def get_metrics_buffer() -> MetricsBuffer:
+    global metrics_buffer
+    return metrics_buffer
@@ -1,6 +1,8 @@
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional, List
+from enum import Enum
+from src.models.metric import Metrics
 
 
 class Comment(BaseModel):
@@ -27,3 +29,29 @@ class CommentUpdate(BaseModel):
     comment_id: int
     content: Optional[str] = None
 
+
+class CommentNode(BaseModel):
+
+    comment_id: int
+    user_id: int
+    content: str
+    created_at: datetime
+    updated_at: datetime
+    metrics: Metrics
+    replies: List['CommentNode']
+    more_replies: int
+    parent_comment_id: int | None
+
+
+class CommentThread(BaseModel):
+
+    comments: List[CommentNode]
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class CommentProjection(str, Enum):
+
+    none = "none"
+    preview = "preview"
+    full = "full"
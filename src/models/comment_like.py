@@ -1,5 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
+from src.models.user import Liker
 
 
 class CommentLike(BaseModel):
@@ -12,14 +14,35 @@ class CommentLike(BaseModel):
 
 class CommentLikeUnique(BaseModel):
 
-    user_id: int
-    post_id: int
-    comment_id: int    
+    user_id: int = Field(ge=1, le=2**31 - 1)
+    post_id: int = Field(ge=1, le=2**31 - 1)
+    comment_id: int = Field(ge=1, le=2**31 - 1)
 
 
 class CommentLikeCreate(BaseModel):
 
+    user_id: int = Field(ge=1, le=2**31 - 1)
+    post_id: int = Field(ge=1, le=2**31 - 1)
+    comment_id: int = Field(ge=1, le=2**31 - 1)
+
+
+
+class CommentLikeState(BaseModel):
+
     user_id: int
     post_id: int
-    comment_id: int    
+    comment_id: int
+    liked: bool
 
+
+class CommentLikers(BaseModel):
+
+    users: List[Liker]
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class ViewerCommentLikes(BaseModel):
+
+    user_id: int
+    comment_ids: List[int]
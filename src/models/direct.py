@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -20,3 +21,28 @@ class DirectConversationCreate(BaseModel):
     
     user1_id: int
     user2_id: int
+
+
+class InboxMessage(BaseModel):
+
+    message_id: int
+    sender_id: int
+    content: str
+    is_read: bool
+    created_at: datetime
+
+
+class InboxConversation(BaseModel):
+
+    conversation_id: int
+    other_user_id: int
+    unread_count: int
+    last_interaction_at: datetime
+    last_message: Optional[InboxMessage] = None
+
+
+class DirectInbox(BaseModel):
+
+    conversations: List[InboxConversation]
+    limit: int
+    next_cursor: Optional[str] = None
@@ -1,5 +1,7 @@
 from pydantic import BaseModel
+from typing import List, Optional
 from datetime import datetime
+from src.models.user import UserSummary
 
 
 class Follow(BaseModel):
@@ -22,4 +24,26 @@ class Follower(BaseModel):
 
 class Followed(BaseModel):
 
-    user_id: int
\ No newline at end of file
+    user_id: int
+
+
+class FollowRelationship(BaseModel):
+
+    follows: bool
+    followed_by: bool
+    mutual: bool
+
+
+
+class FollowEntry(UserSummary):
+
+    # The edge in the other direction also exists
+    follows_back: bool
+    followed_at: datetime
+
+
+class FollowPage(BaseModel):
+
+    users: List[FollowEntry]
+    limit: int
+    next_cursor: Optional[str] = None
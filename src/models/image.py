@@ -1,6 +1,14 @@
 from pydantic import BaseModel
+from enum import Enum
+
+
+class ImageSize(str, Enum):
+
+    thumbnail = "thumbnail"
+    feed = "feed"
+    full = "full"
 
 
 class Image(BaseModel):
 
-    image_url: str
\ No newline at end of file
+    image_url: str
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -16,6 +16,14 @@ class Message(BaseModel):
     reply_to_message_id: int | None
 
 
+class MessagePage(BaseModel):
+
+    # Always in chronological order; has_more refers to the paging direction
+    messages: List[Message]
+    limit: int
+    has_more: bool
+
+
 class MessageCreate(BaseModel):
     
     conversation_id: int
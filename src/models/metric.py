@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Literal
 
 
 class Metrics(BaseModel):
@@ -13,4 +14,29 @@ class UserProfileMetrics(BaseModel):
 
     posts: int
     followers: int
-    following: int    
\ No newline at end of file
+    following: int
+
+
+class CacheStatistics(BaseModel):
+
+    hits: int
+    misses: int
+    hit_ratio: float
+    sets: int
+    evictions: int
+    invalidations: int
+    entries: int
+    bytes: int
+
+
+class MetricEvent(BaseModel):
+
+    target: Literal['post', 'comment']
+    id: int = Field(ge=1, le=2**31 - 1)
+    type: Literal['impressions', 'views']
+    count: int = Field(default=1, ge=1, le=1000)
+
+
+class MetricEventBatch(BaseModel):
+
+    events: List[MetricEvent] = Field(max_length=1000)
@@ -18,6 +18,7 @@ class Post(BaseModel):
     updated_at: datetime
     metrics: Metrics
     comments: List[Comment]
+    liked_by_viewer: Optional[bool] = None
 
 
 class PostCreate(BaseModel):
@@ -33,9 +34,8 @@ class PostCreate(BaseModel):
 class PostCollection(BaseModel):
 
     posts: List[Post]
-    offset: int
     limit: int
-    total: int
+    next_cursor: Optional[str] = None
 
 
 class PostUpdate(BaseModel):
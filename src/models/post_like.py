@@ -1,5 +1,7 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
+from src.models.user import Liker
 
 
 class PostLike(BaseModel):
@@ -11,11 +13,31 @@ class PostLike(BaseModel):
 
 class PostLikeUnique(BaseModel):
 
-    user_id: int
-    post_id: int    
+    user_id: int = Field(ge=1, le=2**31 - 1)
+    post_id: int = Field(ge=1, le=2**31 - 1)
 
 
 class PostLikeCreate(BaseModel):
 
+    user_id: int = Field(ge=1, le=2**31 - 1)
+    post_id: int = Field(ge=1, le=2**31 - 1)
+
+
+class PostLikeState(BaseModel):
+
     user_id: int
     post_id: int
+    liked: bool
+
+
+class PostLikers(BaseModel):
+
+    users: List[Liker]
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class ViewerPostLikes(BaseModel):
+
+    user_id: int
+    post_ids: List[int]
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import List, Optional
 from datetime import datetime
 
 class SearchCreate(BaseModel):
@@ -17,3 +18,50 @@ class SearchDelete(BaseModel):
 
     user_id: int
     search_query: str
+
+
+class UserSearchResult(BaseModel):
+
+    user_id: int
+    username: str
+    full_name: str
+    is_verified: bool
+    score: float
+
+
+class UserSearchPage(BaseModel):
+
+    users: List[UserSearchResult]
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class PostSearchResult(BaseModel):
+
+    post_id: int
+    user_id: int
+    title: str
+    content: Optional[str] = None
+    language: Optional[str] = None
+    created_at: datetime
+    score: float
+
+
+class PostSearchPage(BaseModel):
+
+    posts: List[PostSearchResult]
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class HashtagSearchResult(BaseModel):
+
+    hashtag_id: int
+    name: str
+
+
+class HashtagSearchPage(BaseModel):
+
+    hashtags: List[HashtagSearchResult]
+    limit: int
+    next_cursor: Optional[str] = None
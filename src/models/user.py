@@ -38,3 +38,18 @@ class UserUpdate(BaseModel):
     bio: Optional[str] = None
     birthdate: Optional[datetime.date] = None
     is_verified: Optional[bool] = None
+
+
+
+class UserSummary(BaseModel):
+
+    user_id: int
+    username: str
+    full_name: str
+    is_verified: bool
+    avatar_url: Optional[str] = None
+
+
+class Liker(UserSummary):
+
+    liked_at: datetime.datetime
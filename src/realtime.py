@@ -0,0 +1,227 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from fastapi import WebSocket
+from typing import Awaitable, Callable
+from src import database
+import psycopg
+import asyncio
+import json
+import os
+
+
+# Events are JSON objects {"channel", "event", "data"}. Channels are
+# "conversation:<id>" for message events and "user:<id>" for events
+# addressed to one user (e.g. a new conversation to subscribe to).
+
+CHANNEL: str = "realtime_events"
+# pg_notify payloads are limited to 8000 bytes
+MAX_NOTIFY_BYTES: int = 7900
+SEND_QUEUE_SIZE: int = int(os.getenv("REALTIME_SEND_QUEUE_SIZE", 256))
+RECONNECT_BASE: float = float(os.getenv("REALTIME_RECONNECT_BASE", 1))
+RECONNECT_MAX: float = float(os.getenv("REALTIME_RECONNECT_MAX", 30))
+
+
+def conversation_channel(conversation_id: int) -> str:
+    return f"conversation:{conversation_id}"
+
+
+def user_channel(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_event(channel: str, event: str, data) -> str:
+    return json.dumps({"channel": channel, "event": event, "data": data}, default=_default)
+
+
+# Delivers every published event to the on_event callback of every
+# process sharing the broker, including the publisher itself
+class Broker(ABC):
+
+    def __init__(self):
+        self.on_event: Callable[[str], Awaitable[None]] | None = None
+
+    @abstractmethod
+    async def open(self) -> None:
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def publish(self, message: str) -> None:
+        pass
+
+
+# Single process only
+class MemoryBroker(Broker):
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def publish(self, message: str) -> None:
+        await self.on_event(message)
+
+
+# Shares events between API workers through LISTEN/NOTIFY. When the
+# listening connection drops it reconnects with backoff and LISTENs again;
+# events notified while it was down are lost, clients catch up through the
+# REST API.
+class PostgresBroker(Broker):
+
+    def __init__(self, conninfo: str = None):
+        super().__init__()
+        self.__conninfo = conninfo or database.db_get_pool().conninfo
+        self.__conn: psycopg.AsyncConnection | None = None
+        self.__task: asyncio.Task | None = None
+
+    async def __connect(self) -> None:
+        self.__conn = await psycopg.AsyncConnection.connect(self.__conninfo, autocommit=True)
+        await self.__conn.execute(f"LISTEN {CHANNEL};")
+
+    async def __disconnect(self) -> None:
+        if self.__conn is not None:
+            try:
+                await self.__conn.close()
+            except Exception:
+                pass
+            self.__conn = None
+
+    async def __listen(self) -> None:
+        attempts: int = 0
+        while True:
+            try:
+                if self.__conn is None:
+                    await self.__connect()
+                attempts = 0
+                async for notify in self.__conn.notifies():
+                    try:
+                        await self.on_event(notify.payload)
+                    except Exception as e:
+                        print(f"[REALTIME EVENT FAILED] -> [{e}]")
+            except Exception as e:
+                print(f"[REALTIME DISCONNECTED] -> [{e}]")
+            await self.__disconnect()
+            attempts += 1
+            await asyncio.sleep(min(RECONNECT_BASE * 2 ** (attempts - 1), RECONNECT_MAX))
+
+    async def open(self) -> None:
+        await self.__connect()
+        self.__task = asyncio.create_task(self.__listen())
+
+    async def close(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        await self.__disconnect()
+
+    async def publish(self, message: str) -> None:
+        if len(message.encode()) > MAX_NOTIFY_BYTES:
+            # Too large for NOTIFY: clients get the event without its data
+            # and re-read it through the REST API
+            event: dict = json.loads(message)
+            event['data'] = None
+            event['truncated'] = True
+            message = json.dumps(event)
+        await database.db_read_one("SELECT pg_notify(%s, %s);", (CHANNEL, message))
+
+
+class Connection:
+
+    def __init__(self, websocket: WebSocket, user_id: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Bounded so a slow client cannot hold events in memory forever
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+
+    async def writer(self) -> None:
+        while True:
+            message: str = await self.queue.get()
+            await self.websocket.send_text(message)
+
+
+class Hub:
+
+    def __init__(self, broker: Broker):
+        self.__broker = broker
+        self.__broker.on_event = self.__dispatch
+        self.__channels: dict[str, set[Connection]] = {}
+
+    async def open(self) -> None:
+        await self.__broker.open()
+
+    async def close(self) -> None:
+        await self.__broker.close()
+        connections: set[Connection] = set().union(*self.__channels.values())
+        self.__channels.clear()
+        for connection in connections:
+            try:
+                await connection.websocket.close(code=1001)
+            except RuntimeError:
+                pass
+
+    def subscribe(self, connection: Connection, *channels: str) -> None:
+        for channel in channels:
+            self.__channels.setdefault(channel, set()).add(connection)
+
+    def unsubscribe(self, connection: Connection) -> None:
+        for channel in list(self.__channels):
+            subscribers = self.__channels[channel]
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.__channels[channel]
+
+    async def publish(self, channel: str, event: str, data) -> None:
+        await self.__broker.publish(encode_event(channel, event, data))
+
+    async def __dispatch(self, message: str) -> None:
+        event: dict = json.loads(message)
+        subscribers: set[Connection] = self.__channels.get(event['channel'], set())
+        for connection in list(subscribers):
+            # A new conversation starts streaming to its members right away
+            if event['event'] == "conversation_created" and event['data'] is not None:
+                self.subscribe(connection, conversation_channel(event['data']['conversation_id']))
+            try:
+                connection.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.unsubscribe(connection)
+                try:
+                    await connection.websocket.close(code=1013)
+                except RuntimeError:
+                    pass
+
+
+hub = None
+
+
+def create_hub(new_hub: Hub) -> None:
+    global hub
+    hub = new_hub
+
+
+def get_hub() -> Hub:
+    global hub
+    return hub
+
+
+def broker_from_env() -> Broker:
+    if os.getenv("REALTIME_BROKER", "memory") == "postgres":
+        return PostgresBroker()
+    return MemoryBroker()
+
+
+async def publish(channel: str, event: str, data=None) -> None:
+    await get_hub().publish(channel, event, data)
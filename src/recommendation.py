@@ -0,0 +1,311 @@
+from collections import OrderedDict
+from fastapi import status
+from src import database
+import numpy as np
+import time
+import os
+
+
+POOL_TTL: float = float(os.getenv("FORYOU_POOL_TTL", 600))
+TRENDING_TTL: float = float(os.getenv("FORYOU_TRENDING_TTL", 300))
+MAX_CACHED_POOLS: int = 10_000
+
+CANDIDATE_DAYS: int = 7
+POOL_SIZE: int = 1000
+TRENDING_HASHTAGS: int = 20
+AFFINITY_HASHTAGS: int = 50
+
+# Score weights
+LIKE_WEIGHT: float = 1.0
+COMMENT_WEIGHT: float = 2.0
+VIEW_WEIGHT: float = 0.1
+AFFINITY_WEIGHT: float = 3.0
+SOCIAL_WEIGHT: float = 1.5
+HALF_LIFE_HOURS: float = 12.0
+
+# Candidate sources (bit flags)
+SOURCE_HASHTAG: int = 1
+SOURCE_FOLLOWED_LIKES: int = 2
+SOURCE_TRENDING: int = 4
+
+
+class CandidatePool:
+
+    def __init__(self, rows: list[dict]):
+        n: int = len(rows)
+        self.post_ids = np.fromiter((r['post_id'] for r in rows), dtype=np.int64, count=n)
+        self.author_ids = np.fromiter((r['user_id'] for r in rows), dtype=np.int64, count=n)
+        self.created_at = np.fromiter((r['created_at'] for r in rows), dtype=np.float64, count=n)
+        self.likes = np.fromiter((r['likes'] for r in rows), dtype=np.float64, count=n)
+        self.comments = np.fromiter((r['comments'] for r in rows), dtype=np.float64, count=n)
+        self.views = np.fromiter((r['views'] for r in rows), dtype=np.float64, count=n)
+        self.sources = np.fromiter((r['sources'] for r in rows), dtype=np.int64, count=n)
+        # Hashtags in CSR form: hashtag_ids[i] belongs to candidate hashtag_rows[i]
+        counts = np.fromiter((len(r['hashtags']) for r in rows), dtype=np.int64, count=n)
+        self.hashtag_rows = np.repeat(np.arange(n, dtype=np.int64), counts)
+        self.hashtag_ids = np.fromiter(
+            (h for r in rows for h in r['hashtags']),
+            dtype=np.int64,
+            count=int(counts.sum())
+        )
+
+    def __len__(self) -> int:
+        return len(self.post_ids)
+
+
+class UserPool:
+
+    def __init__(self, candidates: CandidatePool, affinity: list[dict]):
+        self.candidates = candidates
+        affinity = sorted(affinity, key=lambda r: r['hashtag_id'])
+        self.affinity_ids = np.fromiter((r['hashtag_id'] for r in affinity), dtype=np.int64, count=len(affinity))
+        weights = np.fromiter((r['weight'] for r in affinity), dtype=np.float64, count=len(affinity))
+        self.affinity_weights = weights / weights.sum() if len(weights) else weights
+
+
+trending_pool: tuple[float, CandidatePool] | None = None
+user_pools: OrderedDict[int, tuple[float, UserPool]] = OrderedDict()
+
+
+CANDIDATE_COLUMNS: str = """
+    p.post_id,
+    p.user_id,
+    EXTRACT(EPOCH FROM p.created_at)::float8 AS created_at,
+    COALESCE(pc.likes, 0) AS likes,
+    COALESCE(pc.comments, 0) AS comments,
+    COALESCE(pc.views, 0) AS views,
+    ARRAY(
+        SELECT ph2.hashtag_id FROM post_hashtags ph2 WHERE ph2.user_id = p.user_id AND ph2.post_id = p.post_id
+    ) AS hashtags
+"""
+
+
+async def load_trending_pool() -> CandidatePool | None:
+    r: database.DataBaseResponse = await database.db_read_all(
+        f"""
+            WITH trending AS (
+                SELECT
+                    hashtag_id
+                FROM
+                    trending_hashtags(1, %s)
+            ),
+            candidates AS (
+                SELECT DISTINCT
+                    ph.post_id
+                FROM
+                    post_hashtags ph
+                INNER JOIN
+                    trending t ON t.hashtag_id = ph.hashtag_id
+                WHERE
+                    ph.created_at >= CURRENT_TIMESTAMP - (%s || ' days')::interval
+            )
+            SELECT
+                {CANDIDATE_COLUMNS},
+                {SOURCE_TRENDING} AS sources
+            FROM
+                candidates c
+            INNER JOIN
+                posts p ON p.post_id = c.post_id
+            LEFT JOIN
+                post_counters pc ON pc.post_id = p.post_id
+            WHERE
+                p.status = 'published'
+            ORDER BY
+                p.created_at DESC
+            LIMIT %s;
+        """,
+        (TRENDING_HASHTAGS, str(CANDIDATE_DAYS), POOL_SIZE)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    return CandidatePool(r.content)
+
+
+async def load_user_pool(user_id: int) -> UserPool | None:
+    affinity: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                hashtag_id,
+                COUNT(*) AS weight
+            FROM
+                post_hashtags
+            WHERE
+                user_id = %s
+            GROUP BY
+                hashtag_id
+            ORDER BY
+                weight DESC
+            LIMIT %s;
+        """,
+        (str(user_id), AFFINITY_HASHTAGS)
+    )
+    if affinity.status_code != status.HTTP_200_OK:
+        return None
+
+    r: database.DataBaseResponse = await database.db_read_all(
+        f"""
+            WITH candidates AS (
+                SELECT
+                    ph.post_id,
+                    {SOURCE_HASHTAG} AS source
+                FROM
+                    post_hashtags ph
+                WHERE
+                    ph.hashtag_id = ANY(%s::int[]) AND
+                    ph.created_at >= CURRENT_TIMESTAMP - (%s || ' days')::interval
+                UNION
+                SELECT
+                    pl.post_id,
+                    {SOURCE_FOLLOWED_LIKES} AS source
+                FROM
+                    follows f
+                INNER JOIN
+                    post_likes pl ON pl.user_id = f.followed_id
+                WHERE
+                    f.follower_id = %s AND
+                    pl.created_at >= CURRENT_TIMESTAMP - (%s || ' days')::interval
+            ),
+            grouped AS (
+                SELECT
+                    post_id,
+                    bit_or(source) AS sources
+                FROM
+                    candidates
+                GROUP BY
+                    post_id
+            )
+            SELECT
+                {CANDIDATE_COLUMNS},
+                c.sources
+            FROM
+                grouped c
+            INNER JOIN
+                posts p ON p.post_id = c.post_id
+            LEFT JOIN
+                post_counters pc ON pc.post_id = p.post_id
+            WHERE
+                p.status = 'published' AND
+                p.user_id <> %s
+            ORDER BY
+                p.created_at DESC
+            LIMIT %s;
+        """,
+        (
+            [row['hashtag_id'] for row in affinity.content],
+            str(CANDIDATE_DAYS),
+            str(user_id),
+            str(CANDIDATE_DAYS),
+            str(user_id),
+            POOL_SIZE
+        )
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    return UserPool(CandidatePool(r.content), affinity.content)
+
+
+async def get_trending_pool() -> CandidatePool | None:
+    global trending_pool
+    now: float = time.monotonic()
+    if trending_pool is None or trending_pool[0] < now:
+        pool = await load_trending_pool()
+        if pool is None:
+            return None
+        trending_pool = (now + TRENDING_TTL, pool)
+    return trending_pool[1]
+
+
+async def get_user_pool(user_id: int) -> UserPool | None:
+    now: float = time.monotonic()
+    cached = user_pools.get(user_id)
+    if cached is not None and cached[0] >= now:
+        user_pools.move_to_end(user_id)
+        return cached[1]
+    pool = await load_user_pool(user_id)
+    if pool is None:
+        return None
+    user_pools[user_id] = (now + POOL_TTL, pool)
+    user_pools.move_to_end(user_id)
+    while len(user_pools) > MAX_CACHED_POOLS:
+        user_pools.popitem(last=False)
+    return pool
+
+
+def invalidate_user_pool(user_id: int) -> None:
+    user_pools.pop(user_id, None)
+
+
+def score(candidates: CandidatePool, user: UserPool, now: float) -> np.ndarray:
+    engagement = np.log1p(
+        LIKE_WEIGHT * candidates.likes +
+        COMMENT_WEIGHT * candidates.comments +
+        VIEW_WEIGHT * candidates.views
+    )
+
+    affinity = np.zeros(len(candidates), dtype=np.float64)
+    if len(user.affinity_ids) and len(candidates.hashtag_ids):
+        idx = np.searchsorted(user.affinity_ids, candidates.hashtag_ids)
+        idx = np.minimum(idx, len(user.affinity_ids) - 1)
+        weights = np.where(
+            user.affinity_ids[idx] == candidates.hashtag_ids,
+            user.affinity_weights[idx],
+            0.0
+        )
+        affinity = np.bincount(candidates.hashtag_rows, weights=weights, minlength=len(candidates))
+
+    social = (candidates.sources & SOURCE_FOLLOWED_LIKES) > 0
+    age_hours = np.maximum(now - candidates.created_at, 0.0) / 3600.0
+    decay = np.exp2(-age_hours / HALF_LIFE_HOURS)
+    return (engagement + AFFINITY_WEIGHT * affinity + SOCIAL_WEIGHT * social) * decay
+
+
+async def rank(user_id: int, offset: int, limit: int) -> list[int] | None:
+    user = await get_user_pool(user_id)
+    trending = await get_trending_pool()
+    if user is None or trending is None:
+        return None
+
+    now: float = time.time()
+    post_ids = np.concatenate([user.candidates.post_ids, trending.post_ids])
+    author_ids = np.concatenate([user.candidates.author_ids, trending.author_ids])
+    scores = np.concatenate([score(user.candidates, user, now), score(trending, user, now)])
+
+    # Only the candidates are probed in user_viewed_posts, through its
+    # (user_id, post_id) primary key, so the read stays bounded by the pool size
+    exclusions: database.DataBaseResponse = await database.db_read_one(
+        """
+            SELECT
+                ARRAY(
+                    SELECT post_id FROM user_viewed_posts WHERE user_id = %s AND post_id = ANY(%s)
+                ) AS viewed,
+                ARRAY(
+                    SELECT blocked_id FROM blocks WHERE blocker_id = %s
+                    UNION
+                    SELECT blocker_id FROM blocks WHERE blocked_id = %s
+                ) AS blocked;
+        """,
+        (str(user_id), np.unique(post_ids).tolist(), str(user_id), str(user_id))
+    )
+    if exclusions.status_code != status.HTTP_200_OK:
+        return None
+
+    # A post may come from both pools; keep its best score
+    order = np.lexsort((-scores, post_ids))
+    post_ids, author_ids, scores = post_ids[order], author_ids[order], scores[order]
+    first = np.ones(len(post_ids), dtype=bool)
+    first[1:] = post_ids[1:] != post_ids[:-1]
+
+    keep = (
+        first &
+        (author_ids != user_id) &
+        ~np.isin(post_ids, np.asarray(exclusions.content['viewed'], dtype=np.int64)) &
+        ~np.isin(author_ids, np.asarray(exclusions.content['blocked'], dtype=np.int64))
+    )
+    post_ids, scores = post_ids[keep], scores[keep]
+
+    end: int = min(offset + limit, len(scores))
+    if offset >= end:
+        return []
+    top = np.argpartition(-scores, end - 1)[:end] if end < len(scores) else np.arange(len(scores))
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return post_ids[top[offset:end]].tolist()
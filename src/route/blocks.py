@@ -1,17 +1,22 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, status
 from fastapi.responses import JSONResponse, Response
 from src.models.unique import UniqueID
 from src.models.block import Block
 from typing import List
+from src import block_filter
+from src import cache
 from src import database
+from src import recommendation
+from src import social_graph
+from src import timeline
 
 
 blocks_router = APIRouter()
 
 
 @blocks_router.get("/blocks/user", response_model=List[Block])
-def read_blocked_by_user(user: UniqueID) -> JSONResponse:
-    return database.db_read_all(
+async def read_blocked_by_user(user: UniqueID) -> JSONResponse:
+    return (await database.db_read_all(
         """
             SELECT 
                 blocker_id,
@@ -23,12 +28,12 @@ def read_blocked_by_user(user: UniqueID) -> JSONResponse:
                 blocker_id = %s;
         """,
         (str(user.id), )
-    ).json_response()
+    )).json_response()
 
 
 @blocks_router.post("/blocks")
-def create_block(block: Block) -> Response:
-    return database.db_create(
+async def create_block(block: Block) -> Response:
+    r: database.DataBaseResponse = await database.db_create(
         """
             INSERT INTO blocks (
                 blocker_id,
@@ -40,12 +45,26 @@ def create_block(block: Block) -> Response:
                 blocker_id;
         """,
         (str(block.blocker_id), str(block.blocked_id))
-    ).response()
+    )
+    if r.status_code == status.HTTP_201_CREATED:
+        await cache.invalidate(
+            f"user_metrics:{block.blocker_id}",
+            f"user_metrics:{block.blocked_id}"
+        )
+        block_filter.invalidate(block.blocker_id, block.blocked_id)
+        # unfollow_on_block removed the follows in both directions
+        social_graph.on_unfollow(block.blocker_id, block.blocked_id)
+        social_graph.on_unfollow(block.blocked_id, block.blocker_id)
+        recommendation.invalidate_user_pool(block.blocker_id)
+        recommendation.invalidate_user_pool(block.blocked_id)
+        await timeline.on_block(block.blocker_id, block.blocked_id)
+
+    return r.response()
 
 
 @blocks_router.delete("/blocks")
-def delete_block(block: Block) -> Response:
-    return database.db_delete(
+async def delete_block(block: Block) -> Response:
+    r: database.DataBaseResponse = await database.db_delete(
         """
             DELETE FROM
                 blocks
@@ -56,4 +75,8 @@ def delete_block(block: Block) -> Response:
                 blocker_id;
         """,
         (str(block.blocker_id), str(block.blocked_id))
-    ).response()
\ No newline at end of file
+    )
+    if r.status_code == status.HTTP_204_NO_CONTENT:
+        block_filter.invalidate(block.blocker_id, block.blocked_id)
+
+    return r.response()
\ No newline at end of file
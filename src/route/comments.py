@@ -1,17 +1,24 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query, status
 from fastapi.responses import Response
 from src.models.unique import UniqueID
-from src.models.comment import Comment, CommentCreate, CommentUpdate
-from typing import List
+from src.models.comment import Comment, CommentCreate, CommentUpdate, CommentThread
+from typing import List, Optional
+from src import block_filter
+from src import cache
+from src import comment_tree
 from src import database
+from src import util
 
 
 comments_router = APIRouter()
 
 
 @comments_router.get("/comments/post/parent", response_model=List[Comment])
-def read_parent_comments_from_post(post: UniqueID):
-    return database.db_read_all(
+async def read_parent_comments_from_post(
+    post: UniqueID,
+    viewer_id: Optional[int] = Query(default=None)
+):
+    r: database.DataBaseResponse = await database.db_read_all(
         """
             SELECT 
                 comment_id,
@@ -29,12 +36,22 @@ def read_parent_comments_from_post(post: UniqueID):
                 parent_comment_id is NULL;
         """,
         (str(post.id), )
-    ).json_response()
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.json_response()
+
+    r.content = await block_filter.filter_rows(viewer_id, r.content)
+    if r.content is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return r.json_response()
 
     
 @comments_router.get("/comments/comment", response_model=Comment)
-def read_comment(comment: UniqueID):
-    r: database.DataBaseResponse = database.db_read_one(
+async def read_comment(
+    comment: UniqueID,
+    viewer_id: Optional[int] = Query(default=None)
+):
+    r: database.DataBaseResponse = await database.db_read_one(
         """
             SELECT 
                 get_comment_children(%s) 
@@ -43,14 +60,57 @@ def read_comment(comment: UniqueID):
         """,
         (str(comment.id), )
     ) 
-    r.content = r.content['comments']
+    if r.status_code != status.HTTP_200_OK:
+        return r.json_response()
+
+    r.content = await block_filter.filter_rows(viewer_id, r.content['comments'])
+    if r.content is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     return r.json_response()
 
 
 
+@comments_router.get("/comments/thread", response_model=CommentThread)
+async def read_comment_thread(
+    post_id: int = Query(),
+    parent_comment_id: Optional[int] = Query(default=None),
+    cursor: Optional[str] = Query(default=None),
+    limit: int = Query(default=20, ge=1, le=100),
+    max_depth: int = Query(default=2, ge=1, le=8),
+    replies: int = Query(default=3, ge=0, le=50),
+    viewer_id: Optional[int] = Query(default=None)
+):
+    # (created_at, comment_id) position placed before any real comment
+    position: tuple | None = util.decode_cursor(cursor, ("-infinity", 0), util.TIMESTAMP_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    thread = await comment_tree.read_thread(
+        post_id,
+        parent_comment_id,
+        position,
+        limit,
+        max_depth,
+        replies
+    )
+    if thread is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    comments, next_cursor = thread
+    comments = await block_filter.filter_rows(viewer_id, comments)
+    if comments is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    r = database.DataBaseResponse(content={
+        "comments": comments,
+        "limit": limit,
+        "next_cursor": next_cursor
+    })
+    return r.json_response()
+
+
 @comments_router.post("/comments")
-def create_comment(comment: CommentCreate) -> Response:    
-    return database.db_create(
+async def create_comment(comment: CommentCreate) -> Response:    
+    r: database.DataBaseResponse = await database.db_create(
         """
             INSERT INTO comments 
                 (user_id, post_id, content, parent_comment_id)
@@ -65,13 +125,17 @@ def create_comment(comment: CommentCreate) -> Response:
             comment.content,
             comment.parent_comment_id
         )
-    ).response()    
+    )
+    if r.status_code == status.HTTP_201_CREATED:
+        await cache.invalidate(f"post:{comment.post_id}", f"post_metrics:{comment.post_id}")
+
+    return r.response()
 
 
 
 @comments_router.put("/comments")
-def update_comment(comment: CommentUpdate) -> Response:
-    return database.db_update(
+async def update_comment(comment: CommentUpdate) -> Response:
+    return (await database.db_update(
         """
             UPDATE comments SET
                 content = %s,
@@ -82,19 +146,24 @@ def update_comment(comment: CommentUpdate) -> Response:
                 comment_id;
         """,
         (comment.content, str(comment.comment_id))
-    ).response()
+    )).response()
 
 
 @comments_router.delete("/comments")
-def delete_comment(comment: UniqueID) -> Response:
-    return database.db_delete(
+async def delete_comment(comment: UniqueID) -> Response:
+    r: database.DataBaseResponse = await database.db_delete(
         """
             DELETE FROM 
                 comments 
             WHERE 
                 comment_id = %s 
             RETURNING 
-                comment_id;
+                comment_id, post_id;
         """,
         (str(comment.id), )
-    ).response()
\ No newline at end of file
+    )
+    if r.status_code == status.HTTP_204_NO_CONTENT and r.content is not None:
+        post_id: int = r.content['post_id']
+        await cache.invalidate(f"post:{post_id}", f"post_metrics:{post_id}")
+
+    return r.response()
\ No newline at end of file
@@ -1,17 +1,20 @@
-from fastapi import APIRouter, status
+from fastapi import APIRouter, Query, status
 from fastapi.responses import JSONResponse, Response
 from src.models.unique import UniqueID
-from src.models.direct import DirectConversation, DirectConversationCreate
-from typing import List
+from src.models.direct import DirectConversation, DirectConversationCreate, DirectInbox
+from typing import List, Optional
 from src import database
+from src import realtime
+from src import util
 
 
 directs_router = APIRouter()
 
 
 @directs_router.get("/directs", response_model=List[DirectConversation])
-def get_direct_conversations_from_user(user: UniqueID) -> JSONResponse:
-    return database.db_read_all(
+async def get_direct_conversations_from_user(user: UniqueID) -> JSONResponse:
+    # One index scan per side of the pair instead of a BitmapOr
+    return (await database.db_read_all(
         """ 
             SELECT
                 conversation_id,
@@ -22,17 +25,137 @@ def get_direct_conversations_from_user(user: UniqueID) -> JSONResponse:
             FROM
                 direct_conversations
             WHERE
-                user1_id = %s OR
+                user1_id = %s
+            UNION ALL
+            SELECT
+                conversation_id,
+                user1_id,
+                user2_id,                   
+                TO_CHAR(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
+                TO_CHAR(last_interaction_at, 'YYYY-MM-DD HH24:MI:SS') as last_interaction_at
+            FROM
+                direct_conversations
+            WHERE
                 user2_id = %s;
         """,
         (str(user.id), str(user.id))
-    ).json_response()
+    )).json_response()
+
+
+@directs_router.get("/directs/inbox", response_model=DirectInbox)
+async def read_inbox(
+    user: UniqueID,
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
+):
+    # (last_interaction_at, conversation_id) position placed before any real conversation
+    position: tuple | None = util.decode_cursor(cursor, ("infinity", 2147483647), util.TIMESTAMP_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    # Each branch walks its own (userX_id, last_interaction_at, conversation_id)
+    # index and stops after limit + 1 rows, so the merge stays small
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            WITH page AS (
+                (
+                    SELECT
+                        conversation_id,
+                        user2_id AS other_user_id,
+                        last_interaction_at
+                    FROM
+                        direct_conversations
+                    WHERE
+                        user1_id = %s AND
+                        (last_interaction_at, conversation_id) < (%s::timestamptz, %s)
+                    ORDER BY
+                        last_interaction_at DESC,
+                        conversation_id DESC
+                    LIMIT %s
+                )
+                UNION ALL
+                (
+                    SELECT
+                        conversation_id,
+                        user1_id AS other_user_id,
+                        last_interaction_at
+                    FROM
+                        direct_conversations
+                    WHERE
+                        user2_id = %s AND
+                        (last_interaction_at, conversation_id) < (%s::timestamptz, %s)
+                    ORDER BY
+                        last_interaction_at DESC,
+                        conversation_id DESC
+                    LIMIT %s
+                )
+                ORDER BY
+                    last_interaction_at DESC,
+                    conversation_id DESC
+                LIMIT %s
+            )
+            SELECT
+                p.conversation_id,
+                p.other_user_id,
+                COALESCE(cm.unread_count, 0) AS unread_count,
+                p.last_interaction_at,
+                lm.last_message,
+                p.last_interaction_at AS cursor_last_interaction_at
+            FROM
+                page p
+            LEFT JOIN
+                direct_conversation_members cm ON
+                cm.conversation_id = p.conversation_id AND
+                cm.user_id = %s
+            LEFT JOIN LATERAL (
+                SELECT
+                    jsonb_build_object(
+                        'message_id', m.message_id,
+                        'sender_id', m.sender_id,
+                        'content', CASE 
+                            WHEN LENGTH(m.content) > 100 THEN SUBSTRING(m.content, 1, 100) || '...' 
+                            ELSE m.content 
+                        END,
+                        'is_read', COALESCE(m.is_read, FALSE),
+                        'created_at', m.created_at
+                    ) AS last_message
+                FROM
+                    messages m
+                WHERE
+                    m.conversation_id = p.conversation_id
+                ORDER BY
+                    m.created_at DESC
+                LIMIT 1
+            ) lm ON TRUE
+            ORDER BY
+                p.last_interaction_at DESC,
+                p.conversation_id DESC;
+        """,
+        (
+            str(user.id), position[0], position[1], limit + 1,
+            str(user.id), position[0], position[1], limit + 1,
+            limit + 1,
+            str(user.id)
+        )
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    conversations, next_cursor = util.paginate(
+        r.content,
+        limit,
+        "cursor_last_interaction_at",
+        "conversation_id"
+    )
+    util.serialize_timestamps(conversations, "last_interaction_at")
+    r.content = {"conversations": conversations, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
 
 
 @directs_router.post("/directs")
-def create_direct_conversation(direct: DirectConversationCreate) -> Response:
+async def create_direct_conversation(direct: DirectConversationCreate) -> Response:
     users: list[int] = [str(x) for x in sorted([direct.user1_id, direct.user2_id])]
-    return database.db_create(
+    r: database.DataBaseResponse = await database.db_create(
         """
             INSERT INTO direct_conversations (
                 user1_id,
@@ -41,15 +164,20 @@ def create_direct_conversation(direct: DirectConversationCreate) -> Response:
             VALUES 
                 (%s, %s)
             RETURNING
-                user1_id, user2_id;
+                conversation_id, user1_id, user2_id;
         """,
         (users[0], users[1])
-    ).response()
+    )
+    if r.status_code == status.HTTP_201_CREATED:
+        for user_id in (r.content['user1_id'], r.content['user2_id']):
+            await realtime.publish(realtime.user_channel(user_id), "conversation_created", r.content)
+
+    return r.response()
 
 
 @directs_router.delete("/directs")
-def delete_direct_conversation(direct_conversation: UniqueID) -> Response:
-    return database.db_delete(
+async def delete_direct_conversation(direct_conversation: UniqueID) -> Response:
+    return (await database.db_delete(
         """
             DELETE FROM 
                 direct_conversations
@@ -59,6 +187,6 @@ def delete_direct_conversation(direct_conversation: UniqueID) -> Response:
                 conversation_id;
         """,
         (str(direct_conversation.id), )
-    ).response()
+    )).response()
 
 
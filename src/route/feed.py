@@ -1,84 +1,206 @@
 from fastapi import APIRouter, Query, status
 from fastapi.responses import Response
 from src.models.unique import UniqueID
-from src.models.post import Post
+from src.models.post import Post, PostCollection
+from src.models.comment import CommentProjection
 from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from src import block_filter
+from src import comment_tree
 from src import database
+from src import recommendation
+from src import timeline
+from src import util
 
 
 feed_router = APIRouter()
 
 
+# (created_at, post_id) position placed before any real post
+FIRST_PAGE: tuple = ("infinity", 2147483647)
+
+
+async def read_posts_by_ids(
+    post_ids: list[int],
+    comments: CommentProjection
+) -> database.DataBaseResponse:
+    # Hydrates published posts keeping the order of post_ids
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT 
+                p.post_id,
+                p.user_id,
+                p.title,
+                p.content,
+                p.language,                                
+                TO_CHAR(p.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
+                TO_CHAR(p.updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
+                get_post_metrics(p.post_id) AS metrics
+            FROM 
+                posts p
+            WHERE 
+                p.post_id = ANY(%s::int[]) AND
+                p.status = 'published'
+            ORDER BY 
+                array_position(%s::int[], p.post_id);
+        """,
+        (post_ids, post_ids)
+    )
+    if r.status_code == status.HTTP_200_OK and not await comment_tree.attach_comments(r.content, comments):
+        return database.DataBaseResponse(status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return r
+
+
 @feed_router.get("/feed/for_you", response_model=List[Post])
-def read_foryou_feed(user: UniqueID):
-    return Response(status_code=status.HTTP_200_OK)
+async def read_foryou_feed(
+    user: UniqueID,
+    offset: Optional[int] = Query(default=0, ge=0),
+    limit: Optional[int] = Query(default=20, ge=1, le=100),
+    comments: CommentProjection = Query(default=CommentProjection.preview)
+):
+    post_ids: list[int] | None = await recommendation.rank(user.id, offset, limit)
+    if post_ids is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    r: database.DataBaseResponse = await read_posts_by_ids(post_ids, comments)
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    r.content = await block_filter.filter_rows(user.id, r.content)
+    if r.content is None or not await util.mark_liked_posts(user.id, r.content):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return r.json_response()
 
 
-@feed_router.get("/feed/following", response_model=List[Post])
-def read_following_feed(
+@feed_router.get("/feed/following", response_model=PostCollection)
+async def read_following_feed(
     user: UniqueID,
     days: Optional[int] = Query(default=2),
-    offset: Optional[int] = Query(default=0),
-    limit: Optional[int] = Query(default=20)
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100),
+    comments: CommentProjection = Query(default=CommentProjection.preview)
+):
+    position: tuple | None = util.decode_cursor(cursor, FIRST_PAGE, util.TIMESTAMP_CURSOR)
+    before: tuple[datetime, int] | None = None if position is None else timeline.parse_position(position)
+    if before is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    since: datetime = datetime.now(timezone.utc) - timedelta(days=days)
+    entries = await timeline.read_timeline(user.id, before, since, limit)
+    if entries is None:
+        return await read_following_feed_from_database(user, days, position, limit, comments)
+
+    r: database.DataBaseResponse = await read_posts_by_ids([e[1] for e in entries[:limit]], comments)
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    posts: list[dict] | None = await block_filter.filter_rows(user.id, r.content)
+    if posts is None or not await util.mark_liked_posts(user.id, posts):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    next_cursor: str | None = None
+    if len(entries) > limit:
+        next_cursor = util.encode_cursor(entries[limit - 1][0], entries[limit - 1][1])
+    r.content = {"posts": posts, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
+
+
+async def read_following_feed_from_database(
+    user: UniqueID,
+    days: int,
+    position: tuple,
+    limit: int,
+    comments: CommentProjection
 ):
-    return database.db_read_all(
+    # Fan-out-on-read, used when the page is past the cached timeline
+    r: database.DataBaseResponse = await database.db_read_all(
         """
             SELECT 
                 p.post_id,
+                p.user_id,
                 p.title,
                 p.content,
                 p.language,                                
                 TO_CHAR(p.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
                 TO_CHAR(p.updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
-                get_post_comments(p.post_id) AS comments,
-                get_post_metrics(p.post_id) AS metrics
+                get_post_metrics(p.post_id) AS metrics,
+                p.created_at AS cursor_created_at
             FROM 
-                posts p
-            INNER JOIN 
-                follows f ON f.follower_id = p.user_id
+                follows f
             INNER JOIN 
-                users u ON u.user_id = f.follower_id
+                posts p ON p.user_id = f.followed_id
             WHERE 
-                f.followed_id = %s AND 
+                f.follower_id = %s AND 
                 p.status = 'published' AND 
-                p.created_at >= CURRENT_TIMESTAMP - INTERVAL '%s days'
+                p.created_at >= CURRENT_TIMESTAMP - (%s || ' days')::interval AND
+                (p.created_at, p.post_id) < (%s::timestamptz, %s)
             ORDER BY 
-                p.created_at DESC
-            LIMIT %s
-            OFFSET %s;
+                p.created_at DESC,
+                p.post_id DESC
+            LIMIT %s;
         """,
-        (str(user.id), days, limit, offset)
-    ).json_response()
+        (str(user.id), str(days), position[0], position[1], limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
 
+    posts, next_cursor = util.paginate(r.content, limit, "cursor_created_at", "post_id")
+    if not await comment_tree.attach_comments(posts, comments):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    posts = await block_filter.filter_rows(user.id, posts)
+    if posts is None or not await util.mark_liked_posts(user.id, posts):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    r.content = {"posts": posts, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
 
-@feed_router.get("/feed/user", response_model=List[Post])
-def read_user_posts(
+
+@feed_router.get("/feed/user", response_model=PostCollection)
+async def read_user_posts(
     user: UniqueID,
+    viewer_id: Optional[int] = Query(default=None),
     days: Optional[int] = Query(default=2),
-    offset: Optional[int] = Query(default=0),
-    limit: Optional[int] = Query(default=20)
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100),
+    comments: CommentProjection = Query(default=CommentProjection.preview)
 ):
-    return database.db_read_all(
+    position: tuple | None = util.decode_cursor(cursor, FIRST_PAGE, util.TIMESTAMP_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    r: database.DataBaseResponse = await database.db_read_all(
         """
             SELECT 
                 p.post_id,
+                p.user_id,
                 p.title,
                 p.content,
                 p.language,                                
                 TO_CHAR(p.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
                 TO_CHAR(p.updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
-                get_post_comments(p.post_id) AS comments,
-                get_post_metrics(p.post_id) AS metrics
+                get_post_metrics(p.post_id) AS metrics,
+                p.created_at AS cursor_created_at
             FROM 
                 posts p            
             WHERE 
                 p.user_id = %s AND                
                 p.status = 'published' AND
-                p.created_at >= CURRENT_TIMESTAMP - INTERVAL '%s days'
+                p.created_at >= CURRENT_TIMESTAMP - (%s || ' days')::interval AND
+                (p.created_at, p.post_id) < (%s::timestamptz, %s)
             ORDER BY 
-                p.created_at DESC
-            LIMIT %s
-            OFFSET %s;
+                p.created_at DESC,
+                p.post_id DESC
+            LIMIT %s;
         """,
-        (str(user.id), days, limit, offset)
-    ).json_response()
\ No newline at end of file
+        (str(user.id), str(days), position[0], position[1], limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    posts, next_cursor = util.paginate(r.content, limit, "cursor_created_at", "post_id")
+    if not await comment_tree.attach_comments(posts, comments):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    posts = await block_filter.filter_rows(viewer_id, posts)
+    if posts is None or not await util.mark_liked_posts(viewer_id, posts):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    r.content = {"posts": posts, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
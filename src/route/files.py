@@ -0,0 +1,23 @@
+from fastapi import APIRouter, status
+from fastapi.responses import FileResponse, Response
+from src.storage import get_storage, LocalFileStorage
+import mimetypes
+
+
+files_router = APIRouter()
+
+
+@files_router.get("/files/{name}")
+async def read_file(name: str):
+    # Only LocalFileStorage serves its own files; blobs are content addressed
+    # so they never change and can be cached forever. Blobs have no extension,
+    # the content type comes from the one in the URL
+    storage = get_storage()
+    path: str | None = storage.get_path(name) if isinstance(storage, LocalFileStorage) else None
+    if path is None:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    return FileResponse(
+        path,
+        media_type=mimetypes.guess_type(name)[0],
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
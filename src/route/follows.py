@@ -1,48 +1,106 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query, status
 from src.models.unique import UniqueID
 from fastapi.responses import JSONResponse, Response
-from src.models.follow import Follow, Followed, Follower
-from typing import List
+from src.models.follow import Follow, Followed, Follower, FollowRelationship, FollowPage
+from typing import List, Optional
+from src import cache
 from src import database
+from src import recommendation
+from src import social_graph
+from src import timeline
+from src import util
 
 
 follows_route = APIRouter()
 
 
-@follows_route.get("/follows/followers", response_model=List[Follower])
-def read_followers(user: UniqueID) -> JSONResponse:
-    return database.db_read_all(
-        """
-            SELECT 
-                follower_id
-            FROM 
-                follows
-            WHERE 
-                followed_id = %s;
-        """,
-        (str(user.id), )
-    ).json_response()        
+async def read_follow_page(owner_column: str, user_column: str, user_id: int, cursor: str | None, limit: int):
+    # (created_at, id) position placed before any real follow
+    position: tuple | None = util.decode_cursor(cursor, ("infinity", 2147483647), util.TIMESTAMP_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
 
-
-@follows_route.get("/follows/following", response_model=List[Followed])
-def read_followings(user: UniqueID) -> JSONResponse:    
-    r: database.DataBaseResponse = database.db_read_all(
-        """
+    # Walks idx_follower / idx_followed and hydrates only the rows of the page
+    r: database.DataBaseResponse = await database.db_read_all(
+        f"""
             SELECT
-                followed_id
+                {util.USER_SUMMARY_COLUMNS},
+                EXISTS (
+                    SELECT 1 FROM follows b WHERE b.follower_id = f.followed_id AND b.followed_id = f.follower_id
+                ) AS follows_back,
+                f.created_at AS followed_at
             FROM
-                follows
+                follows f
+            INNER JOIN
+                users u ON u.user_id = f.{user_column}
+            {util.USER_SUMMARY_JOINS}
             WHERE
-            follower_id = %s;
+                f.{owner_column} = %s AND
+                (f.created_at, f.{user_column}) < (%s::timestamptz, %s)
+            ORDER BY
+                f.created_at DESC,
+                f.{user_column} DESC
+            LIMIT %s;
         """,
-        (str(user.id), )
-    )    
+        (str(user_id), position[0], position[1], limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    users, next_cursor = util.paginate(r.content, limit, "followed_at", "user_id")
+    util.serialize_timestamps(users, "followed_at")
+    r.content = {"users": users, "limit": limit, "next_cursor": next_cursor}
     return r.json_response()
 
 
+@follows_route.get("/follows/followers", response_model=FollowPage)
+async def read_followers(
+    user: UniqueID,
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
+):
+    return await read_follow_page("followed_id", "follower_id", user.id, cursor, limit)
+
+
+@follows_route.get("/follows/following", response_model=FollowPage)
+async def read_followings(
+    user: UniqueID,
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
+):
+    return await read_follow_page("follower_id", "followed_id", user.id, cursor, limit)
+
+
+@follows_route.get("/follows/followers/ids", response_model=List[Follower])
+async def read_follower_ids(user: UniqueID) -> JSONResponse:
+    ids: list[int] | None = await social_graph.followers(user.id)
+    if ids is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return JSONResponse(content=[{"follower_id": x} for x in ids])
+
+
+@follows_route.get("/follows/following/ids", response_model=List[Followed])
+async def read_following_ids(user: UniqueID) -> JSONResponse:    
+    ids: list[int] | None = await social_graph.following(user.id)
+    if ids is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return JSONResponse(content=[{"followed_id": x} for x in ids])
+
+
+@follows_route.get("/follows/relationship", response_model=FollowRelationship)
+async def read_relationship(
+    user_id: int = Query(),
+    other_id: int = Query()
+):
+    r: dict[str, bool] | None = await social_graph.relationship(user_id, other_id)
+    if r is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return JSONResponse(content=r)
+
+
 @follows_route.post("/follows")
-def create_follow(follow: Follow) -> Response:
-    return database.db_create(
+async def create_follow(follow: Follow) -> Response:
+    r: database.DataBaseResponse = await database.db_create(
         """
             INSERT INTO follows (
                 follower_id,
@@ -54,12 +112,22 @@ def create_follow(follow: Follow) -> Response:
                 follower_id;
         """,
         (str(follow.follower_id), str(follow.followed_id))
-    ).response()
+    )
+    if r.status_code == status.HTTP_201_CREATED:
+        await cache.invalidate(
+            f"user_metrics:{follow.follower_id}",
+            f"user_metrics:{follow.followed_id}"
+        )
+        social_graph.on_follow(follow.follower_id, follow.followed_id)
+        recommendation.invalidate_user_pool(follow.follower_id)
+        await timeline.on_follow(follow.follower_id, follow.followed_id)
+
+    return r.response()
 
 
 @follows_route.delete("/follows")
-def delete_follow(follow: Follow) -> Response:
-    return database.db_delete(
+async def delete_follow(follow: Follow) -> Response:
+    r: database.DataBaseResponse = await database.db_delete(
         """
             DELETE FROM 
                 follows
@@ -70,4 +138,14 @@ def delete_follow(follow: Follow) -> Response:
                 follower_id;
         """,
         (str(follow.follower_id), str(follow.followed_id))
-    ).response()
+    )
+    if r.status_code == status.HTTP_204_NO_CONTENT:
+        await cache.invalidate(
+            f"user_metrics:{follow.follower_id}",
+            f"user_metrics:{follow.followed_id}"
+        )
+        social_graph.on_unfollow(follow.follower_id, follow.followed_id)
+        recommendation.invalidate_user_pool(follow.follower_id)
+        await timeline.on_unfollow(follow.follower_id, follow.followed_id)
+
+    return r.response()
@@ -1,21 +1,28 @@
-from fastapi import APIRouter, Query
-from src.models.post import Post
+from fastapi import APIRouter, Query, status
+from fastapi.responses import Response
+from src.models.post import PostCollection
 from src.models.unique import UniqueID
 from src.models.search import SearchCreate, Search, SearchDelete
 from typing import List, Optional
 from src import database
+from src import util
 
 
 history_router = APIRouter()
 
 
-@history_router.get("/history/user/posts", response_model=List[Post])
-def read_user_post_view_history(
+@history_router.get("/history/user/posts", response_model=PostCollection)
+async def read_user_post_view_history(
     user: UniqueID,
-    limit: Optional[int] = Query(default=20),
-    offset: Optional[int] = Query(default=0)
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
 ):
-    return database.db_read_all(
+    # (viewed_at, post_id) position placed before any real view
+    position: tuple | None = util.decode_cursor(cursor, ("infinity", 2147483647), util.TIMESTAMP_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    r: database.DataBaseResponse = await database.db_read_all(
         """
             SELECT 
                 p.post_id,
@@ -30,27 +37,33 @@ def read_user_post_view_history(
                 p.is_pinned,                
                 TO_CHAR(p.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
                 TO_CHAR(p.updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
-                get_post_metrics(p.post_id) AS metrics
+                get_post_metrics(p.post_id) AS metrics,
+                uv.viewed_at AS cursor_viewed_at
             FROM 
                 user_viewed_posts uv
             INNER JOIN 
                 posts p ON uv.post_id = p.post_id
-            INNER JOIN 
-                users u ON p.user_id = u.user_id
             WHERE 
-                uv.user_id = %s
+                uv.user_id = %s AND
+                (uv.viewed_at, uv.post_id) < (%s::timestamptz, %s)
             ORDER BY 
-                uv.viewed_at DESC
-            LIMIT %s 
-            OFFSET %s;
+                uv.viewed_at DESC,
+                uv.post_id DESC
+            LIMIT %s;
         """,
-        (str(user.id), limit, offset)
-    ).json_response()
+        (str(user.id), position[0], position[1], limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    posts, next_cursor = util.paginate(r.content, limit, "cursor_viewed_at", "post_id")
+    r.content = {"posts": posts, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
 
 
 @history_router.post("/history/user/posts")
-def mark_post_as_readed(user: UniqueID, post_id: int = Query):
-    return database.db_create(
+async def mark_post_as_readed(user: UniqueID, post_id: int = Query):
+    return (await database.db_create(
         """
             INSERT INTO user_viewed_posts (
                 user_id,
@@ -65,12 +78,12 @@ def mark_post_as_readed(user: UniqueID, post_id: int = Query):
                 user_id
         """,
         (str(user.id), str(post_id))
-    ).response()
+    )).response()
 
 
 @history_router.get("/history/user/search", response_model=List[Search])
-def read_user_search_history(user: UniqueID):
-    return database.db_read_all(
+async def read_user_search_history(user: UniqueID):
+    return (await database.db_read_all(
         """
             SELECT 
                 search_query,
@@ -84,12 +97,12 @@ def read_user_search_history(user: UniqueID):
             DESC;
         """,
         (str(user.id), )
-    ).json_response()
+    )).json_response()
 
 
 @history_router.post("/history/user/search")
-def register_user_search(search: SearchCreate):
-    return database.db_create(
+async def register_user_search(search: SearchCreate):
+    return (await database.db_create(
         """
             INSERT INTO user_search_history (
                 user_id,
@@ -101,12 +114,12 @@ def register_user_search(search: SearchCreate):
                 user_id
         """,
         (str(search.user_id), search.search_query)
-    ).response()
+    )).response()
 
 
 @history_router.delete("/history/user/search")
-def delete_user_search(search: SearchDelete):
-    return database.db_delete(
+async def delete_user_search(search: SearchDelete):
+    return (await database.db_delete(
         """
             DELETE FROM 
                 user_search_history
@@ -117,12 +130,12 @@ def delete_user_search(search: SearchDelete):
                 user_id;
         """,
         (search.user_id, search.search_query)
-    ).response()
+    )).response()
 
 
 @history_router.delete("/history/user/search/clear")
-def clear_user_search_history(user: UniqueID):
-    return database.db_delete(
+async def clear_user_search_history(user: UniqueID):
+    return (await database.db_delete(
         """
             DELETE FROM 
                 user_search_history
@@ -130,4 +143,4 @@ def clear_user_search_history(user: UniqueID):
                 user_id = %s;            
         """,
         (str(user.id), )
-    ).response()
+    )).response()
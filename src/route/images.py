@@ -1,8 +1,9 @@
 from fastapi import APIRouter, status, UploadFile, File, Form, Query
 from fastapi.responses import Response
-from src.models.image import Image
+from src.models.image import Image, ImageSize
 from src.models.unique import UniqueID
 from typing import List
+from src import cache
 from src import database
 from src.storage import get_storage
 from src import util
@@ -13,32 +14,37 @@ images_router = APIRouter()
 
 
 @images_router.get("/images/user/profile", response_model=Image)
-def read_user_profile_image(user: UniqueID):
-    return database.db_read_one(
+async def read_user_profile_image(
+    user: UniqueID,
+    size: ImageSize = Query(default=ImageSize.full)
+):
+    return (await database.db_read_one(
         """
             SELECT 
-                i.image_url
+                COALESCE(v.image_url, i.image_url) AS image_url
             FROM 
                 users_profile_images upi
             JOIN 
                 images i ON upi.profile_image_id = i.image_id
+            LEFT JOIN
+                image_variants v ON v.image_id = i.image_id AND v.variant = %s
             WHERE 
                 upi.user_id = %s;
         """,
-        (str(user.id), )
-    ).json_response()
+        (size.value, str(user.id))
+    )).json_response()
 
 
 @images_router.post("/images/user/profile")
-def create_user_profile_image(token: str = Form(), file: UploadFile = File()):
-    image_id: str | None = util.create_new_image(
+async def create_user_profile_image(token: str = Form(), file: UploadFile = File()):
+    image_id: str | None = await util.create_new_image(
         get_storage().get_user_folder(token),
         file
     )
     if image_id is None:
         return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    return database.db_create(
+    return (await database.db_create(
         """
             INSERT INTO users_profile_images (
                 user_id,
@@ -54,12 +60,12 @@ def create_user_profile_image(token: str = Form(), file: UploadFile = File()):
                 user_id
         """,
         (str(token), image_id)
-    ).response()
+    )).response()
 
 
 @images_router.delete("/images/user/profile")
-def delete_user_profile_image(user: UniqueID):
-    return database.db_update(
+async def delete_user_profile_image(user: UniqueID):
+    return (await database.db_update(
         """
             UPDATE
                 users_profile_images
@@ -71,36 +77,41 @@ def delete_user_profile_image(user: UniqueID):
                 user_id
         """,
         (str(user.id), )
-    ).response()
+    )).response()
 
 
 @images_router.get("/images/user/cover", response_model=Image)
-def read_user_cover_image(user: UniqueID):
-    return database.db_read_one(
+async def read_user_cover_image(
+    user: UniqueID,
+    size: ImageSize = Query(default=ImageSize.full)
+):
+    return (await database.db_read_one(
         """
             SELECT 
-                i.image_url
+                COALESCE(v.image_url, i.image_url) AS image_url
             FROM 
                 users_profile_images upi
             JOIN 
                 images i ON upi.cover_image_id = i.image_id
+            LEFT JOIN
+                image_variants v ON v.image_id = i.image_id AND v.variant = %s
             WHERE 
                 upi.user_id = %s;
         """,
-        (str(user.id), )
-    ).json_response()
+        (size.value, str(user.id))
+    )).json_response()
 
 
 @images_router.post("/images/user/cover")
-def create_user_cover_image(token: str = Form(), file: UploadFile = File()):
-    image_id: str | None = util.create_new_image(
+async def create_user_cover_image(token: str = Form(), file: UploadFile = File()):
+    image_id: str | None = await util.create_new_image(
         get_storage().get_user_folder(token),
         file
     )
     if image_id is None:
         return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    return database.db_create(
+    return (await database.db_create(
         """
             INSERT INTO users_profile_images (
                 user_id,
@@ -116,12 +127,12 @@ def create_user_cover_image(token: str = Form(), file: UploadFile = File()):
                 user_id
         """,
         (str(token), image_id)
-    ).response()
+    )).response()
 
 
 @images_router.delete("/images/user/cover")
-def delete_user_cover_image(user: UniqueID):
-    return database.db_update(
+async def delete_user_cover_image(user: UniqueID):
+    return (await database.db_update(
         """
             UPDATE
                 users_profile_images
@@ -133,15 +144,28 @@ def delete_user_cover_image(user: UniqueID):
                 user_id
         """,
         (str(user.id), )
-    ).response()
+    )).response()
 
 
 @images_router.get("/images/posts", response_model=List[Image])
-def read_post_images(post: UniqueID):
-    return database.db_read_all(
+async def read_post_images(
+    post: UniqueID,
+    size: ImageSize = Query(default=ImageSize.full)
+):
+    # Every variant is cached under one key; the requested size is picked here
+    r: database.DataBaseResponse = await cache.db_read_all(
+        f"post_images:{post.id}",
         """
         SELECT 
-            i.image_url
+            i.image_url,
+            COALESCE(
+                (
+                    SELECT jsonb_object_agg(v.variant, v.image_url)
+                    FROM image_variants v
+                    WHERE v.image_id = i.image_id
+                ),
+                '{}'::jsonb
+            ) AS variants
         FROM 
             post_images pi
         JOIN 
@@ -152,57 +176,39 @@ def read_post_images(post: UniqueID):
             BY pi.position;
         """,
         (str(post.id), )        
-    ).json_response()
+    )
+    if r.status_code == status.HTTP_200_OK:
+        r.content = [
+            {"image_url": row['variants'].get(size.value, row['image_url'])}
+            for row in r.content
+        ]
+    return r.json_response()
 
 
 @images_router.post("/images/posts")
-def create_post_images(
+async def create_post_images(
     post_id: int = Query(), 
     file: list[UploadFile] = File()
 ):
-    post_folder: str = get_storage().get_post_folder(post_id)
+    r: database.DataBaseResponse = await util.create_post_images(post_id, file)
+    if r.status_code == status.HTTP_201_CREATED:
+        await cache.invalidate(f"post_images:{post_id}")
 
-    for i, image_file in enumerate(file):        
-        image_id: str | None = util.create_new_image(post_folder, image_file)
-        if image_id is None:
-            return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        r: database.DataBaseResponse = database.db_create(
-            """
-                INSERT INTO post_images (
-                    post_id,
-                    image_id,
-                    position
-                )
-                VALUES 
-                    (%s, %s, %s)
-                ON CONFLICT
-                    (post_id, position)
-                DO UPDATE SET
-                    image_id = EXCLUDED.image_id
-                RETURNING
-                    post_id
-            """,
-            (str(post_id), image_id, str(i))
-        )
-        if r.status_code != status.HTTP_201_CREATED:
-            return r.response()
-        
-    return Response(status_code=status.HTTP_201_CREATED)
+    return r.response()
 
 
 @images_router.put("/images/posts")
-def update_post_image(
+async def update_post_image(
     post_id: int = Query(),
     position: int = Query(),
     file: UploadFile = File()
 ):
     post_folder: str = get_storage().get_post_folder(post_id)
-    image_id: str | None = util.create_new_image(post_folder, file)
+    image_id: str | None = await util.create_new_image(post_folder, file)
     if image_id is None:
         return Response(status.HTTP_500_INTERNAL_SERVER_ERROR)
     
-    return database.db_update(
+    r: database.DataBaseResponse = await database.db_update(
         """
             UPDATE
                 post_images
@@ -215,15 +221,19 @@ def update_post_image(
                 post_id
         """,
         (image_id, str(post_id), str(position))
-    ).response()
+    )
+    if r.status_code == status.HTTP_201_CREATED:
+        await cache.invalidate(f"post_images:{post_id}")
+
+    return r.response()
 
 
 @images_router.delete("/images/posts")
-def delete_post_image(
+async def delete_post_image(
     post_id: int = Query(),
     position: int = Query()
 ):
-    return database.db_delete(
+    r: database.DataBaseResponse = await database.db_delete(
         """
             DELETE FROM
                 post_images
@@ -234,4 +244,8 @@ def delete_post_image(
                 post_id
         """,
         (str(post_id), str(position))
-    ).response()
\ No newline at end of file
+    )
+    if r.status_code == status.HTTP_204_NO_CONTENT:
+        await cache.invalidate(f"post_images:{post_id}")
+
+    return r.response()
\ No newline at end of file
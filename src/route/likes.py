@@ -1,117 +1,199 @@
-from fastapi import APIRouter, status, HTTPException
+from fastapi import APIRouter, Query, status, HTTPException
 from fastapi.responses import JSONResponse, Response
-from src.models.comment_like import CommentLike, CommentLikeCreate, CommentLikeUnique
-from src.models.post_like import PostLike, PostLikeUnique, PostLikeCreate
+from src.models.comment_like import CommentLikeCreate, CommentLikeUnique, CommentLikeState, CommentLikers, ViewerCommentLikes
+from src.models.post_like import PostLikeUnique, PostLikeCreate, PostLikeState, PostLikers, ViewerPostLikes
 from src.models.unique import UniqueID
-from typing import List
+from typing import List, Optional
 from src import database
+from src import like_buffer
+from src import util
 
 
 likes_router = APIRouter()
 
 
+MAX_VIEWER_IDS: int = 100
 
-@likes_router.get("/likes/posts", response_model=List[PostLike])
-def read_post_likes(post: UniqueID) -> JSONResponse:
-    return database.db_read_all(
-        """
-            SELECT 
-                user_id, 
-                post_id,                    
-                TO_CHAR(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
-            FROM 
-                post_likes
-            WHERE 
-                post_id = %s;
-        """, 
-        (str(post.id), )
-    ).json_response()
-
-
-@likes_router.post("/likes/posts")
-def create_post_like(post_like: PostLikeCreate) -> Response:
-    return database.db_create(
-        """
-            INSERT INTO post_likes 
-                (post_id, user_id)
-            VALUES 
-                (%s, %s)            
-            RETURNING 
-                post_id;
-        """,
-        (str(post_like.post_id), str(post_like.user_id))
-    ).response()
-
-
-@likes_router.delete("/likes/posts")
-def delete_post_like(post_like: PostLikeUnique) -> Response:
-    return database.db_delete(
-        """
-            DELETE FROM 
-                post_likes
-            WHERE 
-                user_id = %s AND 
-                post_id = %s 
-            RETURNING 
-                post_id;
-        """,
-        (str(post_like.user_id), str(post_like.post_id))
-    ).response()
-
-
-@likes_router.get("/likes/comments", response_model=List[CommentLike])
-def read_likes_from_comment(comment: UniqueID) -> JSONResponse:
-    return database.db_read_all(
-        """ 
-        SELECT 
-            comment_id, 
-            user_id,
-            post_id,            
-            TO_CHAR(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
-        FROM 
-            comment_likes 
-        WHERE 
-            comment_id = %s;
-        """,
-        (str(comment.id), )
-    ).json_response()
-
-
-@likes_router.post("/likes/comments")
-def create_comment_like(comment_like: CommentLikeCreate) -> Response:
-    return database.db_create(
-        """
-            INSERT INTO comment_likes 
-                (user_id, post_id, comment_id)
-            VALUES 
-                (%s, %s, %s)            
-            RETURNING 
-                comment_id;
-        """,
-        (
-            str(comment_like.user_id), 
-            str(comment_like.post_id), 
-            str(comment_like.comment_id)
+
+# The flush skips rows whose user or target does not exist, so they are
+# rejected here instead of being accepted and then silently lost. Params
+# follow the order of the like buffer keys
+EXISTS_QUERIES: dict[str, str] = {
+    "post": """
+        SELECT
+            EXISTS (SELECT 1 FROM users WHERE user_id = %s) AND
+            EXISTS (SELECT 1 FROM posts WHERE post_id = %s) AS found;
+    """,
+    "comment": """
+        SELECT
+            EXISTS (SELECT 1 FROM users WHERE user_id = %s) AND
+            EXISTS (SELECT 1 FROM comments WHERE post_id = %s AND comment_id = %s) AS found;
+    """
+}
+
+
+def likers_page(r: database.DataBaseResponse, limit: int) -> Response:
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+    users, next_cursor = util.paginate(r.content, limit, "liked_at", "user_id")
+    util.serialize_timestamps(users, "liked_at")
+    r.content = {"users": users, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
+
+
+async def buffer_like(target: str, key: tuple, state: dict) -> Response:
+    # Likes are idempotent: the same request always answers with the state
+    # the next flush of the like buffer will store
+    r: database.DataBaseResponse = await database.db_read_one(
+        EXISTS_QUERIES[target],
+        tuple(str(k) for k in key)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+    if not r.content['found']:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    if not await like_buffer.get_like_buffer().set(target, key, state['liked']):
+        return Response(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(int(like_buffer.FLUSH_INTERVAL) or 1)}
         )
-    ).response()
-
-
-@likes_router.delete("/likes/comments", status_code=status.HTTP_204_NO_CONTENT)
-def delete_comment_like(comment_like: CommentLikeUnique) -> Response:
-    return database.db_delete(
-        """
-            DELETE FROM 
-                comment_likes
-            WHERE 
-                user_id = %s AND 
-                post_id = %s AND
-                comment_id = %s
-            RETURNING 
-                comment_id;
+    return JSONResponse(content=state, status_code=status.HTTP_202_ACCEPTED)
+
+
+@likes_router.get("/likes/posts", response_model=PostLikers)
+async def read_post_likes(
+    post: UniqueID,
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
+):
+    # (created_at, user_id) position placed before any real like
+    position: tuple | None = util.decode_cursor(cursor, ("infinity", 2147483647), util.TIMESTAMP_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    # A single post_likes partition, walked through idx_post_likes_post
+    r: database.DataBaseResponse = await database.db_read_all(
+        f"""
+            SELECT
+                {util.USER_SUMMARY_COLUMNS},
+                pl.created_at AS liked_at
+            FROM
+                post_likes pl
+            INNER JOIN
+                users u ON u.user_id = pl.user_id
+            {util.USER_SUMMARY_JOINS}
+            WHERE
+                pl.post_id = %s AND
+                (pl.created_at, pl.user_id) < (%s::timestamptz, %s)
+            ORDER BY
+                pl.created_at DESC,
+                pl.user_id DESC
+            LIMIT %s;
         """,
-        (
-            str(comment_like.user_id), 
-            str(comment_like.post_id), 
-            str(comment_like.comment_id)
-        )
-    ).response()    
\ No newline at end of file
+        (str(post.id), position[0], position[1], limit + 1)
+    )
+    return likers_page(r, limit)
+
+
+@likes_router.get("/likes/posts/viewer", response_model=ViewerPostLikes)
+async def read_viewer_post_likes(
+    user_id: int = Query(),
+    ids: List[int] = Query(max_length=MAX_VIEWER_IDS)
+):
+    liked: set[int] | None = await util.liked_posts(user_id, list(set(ids)))
+    if liked is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return JSONResponse(content={"user_id": user_id, "post_ids": sorted(liked)})
+
+
+@likes_router.post("/likes/posts", status_code=status.HTTP_202_ACCEPTED, response_model=PostLikeState)
+async def create_post_like(post_like: PostLikeCreate) -> Response:
+    return await buffer_like(
+        "post",
+        (post_like.user_id, post_like.post_id),
+        {"user_id": post_like.user_id, "post_id": post_like.post_id, "liked": True}
+    )
+
+
+@likes_router.delete("/likes/posts", status_code=status.HTTP_202_ACCEPTED, response_model=PostLikeState)
+async def delete_post_like(post_like: PostLikeUnique) -> Response:
+    return await buffer_like(
+        "post",
+        (post_like.user_id, post_like.post_id),
+        {"user_id": post_like.user_id, "post_id": post_like.post_id, "liked": False}
+    )
+
+
+@likes_router.get("/likes/comments", response_model=CommentLikers)
+async def read_likes_from_comment(
+    comment: UniqueID,
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
+):
+    # (created_at, user_id) position placed before any real like
+    position: tuple | None = util.decode_cursor(cursor, ("infinity", 2147483647), util.TIMESTAMP_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    # The comment's post_id is resolved first so only its partition is scanned
+    r: database.DataBaseResponse = await database.db_read_all(
+        f"""
+            SELECT
+                {util.USER_SUMMARY_COLUMNS},
+                cl.created_at AS liked_at
+            FROM
+                comment_likes cl
+            INNER JOIN
+                users u ON u.user_id = cl.user_id
+            {util.USER_SUMMARY_JOINS}
+            WHERE
+                cl.post_id = (SELECT c.post_id FROM comments c WHERE c.comment_id = %s) AND
+                cl.comment_id = %s AND
+                (cl.created_at, cl.user_id) < (%s::timestamptz, %s)
+            ORDER BY
+                cl.created_at DESC,
+                cl.user_id DESC
+            LIMIT %s;
+        """,
+        (str(comment.id), str(comment.id), position[0], position[1], limit + 1)
+    )
+    return likers_page(r, limit)
+
+
+@likes_router.get("/likes/comments/viewer", response_model=ViewerCommentLikes)
+async def read_viewer_comment_likes(
+    user_id: int = Query(),
+    ids: List[int] = Query(max_length=MAX_VIEWER_IDS)
+):
+    liked: set[int] | None = await util.liked_comments(user_id, list(set(ids)))
+    if liked is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return JSONResponse(content={"user_id": user_id, "comment_ids": sorted(liked)})
+
+
+@likes_router.post("/likes/comments", status_code=status.HTTP_202_ACCEPTED, response_model=CommentLikeState)
+async def create_comment_like(comment_like: CommentLikeCreate) -> Response:
+    return await buffer_like(
+        "comment",
+        (comment_like.user_id, comment_like.post_id, comment_like.comment_id),
+        {
+            "user_id": comment_like.user_id,
+            "post_id": comment_like.post_id,
+            "comment_id": comment_like.comment_id,
+            "liked": True
+        }
+    )
+
+
+@likes_router.delete("/likes/comments", status_code=status.HTTP_202_ACCEPTED, response_model=CommentLikeState)
+async def delete_comment_like(comment_like: CommentLikeUnique) -> Response:
+    return await buffer_like(
+        "comment",
+        (comment_like.user_id, comment_like.post_id, comment_like.comment_id),
+        {
+            "user_id": comment_like.user_id,
+            "post_id": comment_like.post_id,
+            "comment_id": comment_like.comment_id,
+            "liked": False
+        }
+    )
@@ -1,131 +1,229 @@
 from fastapi import APIRouter, status, Query
 from fastapi.responses import Response
-from src.models.message import MessageCreate, Message, MessageUpdate, MessageReadAll, UserMessageList
+from src.models.message import Message, MessageCreate, MessagePage, MessageUpdate, MessageReadAll, UserMessageList
 from src.models.direct import DirectConversation
 from src.models.unique import UniqueID
-from typing import List
+from typing import Optional
 from src import database
+from src import realtime
+from src import util
+import os
 
 
 messages_router = APIRouter()
 
 
-@messages_router.get("/directs/messages", response_model=List[Message])
-def read_conversation_messages(conversation: UniqueID):
-    return database.db_read_all(
+# Columns of a message as returned to clients and realtime subscribers
+MESSAGE_COLUMNS: str = """
+    m.message_id,
+    m.conversation_id,
+    m.sender_id,
+    m.content,
+    m.created_at,
+    m.updated_at,
+    m.read_at,
+    m.is_read,
+    m.reply_to_message_id
+"""
+
+
+# Busy conversations only bump last_interaction_at once per window;
+# 0 updates it on every write
+INTERACTION_COALESCE_SECONDS: float = float(os.getenv("MESSAGES_INTERACTION_COALESCE_SECONDS", 0))
+
+
+# Expects the written message as "m" with its timestamp as "interaction_at"
+TOUCH_CONVERSATION: str = """
+    touched AS (
+        UPDATE
+            direct_conversations dc
+        SET
+            last_interaction_at = m.interaction_at
+        FROM
+            m
+        WHERE
+            dc.conversation_id = m.conversation_id AND
+            (
+                dc.last_interaction_at IS NULL OR
+                dc.last_interaction_at < m.interaction_at - (%s || ' seconds')::interval
+            )
+        RETURNING
+            dc.conversation_id
+    )
+"""
+
+
+@messages_router.get("/directs/messages", response_model=MessagePage)
+async def read_conversation_messages(
+    conversation: UniqueID,
+    before: Optional[int] = Query(default=None),
+    after: Optional[int] = Query(default=None),
+    limit: int = Query(default=50, ge=1, le=200)
+):
+    # Without a cursor the newest messages are returned. before/after take a
+    # message_id and page towards older/newer messages respectively.
+    if before is not None and after is not None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    anchor: str = ""
+    anchor_params: tuple = ()
+    direction: str = "DESC"
+    if before is not None or after is not None:
+        op: str = "<" if before is not None else ">"
+        direction = "DESC" if before is not None else "ASC"
+        # The plain created_at bound lets the planner range scan
+        # idx_messages_conversation; the row comparison breaks ties
+        anchor = f"""
+            INNER JOIN (
+                SELECT 
+                    created_at,
+                    message_id
+                FROM 
+                    messages
+                WHERE 
+                    message_id = %s AND
+                    conversation_id = %s
+            ) a ON 
+                m.created_at {op}= a.created_at AND
+                (m.created_at, m.message_id) {op} (a.created_at, a.message_id)
         """
+        anchor_params = (str(before if before is not None else after), str(conversation.id))
+
+    r: database.DataBaseResponse = await database.db_read_all(
+        f"""
             SELECT 
-                message_id,
-                conversation_id,
-                sender_id,
-                content,                   
-                TO_CHAR(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
-                TO_CHAR(updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
-                COALESCE(TO_CHAR(read_at, 'YYYY-MM-DD HH24:MI:SS'), 'Not read') AS readed_at,
-                is_read,
-                reply_to_message_id
+                {MESSAGE_COLUMNS}
             FROM 
-                messages
+                messages m
+            {anchor}
             WHERE 
-                conversation_id = %s
+                m.conversation_id = %s
             ORDER BY 
-                created_at ASC;
+                m.created_at {direction},
+                m.message_id {direction}
+            LIMIT %s;
         """,
-        (str(conversation.id), )
-    ).json_response()
+        anchor_params + (str(conversation.id), limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
 
+    messages: list[dict] = r.content[:limit]
+    if direction == "DESC":
+        messages.reverse()
+    r.content = {
+        "messages": util.serialize_timestamps(messages, "created_at", "updated_at", "read_at"),
+        "limit": limit,
+        "has_more": len(r.content) > limit
+    }
+    return r.json_response()
 
-@messages_router.post("/directs/messages")
-def create_message(message: MessageCreate) -> Response:
-    r: database.DataBaseResponse = database.db_create(
-        """
-            INSERT INTO messages (
-                conversation_id,
-                sender_id,
-                content,
-                reply_to_message_id
-            )
-            VALUES 
-                (%s, %s, %s, %s)
-            RETURNING 
-                created_at;
+
+@messages_router.post("/directs/messages", response_model=Message, status_code=status.HTTP_201_CREATED)
+async def create_message(message: MessageCreate) -> Response:
+    # The message and last_interaction_at are written by one statement
+    r: database.DataBaseResponse = await database.db_create(
+        f"""
+            WITH m AS (
+                INSERT INTO messages (
+                    conversation_id,
+                    sender_id,
+                    content,
+                    reply_to_message_id
+                )
+                VALUES 
+                    (%s, %s, %s, %s)
+                RETURNING 
+                    *,
+                    created_at AS interaction_at
+            ),
+            {TOUCH_CONVERSATION}
+            SELECT 
+                {MESSAGE_COLUMNS}
+            FROM 
+                m;
         """,
         (
             str(message.conversation_id),
             str(message.sender_id),
             message.content,
-            message.reply_to_message_id
+            message.reply_to_message_id,
+            str(INTERACTION_COALESCE_SECONDS)
          )
     )
+    if r.status_code != status.HTTP_201_CREATED:
+        return r.response()
 
-    if r.status_code == status.HTTP_201_CREATED:
-        database.db_update(
-            """
-                UPDATE
-                    direct_conversations
-                SET 
-                    last_interaction_at = %s
-                WHERE
-                    conversation_id = %s
-                RETURNING 
-                    conversation_id;
-            """,
-            (
-                str(r.content['created_at']), 
-                str(message.conversation_id)
-            )
-        )
-
-    return r.response()
+    util.serialize_timestamps([r.content], "created_at", "updated_at", "read_at")
+    await realtime.publish(
+        realtime.conversation_channel(message.conversation_id),
+        "message_created",
+        r.content
+    )
+    return r.json_response()
 
 
-@messages_router.put("/directs/messages")
-def update_message(message: MessageUpdate) -> Response:
-    r: database.DataBaseResponse = database.db_update(
-        """
-        UPDATE 
-            messages 
-        SET 
-            content = COALESCE(%s, content),
-            updated_at = CURRENT_TIMESTAMP,
-            read_at = NULL,
-            is_read = FALSE,
-            is_edited = TRUE
-        WHERE            
-            message_id = %s            
-        RETURNING
-            conversation_id, updated_at;
+@messages_router.put("/directs/messages", response_model=Message)
+async def update_message(message: MessageUpdate) -> Response:
+    r: database.DataBaseResponse = await database.db_update(
+        f"""
+            WITH m AS (
+                UPDATE 
+                    messages 
+                SET 
+                    content = COALESCE(%s, content),
+                    updated_at = CURRENT_TIMESTAMP,
+                    read_at = NULL,
+                    is_read = FALSE,
+                    is_edited = TRUE
+                WHERE            
+                    message_id = %s            
+                RETURNING
+                    *,
+                    updated_at AS interaction_at
+            ),
+            {TOUCH_CONVERSATION}
+            SELECT 
+                {MESSAGE_COLUMNS}
+            FROM 
+                m;
         """,
         (
             message.content, 
-            str(message.message_id)            
+            str(message.message_id),
+            str(INTERACTION_COALESCE_SECONDS)
         )
     )
+    if r.status_code != status.HTTP_201_CREATED:
+        return r.response()
 
-    if r.status_code == status.HTTP_201_CREATED:
-        database.db_update(
-            """
-                UPDATE
-                    direct_conversations
-                SET 
-                    last_interaction_at = %s
-                WHERE
-                    conversation_id = %s
-                RETURNING
-                    conversation_id;
-            """,
-            (                
-                str(r.content['updated_at']),
-                str(r.content['conversation_id'])
-            )
-        )
+    util.serialize_timestamps([r.content], "created_at", "updated_at", "read_at")
+    await realtime.publish(
+        realtime.conversation_channel(r.content['conversation_id']),
+        "message_updated",
+        r.content
+    )
+    return r.json_response()
 
-    return r.response()
+
+async def publish_read(rows: list[dict]) -> None:
+    # One "messages_read" event per conversation touched
+    conversations: dict[int, list[dict]] = {}
+    for row in rows:
+        conversations.setdefault(row['conversation_id'], []).append(
+            {"message_id": row['message_id'], "read_at": row['read_at']}
+        )
+    for conversation_id, messages in conversations.items():
+        await realtime.publish(
+            realtime.conversation_channel(conversation_id),
+            "messages_read",
+            messages
+        )
 
 
 @messages_router.post("/directs/messages/mark_read/one")
-def mark_message_as_readed(message: UniqueID) -> Response:
-    return database.db_update(
+async def mark_message_as_readed(message: UniqueID) -> Response:
+    r: database.DataBaseResponse = await database.db_update(
         """
         UPDATE 
             messages 
@@ -136,15 +234,21 @@ def mark_message_as_readed(message: UniqueID) -> Response:
             is_read = FALSE AND
             message_id = %s
         RETURNING 
-            message_id;            
+            message_id,
+            conversation_id,
+            read_at;            
         """,
         (str(message.id), )
-    ).response()
+    )
+    if r.status_code == status.HTTP_201_CREATED:
+        await publish_read([r.content])
+
+    return r.response()
 
 
 @messages_router.post("/directs/messages/mark_read/all")
-def mark_all_messages_readed_by_user(message_read_all: MessageReadAll) -> Response:
-    return database.db_update(
+async def mark_all_messages_readed_by_user(message_read_all: MessageReadAll) -> Response:
+    r: database.DataBaseResponse = await database.db_transaction([(
         """
             UPDATE 
                 messages
@@ -154,18 +258,26 @@ def mark_all_messages_readed_by_user(message_read_all: MessageReadAll) -> Respon
             WHERE 
                 is_read = FALSE AND
                 conversation_id = %s AND
-                sender_id != %s;
+                sender_id != %s
+            RETURNING
+                message_id,
+                conversation_id,
+                read_at;
         """,
         (
             str(message_read_all.conversation_id),
             str(message_read_all.user_id)
         )
-    ).response()
+    )])
+    if r.status_code == status.HTTP_201_CREATED:
+        await publish_read(r.content[0])
+
+    return r.response()
 
 
 @messages_router.post("/directs/messages/mark_read/some")
-def mark_some_messages_as_readed(messages: UserMessageList) -> Response:
-    return database.db_update(
+async def mark_some_messages_as_readed(messages: UserMessageList) -> Response:
+    r: database.DataBaseResponse = await database.db_transaction([(
         """
             UPDATE 
                 messages 
@@ -175,33 +287,50 @@ def mark_some_messages_as_readed(messages: UserMessageList) -> Response:
             WHERE 
                 is_read = FALSE AND
                 sender_id != %s AND
-                message_id = ANY(%s);
+                message_id = ANY(%s)
+            RETURNING
+                message_id,
+                conversation_id,
+                read_at;
         """,
         (
             str(messages.user_id),
             messages.messages_ids
         )
-    ).response()
+    )])
+    if r.status_code == status.HTTP_201_CREATED:
+        await publish_read(r.content[0])
+
+    return r.response()
 
 
 @messages_router.delete("/directs/messages")
-def delete_message(message: UniqueID) -> Response:
-    return database.db_delete(
+async def delete_message(message: UniqueID) -> Response:
+    r: database.DataBaseResponse = await database.db_delete(
         """
             DELETE FROM 
                 messages
             WHERE
                 message_id = %s
             RETURNING 
-                message_id;
+                message_id,
+                conversation_id;
         """,
         (str(message.id), )
-    ).response()
+    )
+    if r.status_code == status.HTTP_204_NO_CONTENT and r.content is not None:
+        await realtime.publish(
+            realtime.conversation_channel(r.content['conversation_id']),
+            "message_deleted",
+            {"message_id": r.content['message_id']}
+        )
+
+    return r.response()
 
 
 @messages_router.delete("/directs/messages/clear")
-def delete_all_messages_from_conversation(conversation: UniqueID):
-    return database.db_delete(
+async def delete_all_messages_from_conversation(conversation: UniqueID):
+    r: database.DataBaseResponse = await database.db_delete(
         """
             DELETE FROM 
                 messages
@@ -209,4 +338,8 @@ def delete_all_messages_from_conversation(conversation: UniqueID):
                 conversation_id = %s;
         """,
         (str(conversation.id), )
-    ).response()
\ No newline at end of file
+    )
+    if r.status_code == status.HTTP_204_NO_CONTENT:
+        await realtime.publish(realtime.conversation_channel(conversation.id), "messages_cleared")
+
+    return r.response()
\ No newline at end of file
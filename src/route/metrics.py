@@ -1,21 +1,42 @@
 from fastapi import APIRouter, status, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from src.models.unique import UniqueID
 from src.models.hashtag import HashtagCount
-from src.models.metric import Metrics, UserProfileMetrics
+from src.models.metric import Metrics, UserProfileMetrics, MetricEventBatch, CacheStatistics
 from typing import List, Optional
+from src import cache
 from src import database
+from src import metrics_buffer
 
 
 metrics_router = APIRouter()
 
 
+############################# EVENTS #############################
+##################################################################
+
+@metrics_router.post("/metrics/events", status_code=status.HTTP_202_ACCEPTED)
+async def register_metric_events(batch: MetricEventBatch) -> Response:
+    events: dict[metrics_buffer.MetricKey, int] = {}
+    for event in batch.events:
+        key: metrics_buffer.MetricKey = (event.target, event.id, event.type)
+        events[key] = events.get(key, 0) + event.count
+
+    if not await metrics_buffer.get_metrics_buffer().add(events):
+        return Response(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(int(metrics_buffer.FLUSH_INTERVAL) or 1)}
+        )
+    return Response(status_code=status.HTTP_202_ACCEPTED)
+
+
 ############################ POSTS ############################
 ##################################################################
 
 @metrics_router.get("/metrics/posts", response_model=Metrics)
-def get_post_metrics(post: UniqueID):    
-    r: database.DataBaseResponse = database.db_read_one(
+async def get_post_metrics(post: UniqueID):    
+    r: database.DataBaseResponse = await cache.db_read_one(
+        f"post_metrics:{post.id}",
         """
             SELECT 
                 get_post_metrics(%s)
@@ -31,48 +52,21 @@ def get_post_metrics(post: UniqueID):
 ##################################################################
 
 @metrics_router.get("/metrics/user", response_model=UserProfileMetrics)
-def read_user_metrics(user: UniqueID):
-    followers: database.DataBaseResponse = database.db_read_one(
+async def read_user_metrics(user: UniqueID):
+    return (await cache.db_read_one(
+        f"user_metrics:{user.id}",
         """
             SELECT 
-                COUNT(*)
+                posts,
+                followers,
+                following
             FROM 
-                follows
-            WHERE 
-                followed_id = %s;
-        """,
-        (str(user.id), )
-    )
-    following: database.DataBaseResponse = database.db_read_one(
-        """
-            SELECT 
-                COUNT(*)
-            FROM 
-                follows
-            WHERE 
-                follower_id = %s;
-        """,
-        (str(user.id), )
-    )
-    posts: database.DataBaseResponse = database.db_read_one(
-        """
-            SELECT 
-                COUNT(*)
-            FROM 
-                posts
+                user_counters
             WHERE 
                 user_id = %s;
         """,
         (str(user.id), )
-    )    
-    return JSONResponse(
-        content={
-            "posts": posts.content['count'],            
-            "followers": followers.content['count'],
-            "following": following.content['count']
-        },
-        status_code=status.HTTP_200_OK
-    )
+    )).json_response()
 
 
 
@@ -80,8 +74,8 @@ def read_user_metrics(user: UniqueID):
 ##################################################################
 
 @metrics_router.get("/metrics/comments", response_model=Metrics)
-def get_comment_metrics(comment: UniqueID):    
-    r: database.DataBaseResponse = database.db_read_one(
+async def get_comment_metrics(comment: UniqueID):    
+    r: database.DataBaseResponse = await database.db_read_one(
         """
             SELECT 
                 get_comment_metrics(%s)
@@ -98,8 +92,8 @@ def get_comment_metrics(comment: UniqueID):
 
 
 @metrics_router.get("/metrics/user/hashtags", response_model=List[HashtagCount])
-def get_hashtags_used_by_user(user: UniqueID):
-    return database.db_read_all(
+async def get_hashtags_used_by_user(user: UniqueID):
+    return (await database.db_read_all(
         """
             SELECT
                 h.name,
@@ -117,28 +111,26 @@ def get_hashtags_used_by_user(user: UniqueID):
                 count DESC;
         """,
         (str(user.id), )
-    ).json_response()
+    )).json_response()
 
 
 @metrics_router.get("/metrics/trending/hashtags", response_model=List[HashtagCount])
-def get_most_used_hashtags(day_interval: Optional[int] = Query(default=1)):
-    return database.db_read_all(
+async def get_most_used_hashtags(day_interval: Optional[int] = Query(default=1)):
+    return (await database.db_read_all(
         """
             SELECT
-                h.name,
-                COUNT(*) AS count
-            FROM 
-                hashtags h
-            JOIN 
-                post_hashtags ph ON 
-                ph.hashtag_id = h.hashtag_id
-            WHERE 
-                ph.created_at >= CURRENT_TIMESTAMP - (%s || ' days')::interval
-            GROUP BY 
-                h.name
-            ORDER BY 
+                name,
                 count
-            DESC;
+            FROM
+                trending_hashtags(%s);
         """,
-        (str(day_interval), )
-    ).json_response()
\ No newline at end of file
+        (day_interval, )
+    )).json_response()
+
+
+############################## CACHE #############################
+##################################################################
+
+@metrics_router.get("/metrics/cache", response_model=CacheStatistics)
+async def get_cache_statistics():
+    return JSONResponse(content=await cache.stats(), status_code=status.HTTP_200_OK)
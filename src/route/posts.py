@@ -1,10 +1,14 @@
-from fastapi import APIRouter, status, BackgroundTasks
+from fastapi import APIRouter, status, Query
 from fastapi.responses import JSONResponse, Response
 from src.models.post import Post, PostCreate, PostUpdate
+from src.models.comment import CommentProjection
 from src.models.unique import UniqueID
-from typing import List
-from src import storage
+from typing import List, Optional
+from src import block_filter
+from src import cache
+from src import comment_tree
 from src import database 
+from src import jobs
 from src import util
 
 
@@ -12,8 +16,11 @@ posts_router = APIRouter()
 
 
 @posts_router.get("/posts/all", response_model=List[Post])
-def read_all_posts():
-    return database.db_read_all(
+async def read_all_posts(
+    viewer_id: Optional[int] = Query(default=None),
+    comments: CommentProjection = Query(default=CommentProjection.preview)
+):
+    r: database.DataBaseResponse = await database.db_read_all(
         """
             SELECT
                 p.post_id,
@@ -25,17 +32,29 @@ def read_all_posts():
                 p.is_pinned,                
                 TO_CHAR(p.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
                 TO_CHAR(p.updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
-                get_post_comments(p.post_id) AS comments,
                 get_post_metrics(p.post_id) AS metrics
             FROM 
                 posts p;            
         """        
-    ).json_response()
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.json_response()
+    if not await comment_tree.attach_comments(r.content, comments):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    r.content = await block_filter.filter_rows(viewer_id, r.content)
+    if r.content is None or not await util.mark_liked_posts(viewer_id, r.content):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return r.json_response()
 
 
 @posts_router.get("/posts", response_model=Post)
-def read_post(post: UniqueID) -> JSONResponse:
-    return database.db_read_one(
+async def read_post(
+    post: UniqueID,
+    viewer_id: Optional[int] = Query(default=None),
+    comments: CommentProjection = Query(default=CommentProjection.full)
+) -> JSONResponse:
+    r: database.DataBaseResponse = await cache.db_read_one(
+        f"post:{post.id}",
         """
             SELECT
                 p.post_id,
@@ -47,7 +66,6 @@ def read_post(post: UniqueID) -> JSONResponse:
                 p.is_pinned,                
                 TO_CHAR(p.created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at,
                 TO_CHAR(p.updated_at, 'YYYY-MM-DD HH24:MI:SS') as updated_at,
-                get_post_comments(p.post_id) AS comments,
                 get_post_metrics(p.post_id) AS metrics
             FROM 
                 posts p
@@ -55,12 +73,24 @@ def read_post(post: UniqueID) -> JSONResponse:
                 p.post_id = %s;
         """,
         (str(post.id), )
-    ).json_response()
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.json_response()
+    if not await comment_tree.attach_comments([r.content], comments):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    visible: list[dict] | None = await block_filter.filter_rows(viewer_id, [r.content])
+    if visible is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if not visible:
+        return Response(status_code=status.HTTP_404_NOT_FOUND)
+    if not await util.mark_liked_posts(viewer_id, visible):
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return r.json_response()
 
 
 @posts_router.post("/posts", response_model=UniqueID)
-def create_post(post: PostCreate, background_tasks: BackgroundTasks) -> JSONResponse:
-    r: database.DataBaseResponse = database.db_create(
+async def create_post(post: PostCreate) -> JSONResponse:
+    r: database.DataBaseResponse = await database.db_create(
         """
             INSERT INTO posts (                
                 user_id,
@@ -87,23 +117,19 @@ def create_post(post: PostCreate, background_tasks: BackgroundTasks) -> JSONResp
     if r.status_code != status.HTTP_201_CREATED:
         return r.json_response()
         
-    background_tasks.add_task(
-        util.register_post_hashtags,
-        post.user_id,
-        r.content['post_id'],
-        post.content
-    )
-    background_tasks.add_task(
-        storage.get_storage().mkdir,
-        storage.get_storage().get_post_folder(r.content['post_id'])
+    await cache.invalidate(f"user_metrics:{post.user_id}")
+    await jobs.enqueue(
+        jobs.index_post_hashtags_job(r.content['post_id']),
+        jobs.post_folder_job(r.content['post_id']),
+        *([jobs.sync_post_timelines_job(r.content['post_id'])] if post.status == 'published' else [])
     )
 
     return r.json_response()
 
 
 @posts_router.put("/posts")
-def update_post(post: PostUpdate, background_tasks: BackgroundTasks) -> Response:    
-    r: database.DataBaseResponse = database.db_update(
+async def update_post(post: PostUpdate) -> Response:    
+    r: database.DataBaseResponse = await database.db_update(
         """
             UPDATE 
                 posts 
@@ -132,35 +158,41 @@ def update_post(post: PostUpdate, background_tasks: BackgroundTasks) -> Response
     if r.status_code != status.HTTP_201_CREATED:    
         return r.response()
     
-    background_tasks.add_task(
-        util.register_post_hashtags,
-        post.user_id,
-        r.content['post_id'],
-        post.content
-    )
+    await cache.invalidate(f"post:{post.post_id}")
+    # Publishing a draft fans it out, unpublishing takes it off the timelines
+    updates: list[jobs.Job] = []
+    if post.status is not None:
+        updates.append(jobs.sync_post_timelines_job(post.post_id))
+    if post.content is not None:
+        updates.append(jobs.index_post_hashtags_job(post.post_id))
+    if updates:
+        await jobs.enqueue(*updates)
 
     return r.response()
 
 
 @posts_router.delete("/posts")
-def delete_post(post: UniqueID, background_tasks: BackgroundTasks) -> Response:
-    r: database.DataBaseResponse = database.db_delete(
+async def delete_post(post: UniqueID) -> Response:
+    r: database.DataBaseResponse = await database.db_delete(
         """
             DELETE FROM 
                 posts 
             WHERE 
                 post_id = %s 
             RETURNING 
-                post_id;
+                post_id, user_id;
         """,
         (str(post.id), )
     )
 
-    if r.status_code == status.HTTP_204_NO_CONTENT:
-        background_tasks.add_task(
-            storage.get_storage().rmdir,
-            storage.get_storage().get_post_folder(post.id)            
-        )        
+    if r.status_code == status.HTTP_204_NO_CONTENT and r.content is not None:
+        await cache.invalidate(
+            f"post:{post.id}",
+            f"post_metrics:{post.id}",
+            f"post_images:{post.id}",
+            f"user_metrics:{r.content['user_id']}"
+        )
+        await jobs.enqueue(jobs.post_folder_job(post.id), jobs.sync_post_timelines_job(post.id))
     
     return r.response()
 
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status
+from src import database
+from src import realtime
+import asyncio
+
+
+realtime_router = APIRouter()
+
+
+@realtime_router.websocket("/ws/directs")
+async def directs_websocket(websocket: WebSocket, user_id: int = Query(ge=1, le=2**31 - 1)):
+    # Streams message events of every conversation of the user.
+    #
+    # NOT AUTHENTICATED: like the HTTP routes, the API takes the caller's
+    # user_id at its word, so any client can subscribe to any existing
+    # user's conversations. The id is only checked against the users table
+    # here; put this endpoint behind real authentication before exposing it.
+    user: database.DataBaseResponse = await database.db_read_one(
+        "SELECT user_id FROM users WHERE user_id = %s;",
+        (str(user_id), )
+    )
+    if user.status_code == status.HTTP_404_NOT_FOUND:
+        await websocket.close(code=1008)
+        return
+    if user.status_code != status.HTTP_200_OK:
+        await websocket.close(code=1011)
+        return
+
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                conversation_id
+            FROM
+                direct_conversations
+            WHERE
+                user1_id = %s
+            UNION ALL
+            SELECT
+                conversation_id
+            FROM
+                direct_conversations
+            WHERE
+                user2_id = %s;
+        """,
+        (str(user_id), str(user_id))
+    )
+    if r.status_code != status.HTTP_200_OK:
+        await websocket.close(code=1011)
+        return
+
+    await websocket.accept()
+    hub: realtime.Hub = realtime.get_hub()
+    connection = realtime.Connection(websocket, user_id)
+    hub.subscribe(
+        connection,
+        realtime.user_channel(user_id),
+        *(realtime.conversation_channel(row['conversation_id']) for row in r.content)
+    )
+    writer = asyncio.create_task(connection.writer())
+    try:
+        # Clients only send keepalives; events flow server -> client
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(connection)
+        writer.cancel()
@@ -0,0 +1,204 @@
+from fastapi import APIRouter, BackgroundTasks, Query, status
+from fastapi.responses import Response
+from src.models.search import UserSearchPage, PostSearchPage, HashtagSearchPage
+from typing import Optional
+from src import block_filter
+from src import database
+from src import util
+
+
+search_router = APIRouter()
+
+
+# (score, id) position placed before any real result
+FIRST_PAGE: tuple = ("infinity", 2147483647)
+
+
+async def register_search(user_id: int, search_query: str) -> None:
+    await database.db_create(
+        """
+            INSERT INTO user_search_history (
+                user_id,
+                search_query
+            )
+            VALUES
+                (%s, %s)
+            RETURNING
+                user_id
+        """,
+        (str(user_id), search_query)
+    )
+
+
+def _record(background_tasks: BackgroundTasks, user_id: int | None, q: str, cursor: str | None) -> None:
+    # Only the first page counts as a search
+    if user_id is not None and not cursor:
+        background_tasks.add_task(register_search, user_id, q)
+
+
+def _like_prefix(prefix: str) -> str:
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+@search_router.get("/search/users", response_model=UserSearchPage)
+async def search_users(
+    background_tasks: BackgroundTasks,
+    q: str = Query(min_length=1, max_length=256),
+    user_id: Optional[int] = Query(default=None),
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
+):
+    position: tuple | None = util.decode_cursor(cursor, FIRST_PAGE, util.SCORE_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    q = q.strip()
+    # "username % q" is answered by idx_users_username_trgm
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                user_id,
+                username,
+                full_name,
+                is_verified,
+                score
+            FROM (
+                SELECT
+                    user_id,
+                    username,
+                    full_name,
+                    is_verified,
+                    similarity(username, %s) AS score
+                FROM
+                    users
+                WHERE
+                    username %% %s
+            ) u
+            WHERE
+                (score, user_id) < (%s::real, %s)
+            ORDER BY
+                score DESC,
+                user_id DESC
+            LIMIT %s;
+        """,
+        (q, q, position[0], position[1], limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    _record(background_tasks, user_id, q, cursor)
+    users, next_cursor = util.paginate(r.content, limit, "score", "user_id")
+    users = await block_filter.filter_rows(user_id, users)
+    if users is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    r.content = {"users": users, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
+
+
+@search_router.get("/search/posts", response_model=PostSearchPage)
+async def search_posts(
+    background_tasks: BackgroundTasks,
+    q: str = Query(min_length=1, max_length=256),
+    user_id: Optional[int] = Query(default=None),
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
+):
+    position: tuple | None = util.decode_cursor(cursor, FIRST_PAGE, util.SCORE_CURSOR)
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    q = q.strip()
+    # The WHERE expression must match idx_posts_search exactly
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                post_id,
+                user_id,
+                title,
+                content,
+                language,
+                created_at,
+                score
+            FROM (
+                SELECT
+                    p.post_id,
+                    p.user_id,
+                    p.title,
+                    CASE
+                        WHEN LENGTH(p.content) > 100 THEN SUBSTRING(p.content, 1, 100) || '...'
+                        ELSE p.content
+                    END AS content,
+                    p.language,
+                    p.created_at,
+                    ts_rank_cd(post_search_vector(p.language, p.title, p.content), query) AS score
+                FROM
+                    posts p,
+                    post_search_query(%s) query
+                WHERE
+                    post_search_vector(p.language, p.title, p.content) @@ query AND
+                    p.status = 'published'
+            ) s
+            WHERE
+                (score, post_id) < (%s::real, %s)
+            ORDER BY
+                score DESC,
+                post_id DESC
+            LIMIT %s;
+        """,
+        (q, position[0], position[1], limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    _record(background_tasks, user_id, q, cursor)
+    posts, next_cursor = util.paginate(r.content, limit, "score", "post_id")
+    posts = await block_filter.filter_rows(user_id, posts)
+    if posts is None:
+        return Response(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    util.serialize_timestamps(posts, "created_at")
+    r.content = {"posts": posts, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
+
+
+@search_router.get("/search/hashtags", response_model=HashtagSearchPage)
+async def search_hashtags(
+    background_tasks: BackgroundTasks,
+    q: str = Query(min_length=1, max_length=256),
+    user_id: Optional[int] = Query(default=None),
+    cursor: Optional[str] = Query(default=None),
+    limit: Optional[int] = Query(default=20, ge=1, le=100)
+):
+    # Names after the last one returned; an exact match always sorts first
+    position: tuple | None = util.decode_cursor(cursor, ("", ), (str, ))
+    if position is None:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    prefix: str = q.strip().lstrip('#').lower()
+    if not prefix:
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+
+    # LIKE 'prefix%' plus the ORDER BY are one range scan on idx_hashtags_name_prefix
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                hashtag_id,
+                name,
+                LOWER(name::text) COLLATE "C" AS cursor_name
+            FROM
+                hashtags
+            WHERE
+                LOWER(name::text) COLLATE "C" LIKE %s AND
+                LOWER(name::text) COLLATE "C" > %s
+            ORDER BY
+                LOWER(name::text) COLLATE "C"
+            LIMIT %s;
+        """,
+        (_like_prefix(prefix), position[0], limit + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return r.response()
+
+    _record(background_tasks, user_id, q.strip(), cursor)
+    hashtags, next_cursor = util.paginate(r.content, limit, "cursor_name")
+    r.content = {"hashtags": hashtags, "limit": limit, "next_cursor": next_cursor}
+    return r.json_response()
@@ -1,20 +1,25 @@
-from fastapi import APIRouter, status, BackgroundTasks
+from fastapi import APIRouter, Query, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, Response
 from src.models.unique import UniqueID
-from src.models.user import User, UserUpdate, UserCreate
+from src.models.user import User, UserUpdate, UserCreate, UserSummary
 from src.database import DataBaseResponse
-from src.storage import get_storage
 from typing import List
+from src import cache
 from src import database
+from src import jobs
 from src import util
 
 
 users_router = APIRouter()
 
 
+MAX_BATCH_USERS: int = 100
+
+
 @users_router.get("/users/all", response_model=List[User])
-def read_all_users():
-    return database.db_read_all(
+async def read_all_users():
+    return (await database.db_read_all(
         """
         SELECT
             user_id,
@@ -29,12 +34,13 @@ def read_all_users():
         FROM 
             users;        
         """
-    ).json_response()    
+    )).json_response()    
 
 
 @users_router.get("/users", response_model=User)
-def read_user(user: UniqueID) -> JSONResponse:
-    return database.db_read_one(
+async def read_user(user: UniqueID) -> JSONResponse:
+    return (await cache.db_read_one(
+        f"user:{user.id}",
         """
         SELECT
             user_id,
@@ -51,12 +57,17 @@ def read_user(user: UniqueID) -> JSONResponse:
         WHERE 
             user_id = %s;
         """, (str(user.id), )
-    ).json_response()
+    )).json_response()
+
+
+@users_router.get("/users/batch", response_model=List[UserSummary])
+async def read_users_batch(ids: List[int] = Query(max_length=MAX_BATCH_USERS)):
+    return (await util.read_users(list(dict.fromkeys(ids)))).json_response()
 
 
 @users_router.post("/users")
-def create_user(user: UserCreate, background_tasks: BackgroundTasks) -> Response:
-    r: DataBaseResponse = database.db_create(
+async def create_user(user: UserCreate) -> Response:
+    r: DataBaseResponse = await database.db_create(
         """
             INSERT INTO users (
                 username,
@@ -76,24 +87,21 @@ def create_user(user: UserCreate, background_tasks: BackgroundTasks) -> Response
             user.username.strip(),
             user.email.strip(),
             user.full_name.strip(),
-            util.hash(user.password),
+            await run_in_threadpool(util.hash, user.password),
             user.bio.strip(),
             user.birthdate,
             user.is_verified
         )
     )
     if r.status_code == status.HTTP_201_CREATED:            
-        background_tasks.add_task(
-            get_storage().mkdir,
-            get_storage().get_user_folder(r.content['user_id'])
-        )
+        await jobs.enqueue(jobs.user_folder_job(r.content['user_id']))
 
     return r.response()
 
 
 @users_router.put("/users")
 async def update_user(user: UserUpdate) -> Response:
-    return database.db_update(
+    r: DataBaseResponse = await database.db_update(
         """
             UPDATE 
                 users 
@@ -115,18 +123,22 @@ async def update_user(user: UserUpdate) -> Response:
             user.username,
             user.email,
             user.full_name,
-            util.hash(user.password),
+            await run_in_threadpool(util.hash, user.password),
             user.bio,
             user.birthdate,
             user.is_verified,
             str(user.user_id)
         )
-    ).response()
+    )
+    if r.status_code == status.HTTP_201_CREATED:
+        await cache.invalidate(f"user:{user.user_id}")
+
+    return r.response()
 
 
 @users_router.delete("/users")
-def delete_user(user: UniqueID, background_tasks: BackgroundTasks) -> Response:
-    r: DataBaseResponse = database().db_delete(
+async def delete_user(user: UniqueID) -> Response:
+    r: DataBaseResponse = await database.db_delete(
         """
             DELETE FROM 
                 users 
@@ -138,9 +150,7 @@ def delete_user(user: UniqueID, background_tasks: BackgroundTasks) -> Response:
         (str(user.id), )
     )
     if r.status_code == status.HTTP_204_NO_CONTENT:
-        background_tasks.add_task(
-            get_storage().rmdir,
-            get_storage().get_user_folder(user.id)
-        )
+        await cache.invalidate(f"user:{user.id}", f"user_metrics:{user.id}")
+        await jobs.enqueue(jobs.user_folder_job(user.id))
     
     return r.response()
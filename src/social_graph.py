@@ -0,0 +1,273 @@
+from fastapi import status
+from src import database
+import numpy as np
+import asyncio
+import os
+
+
+# Follow lookups answered from memory when SOCIAL_GRAPH_CACHE is enabled.
+# Every process keeps its own snapshot: its own writes show up immediately,
+# writes made by other processes at the next refresh.
+
+CACHE_ENABLED: bool = os.getenv("SOCIAL_GRAPH_CACHE", "false").lower() == "true"
+REFRESH_INTERVAL: float = float(os.getenv("SOCIAL_GRAPH_REFRESH_INTERVAL", 300))
+LOAD_BATCH_SIZE: int = int(os.getenv("SOCIAL_GRAPH_LOAD_BATCH_SIZE", 100_000))
+
+EMPTY: np.ndarray = np.empty(0, dtype=np.int32)
+
+
+# CSR adjacency: the neighbors of u are ids[offsets[u]:offsets[u + 1]], sorted,
+# so a lookup is a slice and a membership test a binary search
+class Adjacency:
+
+    def __init__(self, sources: np.ndarray, targets: np.ndarray, size: int, presorted: bool = False):
+        # presorted: edges already ordered by (source, target)
+        if presorted:
+            self.ids: np.ndarray = targets
+        else:
+            order = np.lexsort((targets, sources))
+            self.ids: np.ndarray = targets[order]
+        self.offsets: np.ndarray = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=size), out=self.offsets[1:])
+
+    def neighbors(self, u: int) -> np.ndarray:
+        if u < 0 or u + 1 >= len(self.offsets):
+            return EMPTY
+        return self.ids[self.offsets[u]:self.offsets[u + 1]]
+
+    def contains(self, u: int, v: int) -> bool:
+        neighbors = self.neighbors(u)
+        i: int = int(np.searchsorted(neighbors, v))
+        return i < len(neighbors) and bool(neighbors[i] == v)
+
+
+class SocialGraph:
+
+    def __init__(self, enabled: bool = CACHE_ENABLED, refresh_interval: float = REFRESH_INTERVAL):
+        self.__enabled = enabled
+        self.__refresh_interval = refresh_interval
+        self.__following: Adjacency | None = None
+        self.__followers: Adjacency | None = None
+        # Local writes not yet in the snapshot: (follower, followed) -> exists
+        self.__overlay: dict[tuple[int, int], bool] = {}
+        self.__overlay_out: dict[int, set[int]] = {}
+        self.__overlay_in: dict[int, set[int]] = {}
+        # (sequence, follower, followed, exists), replayed over a new snapshot
+        self.__log: list[tuple[int, int, int, bool]] = []
+        self.__sequence: int = 0
+        self.__lock = asyncio.Lock()
+        self.__task: asyncio.Task | None = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.__following is not None
+
+    def __apply(self, follower_id: int, followed_id: int, exists: bool) -> None:
+        self.__overlay[(follower_id, followed_id)] = exists
+        self.__overlay_out.setdefault(follower_id, set()).add(followed_id)
+        self.__overlay_in.setdefault(followed_id, set()).add(follower_id)
+
+    def record(self, follower_id: int, followed_id: int, exists: bool) -> None:
+        if not self.__enabled:
+            return
+        self.__sequence += 1
+        self.__log.append((self.__sequence, follower_id, followed_id, exists))
+        self.__apply(follower_id, followed_id, exists)
+
+    async def __load_edges(self) -> tuple[np.ndarray, np.ndarray]:
+        # Streams the edges in (follower_id, followed_id) order through a
+        # server-side cursor, straight into preallocated int32 arrays
+        async with database.db_get_pool().connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT COUNT(*) FROM follows;")
+                capacity: int = (await cur.fetchone())[0]
+            followers = np.empty(capacity, dtype=np.int32)
+            followed = np.empty(capacity, dtype=np.int32)
+            n: int = 0
+            async with conn.cursor(name="social_graph_edges") as cur:
+                await cur.execute(
+                    """
+                        SELECT
+                            follower_id,
+                            followed_id
+                        FROM
+                            follows
+                        ORDER BY
+                            follower_id,
+                            followed_id;
+                    """
+                )
+                while rows := await cur.fetchmany(LOAD_BATCH_SIZE):
+                    batch = np.asarray(rows, dtype=np.int32)
+                    if n + len(batch) > len(followers):
+                        # Follows created after the count
+                        capacity = max(n + len(batch), int(len(followers) * 1.25))
+                        followers.resize(capacity, refcheck=False)
+                        followed.resize(capacity, refcheck=False)
+                    followers[n:n + len(batch)] = batch[:, 0]
+                    followed[n:n + len(batch)] = batch[:, 1]
+                    n += len(batch)
+            await conn.commit()
+        followers.resize(n, refcheck=False)
+        followed.resize(n, refcheck=False)
+        return followers, followed
+
+    async def refresh(self) -> bool:
+        async with self.__lock:
+            sequence: int = self.__sequence
+            try:
+                followers, followed = await self.__load_edges()
+            except Exception as e:
+                print(f"[DATABASE EXCEPTION] -> [{e}]")
+                return False
+
+            size: int = int(max(followers.max(initial=0), followed.max(initial=0))) + 1
+            self.__following = Adjacency(followers, followed, size, presorted=True)
+            self.__followers = Adjacency(followed, followers, size)
+
+            # Writes made while the snapshot was read may or may not be in it;
+            # replaying them is idempotent
+            self.__log = [entry for entry in self.__log if entry[0] > sequence]
+            self.__overlay, self.__overlay_out, self.__overlay_in = {}, {}, {}
+            for _, follower_id, followed_id, exists in self.__log:
+                self.__apply(follower_id, followed_id, exists)
+            return True
+
+    def __merge(self, base: np.ndarray, touched: set[int], edge) -> list[int]:
+        if not touched:
+            return base.tolist()
+        ids: set[int] = set(base.tolist())
+        for v in touched:
+            if self.__overlay[edge(v)]:
+                ids.add(v)
+            else:
+                ids.discard(v)
+        return sorted(ids)
+
+    def following(self, user_id: int) -> list[int]:
+        return self.__merge(
+            self.__following.neighbors(user_id),
+            self.__overlay_out.get(user_id),
+            lambda v: (user_id, v)
+        )
+
+    def followers(self, user_id: int) -> list[int]:
+        return self.__merge(
+            self.__followers.neighbors(user_id),
+            self.__overlay_in.get(user_id),
+            lambda v: (v, user_id)
+        )
+
+    def is_following(self, follower_id: int, followed_id: int) -> bool:
+        exists: bool | None = self.__overlay.get((follower_id, followed_id))
+        if exists is not None:
+            return exists
+        return self.__following.contains(follower_id, followed_id)
+
+    async def __run(self) -> None:
+        while True:
+            await asyncio.sleep(self.__refresh_interval)
+            await self.refresh()
+
+    async def start(self) -> None:
+        if self.__enabled and self.__task is None:
+            await self.refresh()
+            self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self) -> None:
+        if self.__task is not None:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+
+
+social_graph = None
+
+
+def create_social_graph(new_graph: SocialGraph) -> None:
+    global social_graph
+    social_graph = new_graph
+
+
+def get_social_graph() -> SocialGraph:
+    global social_graph
+    return social_graph
+
+
+# Lookups below use the in-memory graph when it is loaded and otherwise an
+# index range scan: idx_follower for following, idx_followed for followers
+
+async def followers(user_id: int) -> list[int] | None:
+    graph: SocialGraph = get_social_graph()
+    if graph.loaded:
+        return graph.followers(user_id)
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                follower_id
+            FROM
+                follows
+            WHERE
+                followed_id = %s
+            ORDER BY
+                follower_id;
+        """,
+        (str(user_id), )
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    return [row['follower_id'] for row in r.content]
+
+
+async def following(user_id: int) -> list[int] | None:
+    graph: SocialGraph = get_social_graph()
+    if graph.loaded:
+        return graph.following(user_id)
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                followed_id
+            FROM
+                follows
+            WHERE
+                follower_id = %s
+            ORDER BY
+                followed_id;
+        """,
+        (str(user_id), )
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    return [row['followed_id'] for row in r.content]
+
+
+async def relationship(user_id: int, other_id: int) -> dict[str, bool] | None:
+    graph: SocialGraph = get_social_graph()
+    if graph.loaded:
+        follows: bool = graph.is_following(user_id, other_id)
+        followed_by: bool = graph.is_following(other_id, user_id)
+    else:
+        # Both probes are primary key lookups on (follower_id, followed_id)
+        r: database.DataBaseResponse = await database.db_read_one(
+            """
+                SELECT
+                    EXISTS (SELECT 1 FROM follows WHERE follower_id = %s AND followed_id = %s) AS follows,
+                    EXISTS (SELECT 1 FROM follows WHERE follower_id = %s AND followed_id = %s) AS followed_by;
+            """,
+            (str(user_id), str(other_id), str(other_id), str(user_id))
+        )
+        if r.status_code != status.HTTP_200_OK:
+            return None
+        follows, followed_by = r.content['follows'], r.content['followed_by']
+    return {"follows": follows, "followed_by": followed_by, "mutual": follows and followed_by}
+
+
+def on_follow(follower_id: int, followed_id: int) -> None:
+    get_social_graph().record(follower_id, followed_id, True)
+
+
+def on_unfollow(follower_id: int, followed_id: int) -> None:
+    get_social_graph().record(follower_id, followed_id, False)
@@ -5,7 +5,11 @@ import cloudinary.uploader
 import cloudinary.api
 import cloudinary.exceptions
 from dotenv import load_dotenv
+import hashlib
+import shutil
+import uuid
 import os
+import re
 
 
 load_dotenv()
@@ -131,7 +135,155 @@ class CloudinaryStorage(Storage):
             return StorageResponse(False, exception=e, err_msg="cloudinary_delete_image")
 
 
-storage = None
+
+class LocalFileStorage(Storage):
+
+    # Blobs are stored once under blobs/ and named by the sha256 of their
+    # content. Every upload adds a folder entry "<uuid>_<sha256>" hard linked
+    # to its blob, so the link count tells when the last reference is gone.
+    # The URL keeps the client's extension only so the file is served with
+    # the right content type; identical bytes always share one blob.
+    #
+    # Uploads and deletes may run in different processes (API and worker),
+    # so instead of a lock a blob is deleted by first renaming it away: an
+    # upload that linked it in time gets it put back, one that comes later
+    # finds it missing and recreates it.
+
+    CHUNK_SIZE: int = 1024 * 1024
+    NAME_PATTERN = re.compile(r"^([0-9a-f]{64})(\.[a-z0-9]{1,8})?$")
+    ENTRY_PATTERN = re.compile(r"^[0-9a-f]{32}_([0-9a-f]{64})$")
+
+    def __init__(self, base_dir: str = None, base_url: str = None):
+        self.__base_dir = os.path.abspath(base_dir or os.getenv("STORAGE_LOCAL_DIR", "media"))
+        self.__base_url = (base_url or os.getenv("STORAGE_LOCAL_URL", "/api/files")).rstrip('/')
+        self.__blobs_dir = os.path.join(self.__base_dir, "blobs")
+        self.__tmp_dir = os.path.join(self.__base_dir, "tmp")
+        super().__init__(root_folder="ougi_social/")
+
+    def open(self):
+        os.makedirs(self.__blobs_dir, exist_ok=True)
+        os.makedirs(self.__tmp_dir, exist_ok=True)
+
+    def close(self):
+        return super().close()
+
+    def __folder_path(self, dir: str) -> str:
+        path: str = os.path.abspath(os.path.join(self.__base_dir, "folders", dir))
+        if not path.startswith(os.path.join(self.__base_dir, "folders") + os.sep):
+            raise ValueError(f"invalid folder {dir}")
+        return path
+
+    def __blob_path(self, name: str) -> str:
+        return os.path.join(self.__blobs_dir, name[:2], name)
+
+    def __extension(self, image: UploadFile) -> str:
+        ext: str = os.path.splitext(image.filename or "")[1].lower()
+        return ext if re.fullmatch(r"\.[a-z0-9]{1,8}", ext) else ""
+
+    def __unlink(self, path: str) -> None:
+        # Removes a folder entry and its blob once no other entry points to it
+        match = self.ENTRY_PATTERN.fullmatch(os.path.basename(path))
+        os.unlink(path)
+        if match is None:
+            return
+        blob: str = self.__blob_path(match.group(1))
+        try:
+            if os.stat(blob).st_nlink > 1:
+                return
+            tomb: str = os.path.join(self.__tmp_dir, uuid.uuid4().hex)
+            os.rename(blob, tomb)
+        except FileNotFoundError:
+            return
+        try:
+            if os.stat(tomb).st_nlink > 1:
+                # An upload linked the blob between the check and the rename
+                try:
+                    os.link(tomb, blob)
+                except FileExistsError:
+                    pass
+        finally:
+            os.unlink(tomb)
+
+    def __link(self, tmp: str, blob: str, entry: str) -> None:
+        # Links entry to blob, recreating the blob from tmp when it is missing
+        # or was just renamed away by a concurrent delete
+        for _ in range(3):
+            try:
+                os.link(blob, entry)
+                return
+            except FileNotFoundError:
+                try:
+                    os.link(tmp, blob)
+                except FileExistsError:
+                    pass
+        raise FileNotFoundError(blob)
+
+    def get_path(self, name: str) -> str | None:
+        match = self.NAME_PATTERN.fullmatch(name)
+        if match is None:
+            return None
+        path: str = self.__blob_path(match.group(1))
+        return path if os.path.isfile(path) else None
+
+    def mkdir(self, dir: str) -> StorageResponse:
+        try:
+            os.makedirs(self.__folder_path(dir), exist_ok=True)
+            return StorageResponse({"path": dir})
+        except (OSError, ValueError) as err:
+            return StorageResponse(success=False, exception=err, err_msg=f"could not create {dir}")
+
+    def rmdir(self, dir: str) -> StorageResponse:
+        try:
+            path: str = self.__folder_path(dir)
+            for entry in os.scandir(path) if os.path.isdir(path) else []:
+                if entry.is_file():
+                    self.__unlink(entry.path)
+            shutil.rmtree(path, ignore_errors=True)
+            return StorageResponse({"path": dir})
+        except (OSError, ValueError) as err:
+            return StorageResponse(success=False, exception=err, err_msg=f"could not delete {dir}")
+
+    def upload_image(self, image_folder: str, image: UploadFile) -> StorageResponse:
+        tmp: str = os.path.join(self.__tmp_dir, uuid.uuid4().hex)
+        try:
+            folder: str = self.__folder_path(image_folder)
+            digest = hashlib.sha256()
+            with open(tmp, "wb") as f:
+                while chunk := image.file.read(self.CHUNK_SIZE):
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            name: str = digest.hexdigest()
+            blob: str = self.__blob_path(name)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+
+            entry: str = f"{uuid.uuid4().hex}_{name}"
+            os.makedirs(folder, exist_ok=True)
+            self.__link(tmp, blob, os.path.join(folder, entry))
+            os.unlink(tmp)
+            return StorageResponse({
+                "secure_url": f"{self.__base_url}/{name}{self.__extension(image)}",
+                "public_id": f"{image_folder}/{entry}"
+            })
+        except Exception as err:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            return StorageResponse(success=False, exception=err, err_msg="local_upload_image")
+
+    def delete_image(self, public_id: str) -> StorageResponse:
+        try:
+            path: str = self.__folder_path(public_id)
+            if os.path.isfile(path):
+                self.__unlink(path)
+            return StorageResponse({"public_id": public_id})
+        except Exception as e:
+            return StorageResponse(success=False, exception=e, err_msg="local_delete_image")
+
+
+def storage_from_env() -> Storage:
+    if os.getenv("STORAGE_BACKEND", "cloudinary") == "local":
+        return LocalFileStorage()
+    return CloudinaryStorage()
 
 
 def create_storage(new_storage: Storage) -> None:
@@ -0,0 +1,502 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+from fastapi import status
+from src import database
+import bisect
+import os
+
+
+# (created_at, post_id, author_id)
+TimelineEntry = tuple[datetime, int, int]
+
+
+# Authors with more followers than this are not fanned out on write;
+# their posts are merged into the followers' timelines at read time.
+FANOUT_MAX_FOLLOWERS: int = int(os.getenv("TIMELINE_FANOUT_MAX_FOLLOWERS", 10_000))
+
+
+# Writes return False when they could not be applied, so jobs can retry them
+class TimelineStore(ABC):
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+
+    @abstractmethod
+    async def open(self) -> None:
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    # Newest first. None when the timeline was never materialized
+    @abstractmethod
+    async def get(self, user_id: int) -> list[TimelineEntry] | None:
+        pass
+
+    @abstractmethod
+    async def set_timeline(self, user_id: int, entries: list[TimelineEntry]) -> bool:
+        pass
+
+    # Merges entries into an already materialized timeline
+    @abstractmethod
+    async def add(self, user_id: int, entries: list[TimelineEntry]) -> bool:
+        pass
+
+    # Pushes entry into every materialized timeline of user_ids
+    @abstractmethod
+    async def fan_out(self, user_ids: list[int], entry: TimelineEntry) -> bool:
+        pass
+
+    @abstractmethod
+    async def remove_author(self, user_id: int, author_id: int) -> bool:
+        pass
+
+    # Drops a post from every timeline holding it
+    @abstractmethod
+    async def remove_post(self, post_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def add_celebrity(self, author_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def get_celebrities(self) -> set[int]:
+        pass
+
+
+# Per process: fan-out jobs run by src/worker.py never reach it, timelines
+# only pick up new posts when rematerialized. Meant for development and tests;
+# deployments use PostgresTimelineStore
+class MemoryTimelineStore(TimelineStore):
+
+    def __init__(self, max_size: int = 800, max_timelines: int = 50_000):
+        super().__init__(max_size)
+        self.__max_timelines = max_timelines
+        # Entries are kept oldest first so new posts are appended cheaply
+        self.__timelines: OrderedDict[int, list[TimelineEntry]] = OrderedDict()
+        self.__celebrities: set[int] = set()
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        self.__timelines.clear()
+        self.__celebrities.clear()
+
+    def __insert(self, timeline: list[TimelineEntry], entry: TimelineEntry) -> None:
+        i: int = bisect.bisect_left(timeline, entry)
+        if i < len(timeline) and timeline[i][1] == entry[1]:
+            return
+        timeline.insert(i, entry)
+        if len(timeline) > self.max_size:
+            del timeline[0]
+
+    async def get(self, user_id: int) -> list[TimelineEntry] | None:
+        timeline = self.__timelines.get(user_id)
+        if timeline is None:
+            return None
+        self.__timelines.move_to_end(user_id)
+        return timeline[::-1]
+
+    async def set_timeline(self, user_id: int, entries: list[TimelineEntry]) -> bool:
+        self.__timelines[user_id] = sorted(entries)[-self.max_size:]
+        self.__timelines.move_to_end(user_id)
+        while len(self.__timelines) > self.__max_timelines:
+            self.__timelines.popitem(last=False)
+        return True
+
+    async def add(self, user_id: int, entries: list[TimelineEntry]) -> bool:
+        timeline = self.__timelines.get(user_id)
+        if timeline is not None:
+            for entry in entries:
+                self.__insert(timeline, entry)
+        return True
+
+    async def fan_out(self, user_ids: list[int], entry: TimelineEntry) -> bool:
+        for user_id in user_ids:
+            timeline = self.__timelines.get(user_id)
+            if timeline is not None:
+                self.__insert(timeline, entry)
+        return True
+
+    async def remove_author(self, user_id: int, author_id: int) -> bool:
+        timeline = self.__timelines.get(user_id)
+        if timeline is not None:
+            timeline[:] = [e for e in timeline if e[2] != author_id]
+        return True
+
+    async def remove_post(self, post_id: int) -> bool:
+        for timeline in self.__timelines.values():
+            timeline[:] = [e for e in timeline if e[1] != post_id]
+        return True
+
+    async def add_celebrity(self, author_id: int) -> bool:
+        self.__celebrities.add(author_id)
+        return True
+
+    async def get_celebrities(self) -> set[int]:
+        return set(self.__celebrities)
+
+
+# Shared by every API process and the job worker. Entries past max_size are
+# not read and are pruned daily by prune_timeline_entries()
+class PostgresTimelineStore(TimelineStore):
+
+    def __init__(self, max_size: int = 800):
+        super().__init__(max_size)
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def __write(self, statements: list[tuple[str, tuple]]) -> bool:
+        r: database.DataBaseResponse = await database.db_transaction(statements)
+        return r.status_code == status.HTTP_201_CREATED
+
+    async def get(self, user_id: int) -> list[TimelineEntry] | None:
+        # No row: never materialized. A single row without post: empty timeline
+        r: database.DataBaseResponse = await database.db_read_all(
+            """
+                SELECT
+                    e.created_at,
+                    e.post_id,
+                    e.author_id AS user_id
+                FROM
+                    timelines t
+                LEFT JOIN LATERAL (
+                    SELECT
+                        created_at,
+                        post_id,
+                        author_id
+                    FROM
+                        timeline_entries
+                    WHERE
+                        user_id = t.user_id
+                    ORDER BY
+                        created_at DESC,
+                        post_id DESC
+                    LIMIT %s
+                ) e ON TRUE
+                WHERE
+                    t.user_id = %s;
+            """,
+            (self.max_size, str(user_id))
+        )
+        if r.status_code != status.HTTP_200_OK or not r.content:
+            return None
+        return _entries([row for row in r.content if row['post_id'] is not None])
+
+    async def set_timeline(self, user_id: int, entries: list[TimelineEntry]) -> bool:
+        entries = sorted(entries, reverse=True)[:self.max_size]
+        return await self.__write([
+            (
+                """
+                    INSERT INTO timelines
+                        (user_id)
+                    VALUES
+                        (%s)
+                    ON CONFLICT
+                        (user_id)
+                    DO UPDATE SET
+                        materialized_at = CURRENT_TIMESTAMP;
+                """,
+                (str(user_id), )
+            ),
+            ("DELETE FROM timeline_entries WHERE user_id = %s;", (str(user_id), )),
+            (
+                """
+                    INSERT INTO timeline_entries
+                        (user_id, created_at, post_id, author_id)
+                    SELECT
+                        %s, e.created_at, e.post_id, e.author_id
+                    FROM
+                        unnest(%s::timestamptz[], %s::int[], %s::int[]) AS e(created_at, post_id, author_id)
+                    ON CONFLICT
+                        (user_id, post_id)
+                    DO NOTHING;
+                """,
+                (str(user_id), *(list(column) for column in zip(*entries))) if entries else (str(user_id), [], [], [])
+            )
+        ])
+
+    async def add(self, user_id: int, entries: list[TimelineEntry]) -> bool:
+        if not entries:
+            return True
+        return await self.__write([(
+            """
+                INSERT INTO timeline_entries
+                    (user_id, created_at, post_id, author_id)
+                SELECT
+                    t.user_id, e.created_at, e.post_id, e.author_id
+                FROM
+                    timelines t,
+                    unnest(%s::timestamptz[], %s::int[], %s::int[]) AS e(created_at, post_id, author_id)
+                WHERE
+                    t.user_id = %s
+                ON CONFLICT
+                    (user_id, post_id)
+                DO NOTHING;
+            """,
+            (*(list(column) for column in zip(*entries)), str(user_id))
+        )])
+
+    async def fan_out(self, user_ids: list[int], entry: TimelineEntry) -> bool:
+        if not user_ids:
+            return True
+        return await self.__write([(
+            """
+                INSERT INTO timeline_entries
+                    (user_id, created_at, post_id, author_id)
+                SELECT
+                    t.user_id, %s, %s, %s
+                FROM
+                    timelines t
+                WHERE
+                    t.user_id = ANY(%s)
+                ORDER BY
+                    t.user_id
+                ON CONFLICT
+                    (user_id, post_id)
+                DO NOTHING;
+            """,
+            (entry[0], entry[1], entry[2], user_ids)
+        )])
+
+    async def remove_author(self, user_id: int, author_id: int) -> bool:
+        return await self.__write([(
+            "DELETE FROM timeline_entries WHERE user_id = %s AND author_id = %s;",
+            (str(user_id), str(author_id))
+        )])
+
+    async def remove_post(self, post_id: int) -> bool:
+        return await self.__write([(
+            "DELETE FROM timeline_entries WHERE post_id = %s;",
+            (str(post_id), )
+        )])
+
+    async def add_celebrity(self, author_id: int) -> bool:
+        return await self.__write([(
+            "INSERT INTO timeline_celebrities (author_id) VALUES (%s) ON CONFLICT DO NOTHING;",
+            (str(author_id), )
+        )])
+
+    async def get_celebrities(self) -> set[int]:
+        r: database.DataBaseResponse = await database.db_read_all(
+            "SELECT author_id FROM timeline_celebrities;"
+        )
+        if r.status_code != status.HTTP_200_OK:
+            return set()
+        return {row['author_id'] for row in r.content}
+
+
+timeline_store = None
+
+
+def create_timeline_store(new_store: TimelineStore) -> None:
+    global timeline_store
+    timeline_store = new_store
+
+
+def get_timeline_store() -> TimelineStore:
+    global timeline_store
+    return timeline_store
+
+
+def timeline_store_from_env() -> TimelineStore:
+    if os.getenv("TIMELINE_STORE", "postgres") == "memory":
+        return MemoryTimelineStore()
+    return PostgresTimelineStore()
+
+
+def _entries(rows: list[dict]) -> list[TimelineEntry]:
+    return [(row['created_at'], row['post_id'], row['user_id']) for row in rows]
+
+
+async def fan_out_post(author_id: int, post_id: int, created_at: datetime) -> bool:
+    store: TimelineStore = get_timeline_store()
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                follower_id
+            FROM
+                follows
+            WHERE
+                followed_id = %s
+            LIMIT %s;
+        """,
+        (str(author_id), FANOUT_MAX_FOLLOWERS + 1)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return False
+    if len(r.content) > FANOUT_MAX_FOLLOWERS:
+        return await store.add_celebrity(author_id)
+    return await store.fan_out(
+        [row['follower_id'] for row in r.content],
+        (created_at, post_id, author_id)
+    )
+
+
+async def sync_post(post_id: int) -> bool:
+    # Brings the timelines in line with the post's current state: fanned out
+    # while published, removed once it is a draft, archived or deleted.
+    # Idempotent, so it is safe to run again after any change to the post
+    r: database.DataBaseResponse = await database.db_read_one(
+        """
+            SELECT
+                user_id,
+                created_at,
+                status = 'published' AS published
+            FROM
+                posts
+            WHERE
+                post_id = %s;
+        """,
+        (str(post_id), )
+    )
+    if r.status_code == status.HTTP_200_OK and r.content['published']:
+        return await fan_out_post(r.content['user_id'], post_id, r.content['created_at'])
+    if r.status_code in (status.HTTP_200_OK, status.HTTP_404_NOT_FOUND):
+        return await get_timeline_store().remove_post(post_id)
+    return False
+
+
+async def on_follow(follower_id: int, followed_id: int) -> None:
+    store: TimelineStore = get_timeline_store()
+    if await store.get(follower_id) is None:
+        return
+    if followed_id in await store.get_celebrities():
+        return
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                created_at,
+                post_id,
+                user_id
+            FROM
+                posts
+            WHERE
+                user_id = %s AND
+                status = 'published'
+            ORDER BY
+                created_at DESC,
+                post_id DESC
+            LIMIT %s;
+        """,
+        (str(followed_id), store.max_size)
+    )
+    if r.status_code == status.HTTP_200_OK:
+        await store.add(follower_id, _entries(r.content))
+
+
+async def on_unfollow(follower_id: int, followed_id: int) -> None:
+    await get_timeline_store().remove_author(follower_id, followed_id)
+
+
+async def on_block(blocker_id: int, blocked_id: int) -> None:
+    # unfollow_on_block drops the follows in both directions
+    await on_unfollow(blocker_id, blocked_id)
+    await on_unfollow(blocked_id, blocker_id)
+
+
+async def _materialize(user_id: int) -> list[TimelineEntry] | None:
+    store: TimelineStore = get_timeline_store()
+    r: database.DataBaseResponse = await database.db_read_all(
+        """
+            SELECT
+                p.created_at,
+                p.post_id,
+                p.user_id
+            FROM
+                follows f
+            INNER JOIN
+                posts p ON p.user_id = f.followed_id
+            WHERE
+                f.follower_id = %s AND
+                p.status = 'published'
+            ORDER BY
+                p.created_at DESC,
+                p.post_id DESC
+            LIMIT %s;
+        """,
+        (str(user_id), store.max_size)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    entries: list[TimelineEntry] = _entries(r.content)
+    await store.set_timeline(user_id, entries)
+    return entries
+
+
+async def read_timeline(
+    user_id: int,
+    before: tuple[datetime, int],
+    since: datetime,
+    limit: int
+) -> list[TimelineEntry] | None:
+    # Returns up to limit + 1 entries older than `before`, newest first.
+    # None means the page lies past the cached window and must be read
+    # from the database instead.
+    store: TimelineStore = get_timeline_store()
+    entries = await store.get(user_id)
+    if entries is None:
+        entries = await _materialize(user_id)
+        if entries is None:
+            return None
+
+    page: list[TimelineEntry] = [
+        e for e in entries if (e[0], e[1]) < before and e[0] >= since
+    ][:limit + 1]
+    if len(page) <= limit and len(entries) >= store.max_size and entries[-1][0] >= since:
+        return None
+
+    celebrities: set[int] = await store.get_celebrities()
+    if celebrities:
+        r: database.DataBaseResponse = await database.db_read_all(
+            """
+                SELECT
+                    p.created_at,
+                    p.post_id,
+                    p.user_id
+                FROM
+                    follows f
+                INNER JOIN
+                    posts p ON p.user_id = f.followed_id
+                WHERE
+                    f.follower_id = %s AND
+                    f.followed_id = ANY(%s) AND
+                    p.status = 'published' AND
+                    p.created_at >= %s AND
+                    (p.created_at, p.post_id) < (%s, %s)
+                ORDER BY
+                    p.created_at DESC,
+                    p.post_id DESC
+                LIMIT %s;
+            """,
+            (str(user_id), list(celebrities), since, before[0], before[1], limit + 1)
+        )
+        if r.status_code != status.HTTP_200_OK:
+            return None
+        seen: set[int] = {e[1] for e in page}
+        page.extend(e for e in _entries(r.content) if e[1] not in seen)
+        page.sort(reverse=True)
+
+    return page[:limit + 1]
+
+
+def parse_position(position: tuple) -> tuple[datetime, int] | None:
+    try:
+        created_at: datetime = (
+            datetime.max.replace(tzinfo=timezone.utc)
+            if position[0] == "infinity"
+            else datetime.fromisoformat(position[0])
+        )
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return created_at, int(position[1])
+    except (TypeError, ValueError):
+        return None
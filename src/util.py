@@ -1,88 +1,570 @@
 from fastapi import UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 from passlib.context import CryptContext
-from src.database import db_get_pool, db_create, DataBaseResponse
+from src.database import db_read_all, db_transaction, DataBaseResponse
 from src.storage import get_storage, StorageResponse
+from src.image_processing import get_image_processor, Variants, VARIANT_EXTENSION, MAX_IMAGE_BYTES
+from src.like_buffer import get_like_buffer
+from datetime import datetime
+import asyncio
+import binascii
+import base64
+import io
+import json
+import os
 import re
+import tempfile
 
 
 ctx = CryptContext(schemes=['bcrypt'])
 
 
+# Bounds the storage uploads running at once across every request
+UPLOAD_CONCURRENCY: int = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+
 def extract_hashtags(content: str) -> list[str]:    
     if not content:
         return []
     return [tag.lower() for tag in re.findall(r'#(\w+)', content)]    
 
 
+def encode_cursor(*values) -> str:
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw: bytes = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+# Value types of the keyset cursors: datetime values travel as ISO 8601
+# strings and float scores as JSON numbers, both may also be "infinity"
+TIMESTAMP_CURSOR: tuple[type, ...] = (datetime, int)
+SCORE_CURSOR: tuple[type, ...] = (float, int)
+
+
+def cursor_value_matches(value, expected: type) -> bool:
+    if isinstance(value, bool):
+        return False
+    if expected in (datetime, float) and value in ("infinity", "-infinity"):
+        return True
+    if expected is datetime:
+        try:
+            datetime.fromisoformat(value)
+            return True
+        except (TypeError, ValueError):
+            return False
+    if expected is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, expected)
+
+
+def decode_cursor(cursor: str | None, default: tuple, types: tuple[type, ...]) -> tuple | None:
+    # Returns `default` when no cursor is given and None when it is malformed,
+    # so a bad cursor is answered with 400 instead of failing in the query casts
+    if not cursor:
+        return default
+    try:
+        raw: bytes = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != len(default):
+        return None
+    if not all(cursor_value_matches(v, t) for v, t in zip(values, types)):
+        return None
+    return tuple(values)
+
+
+def paginate(rows: list[dict], limit: int, *cursor_columns: str) -> tuple[list[dict], str | None]:
+    # Rows must be fetched with LIMIT limit + 1; the extra row only signals a next page.
+    # Columns named "cursor_*" are keyset helpers and are removed from the output.
+    next_cursor: str | None = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*(rows[-1][c] for c in cursor_columns))
+    for row in rows:
+        for c in cursor_columns:
+            if c.startswith('cursor_'):
+                row.pop(c, None)
+    return rows, next_cursor
+
+
+def serialize_timestamps(rows: list[dict], *columns: str) -> list[dict]:
+    # Turns native timestamps into ISO 8601 strings so rows can go into a JSONResponse
+    for row in rows:
+        for c in columns:
+            if row.get(c) is not None:
+                row[c] = row[c].isoformat()
+    return rows
+
+
 def hash(password: str) -> str:
     if password:
         return ctx.hash(password)
 
 
-def create_new_image(image_dir: str, image: UploadFile) -> str:
-    # 1. Upload img to cloud image server
-    strg_image: StorageResponse  = get_storage().upload_image(image_dir, image)
-    if strg_image.success is False:
-        print(strg_image)
+UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+
+
+def _spool_upload(file) -> str | None:
+    # None when the file is larger than MAX_IMAGE_BYTES
+    fd, path = tempfile.mkstemp(prefix="upload_")
+    size: int = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_IMAGE_BYTES:
+                    break
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    if size > MAX_IMAGE_BYTES:
+        os.unlink(path)
+        return None
+    return path
+
+
+async def spool_upload(image: UploadFile) -> str | None:
+    # Copies the upload to a temporary file in chunks, so it can be handed to
+    # the process pool without being read into memory. The caller deletes it
+    return await run_in_threadpool(_spool_upload, image.file)
+
+
+async def _upload(image_dir: str, image: UploadFile) -> StorageResponse:
+    async with upload_semaphore:
+        return await run_in_threadpool(get_storage().upload_image, image_dir, image)
+
+
+async def delete_uploaded_images(uploads: list[StorageResponse]) -> None:
+    await asyncio.gather(*(
+        run_in_threadpool(get_storage().delete_image, u.content['public_id'])
+        for u in uploads
+    ))
+
+
+async def upload_images(image_dir: str, images: list[UploadFile]) -> list[StorageResponse] | None:
+    # Uploads every image concurrently. If any upload fails the ones that
+    # succeeded are deleted again and None is returned.
+    uploads: list[StorageResponse] = await asyncio.gather(*(
+        _upload(image_dir, image) for image in images
+    ))
+    failed: list[StorageResponse] = [u for u in uploads if not u.success]
+    if failed:
+        for u in failed:
+            print(u)
+        await delete_uploaded_images([u for u in uploads if u.success])
+        return None
+    return uploads
+
+
+# variant -> (upload, width, height)
+ProcessedImage = dict[str, tuple[StorageResponse, int, int]]
+
+
+def _processed_uploads(processed: list[ProcessedImage]) -> list[StorageResponse]:
+    return [v[0] for p in processed for v in p.values()]
+
+
+async def process_image(image_dir: str, image: UploadFile) -> ProcessedImage | None:
+    # 1. Render the sized variants in the process pool
+    path: str | None = await spool_upload(image)
+    if path is None:
+        return None
+    try:
+        variants: Variants | None = await get_image_processor().process(path)
+    finally:
+        os.unlink(path)
+    if variants is None:
+        return None
+
+    # 2. Upload every variant
+    names: list[str] = list(variants)
+    uploads: list[StorageResponse] | None = await upload_images(
+        image_dir,
+        [UploadFile(io.BytesIO(variants[n][0]), filename=f"{n}{VARIANT_EXTENSION}") for n in names]
+    )
+    if uploads is None:
+        return None
+    return {n: (u, variants[n][1], variants[n][2]) for n, u in zip(names, uploads)}
+
+
+async def process_images(image_dir: str, images: list[UploadFile]) -> list[ProcessedImage] | None:
+    processed: list[ProcessedImage | None] = await asyncio.gather(*(
+        process_image(image_dir, image) for image in images
+    ))
+    if any(p is None for p in processed):
+        await delete_uploaded_images(_processed_uploads([p for p in processed if p is not None]))
+        return None
+    return processed
+
+
+# Inserts the images and their variants. Exposes "ids" (n, image_id), where
+# n is the 1-based position of the image in the batch
+INSERT_IMAGES: str = """
+    WITH src AS (
+        SELECT
+            s.image_url,
+            s.public_id,
+            s.n
+        FROM
+            unnest(%s::text[], %s::text[]) WITH ORDINALITY AS s(image_url, public_id, n)
+    ),
+    inserted AS (
+        INSERT INTO images (
+            image_url,
+            public_id
+        )
+        SELECT
+            image_url,
+            public_id
+        FROM
+            src
+        RETURNING
+            image_id,
+            public_id
+    ),
+    ids AS (
+        SELECT
+            s.n,
+            i.image_id
+        FROM
+            inserted i
+        INNER JOIN
+            src s ON s.public_id = i.public_id
+    ),
+    variants AS (
+        INSERT INTO image_variants (
+            image_id,
+            variant,
+            image_url,
+            public_id,
+            width,
+            height
+        )
+        SELECT
+            ids.image_id,
+            v.variant,
+            v.image_url,
+            v.public_id,
+            v.width,
+            v.height
+        FROM
+            unnest(
+                %s::int[],
+                %s::image_variant[],
+                %s::text[],
+                %s::text[],
+                %s::int[],
+                %s::int[]
+            ) AS v(n, variant, image_url, public_id, width, height)
+        INNER JOIN
+            ids ON ids.n = v.n
+    )
+"""
+
+
+def _insert_images_params(processed: list[ProcessedImage]) -> tuple:
+    # images.image_url keeps pointing at the full variant
+    rows = [(n, name, v[0], v[1], v[2]) for n, p in enumerate(processed, 1) for name, v in p.items()]
+    return (
+        [p['full'][0].content['secure_url'] for p in processed],
+        [p['full'][0].content['public_id'] for p in processed],
+        [r[0] for r in rows],
+        [r[1] for r in rows],
+        [r[2].content['secure_url'] for r in rows],
+        [r[2].content['public_id'] for r in rows],
+        [r[3] for r in rows],
+        [r[4] for r in rows]
+    )
+
+
+async def insert_images(processed: list[ProcessedImage], query: str, params: tuple = ()) -> DataBaseResponse:
+    # query runs after INSERT_IMAGES and can read from "ids". Uploads are
+    # deleted again when the transaction fails
+    r: DataBaseResponse = await db_transaction([(
+        INSERT_IMAGES + query,
+        _insert_images_params(processed) + params
+    )])
+    if r.status_code != status.HTTP_201_CREATED:
+        await delete_uploaded_images(_processed_uploads(processed))
+    return r
+
+
+async def create_new_image(image_dir: str, image: UploadFile) -> str:
+    processed: list[ProcessedImage] | None = await process_images(image_dir, [image])
+    if processed is None:
         return
-    
-    # 2. Register image on database
-    db_image: DataBaseResponse = db_create(
+
+    r: DataBaseResponse = await insert_images(
+        processed,
+        """
+            SELECT
+                image_id
+            FROM
+                ids;
+        """
+    )
+    if r.status_code != status.HTTP_201_CREATED:
+        return
+    return r.content[0][0]['image_id']
+
+
+async def create_post_images(post_id: int, images: list[UploadFile]) -> DataBaseResponse:
+    processed: list[ProcessedImage] | None = await process_images(
+        get_storage().get_post_folder(post_id),
+        images
+    )
+    if processed is None:
+        return DataBaseResponse(status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    # position follows the order the files were sent in
+    return await insert_images(
+        processed,
         """
-            INSERT INTO images (
-                image_url,
-                public_id
+            INSERT INTO post_images (
+                post_id,
+                image_id,
+                position
             )
-            VALUES 
-                (%s, %s)
+            SELECT
+                %s,
+                image_id,
+                n - 1
+            FROM
+                ids
+            ORDER BY
+                n
+            ON CONFLICT
+                (post_id, position)
+            DO UPDATE SET
+                image_id = EXCLUDED.image_id
             RETURNING
-                image_id
+                post_id;
         """,
-        (strg_image.content['secure_url'], strg_image.content['public_id'])
+        (str(post_id), )
     )
 
-    if db_image.status_code != status.HTTP_201_CREATED:
-        return
-    
-    # 3. Return registered image
-    return db_image.content['image_id']
-
-
-def register_post_hashtags(user_id: int, post_id: int, content: str) -> DataBaseResponse:
-    hashtags: list[str] = extract_hashtags(content)
-    pool = db_get_pool()
-    with pool.connection() as conn:
-        with conn.cursor() as cur:
-            for tag in hashtags:
-                cur.execute(
-                    """
-                        INSERT INTO hashtags 
-                            (name)
-                        VALUES 
-                            (%s)
-                        ON CONFLICT 
-                            (name) 
-                        DO NOTHING;
-                    """, 
-                    (tag, )
-                )
-                
-                cur.execute(
-                    """
-                        INSERT INTO post_hashtags (
-                            user_id, 
-                            post_id, 
-                            hashtag_id
-                        )
-                        VALUES 
-                            (%s, %s, (SELECT hashtag_id FROM hashtags WHERE name = %s))
-                        ON CONFLICT 
-                            (user_id, post_id, hashtag_id) 
-                        DO NOTHING;
-                    """, 
-                    (
-                        str(user_id),
-                        str(post_id), 
-                        tag
+
+def extract_unique_hashtags(content: str) -> list[str]:
+    return list(dict.fromkeys(extract_hashtags(content)))
+
+
+async def index_post_hashtags(posts: list[tuple[int, int, str]]) -> DataBaseResponse:
+    # Replaces the hashtags of every (post_id, user_id, content) in one statement:
+    # missing tags are upserted, dropped tags are removed and new ones inserted
+    post_ids: list[int] = []
+    user_ids: list[int] = []
+    names: list[str] = []
+    for post_id, user_id, content in posts:
+        for tag in extract_unique_hashtags(content):
+            post_ids.append(post_id)
+            user_ids.append(user_id)
+            names.append(tag)
+
+    return await db_transaction([(
+        """
+            WITH src AS (
+                SELECT 
+                    * 
+                FROM 
+                    unnest(%s::int[], %s::int[], %s::citext[]) AS s(post_id, user_id, name)
+            ),
+            inserted AS (
+                INSERT INTO hashtags 
+                    (name)
+                SELECT DISTINCT 
+                    name 
+                FROM 
+                    src
+                ORDER BY 
+                    name
+                ON CONFLICT 
+                    (name) 
+                DO NOTHING
+                RETURNING 
+                    hashtag_id, name
+            ),
+            ids AS (
+                SELECT hashtag_id, name FROM inserted
+                UNION
+                SELECT h.hashtag_id, h.name FROM hashtags h WHERE h.name IN (SELECT name FROM src)
+            ),
+            pairs AS (
+                SELECT 
+                    s.user_id, 
+                    s.post_id, 
+                    ids.hashtag_id 
+                FROM 
+                    src s
+                INNER JOIN 
+                    ids ON ids.name = s.name
+            ),
+            removed AS (
+                DELETE FROM 
+                    post_hashtags ph
+                WHERE 
+                    ph.post_id = ANY(%s::int[]) AND
+                    NOT EXISTS (
+                        SELECT 1 FROM pairs p WHERE p.post_id = ph.post_id AND p.hashtag_id = ph.hashtag_id
                     )
-                )
\ No newline at end of file
+            )
+            INSERT INTO post_hashtags (
+                user_id, 
+                post_id, 
+                hashtag_id
+            )
+            SELECT 
+                user_id, 
+                post_id, 
+                hashtag_id 
+            FROM 
+                pairs
+            ON CONFLICT 
+                (user_id, post_id, hashtag_id) 
+            DO NOTHING;
+        """,
+        (post_ids, user_ids, names, [p[0] for p in posts])
+    )])
+
+
+async def register_post_hashtags(user_id: int, post_id: int, content: str) -> DataBaseResponse:
+    return await index_post_hashtags([(post_id, user_id, content)])
+
+
+async def reindex_all_post_hashtags(batch_size: int = 1000) -> int:
+    # Rebuilds post_hashtags for the whole posts table, e.g. after the
+    # extraction regex changes. Returns the number of posts processed.
+    last_post_id: int = 0
+    total: int = 0
+    while True:
+        r: DataBaseResponse = await db_read_all(
+            """
+                SELECT 
+                    post_id, 
+                    user_id, 
+                    content
+                FROM 
+                    posts
+                WHERE 
+                    post_id > %s
+                ORDER BY 
+                    post_id
+                LIMIT %s;
+            """,
+            (last_post_id, batch_size)
+        )
+        if r.status_code != status.HTTP_200_OK or not r.content:
+            return total
+        batch = [(row['post_id'], row['user_id'], row['content']) for row in r.content]
+        if (await index_post_hashtags(batch)).status_code != status.HTTP_201_CREATED:
+            return total
+        total += len(batch)
+        last_post_id = batch[-1][0]
+
+
+# Public profile card used by every user list. Expects users as "u"
+USER_SUMMARY_COLUMNS: str = """
+    u.user_id,
+    u.username,
+    u.full_name,
+    u.is_verified,
+    COALESCE(v.image_url, i.image_url) AS avatar_url
+"""
+USER_SUMMARY_JOINS: str = """
+    LEFT JOIN
+        users_profile_images upi ON upi.user_id = u.user_id
+    LEFT JOIN
+        images i ON i.image_id = upi.profile_image_id
+    LEFT JOIN
+        image_variants v ON v.image_id = i.image_id AND v.variant = 'thumbnail'
+"""
+
+
+async def read_users(user_ids: list[int]) -> DataBaseResponse:
+    # One query for any number of ids, returned in the order they were given
+    return await db_read_all(
+        f"""
+            SELECT
+                {USER_SUMMARY_COLUMNS}
+            FROM
+                users u
+            {USER_SUMMARY_JOINS}
+            WHERE
+                u.user_id = ANY(%s::int[])
+            ORDER BY
+                array_position(%s::int[], u.user_id);
+        """,
+        (user_ids, user_ids)
+    )
+
+
+async def liked_posts(user_id: int, post_ids: list[int]) -> set[int] | None:
+    # One primary key probe per id on post_likes (post_id, user_id); likes
+    # still waiting in the like buffer take precedence over the table
+    r: DataBaseResponse = await db_read_all(
+        """
+            SELECT
+                post_id
+            FROM
+                post_likes
+            WHERE
+                post_id = ANY(%s::int[]) AND
+                user_id = %s;
+        """,
+        (post_ids, str(user_id))
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    liked: set[int] = {row['post_id'] for row in r.content}
+    for post_id in post_ids:
+        pending: bool | None = get_like_buffer().liked("post", (user_id, post_id))
+        if pending is True:
+            liked.add(post_id)
+        elif pending is False:
+            liked.discard(post_id)
+    return liked
+
+
+async def liked_comments(user_id: int, comment_ids: list[int]) -> set[int] | None:
+    # comment_likes is keyed by (user_id, post_id, comment_id), so each
+    # comment's post_id is looked up first to probe the right partition
+    r: DataBaseResponse = await db_read_all(
+        """
+            SELECT
+                c.comment_id,
+                c.post_id,
+                cl.comment_id IS NOT NULL AS liked
+            FROM
+                comments c
+            LEFT JOIN
+                comment_likes cl ON
+                cl.user_id = %s AND
+                cl.post_id = c.post_id AND
+                cl.comment_id = c.comment_id
+            WHERE
+                c.comment_id = ANY(%s::int[]);
+        """,
+        (str(user_id), comment_ids)
+    )
+    if r.status_code != status.HTTP_200_OK:
+        return None
+    liked: set[int] = set()
+    for row in r.content:
+        pending: bool | None = get_like_buffer().liked("comment", (user_id, row['post_id'], row['comment_id']))
+        if pending if pending is not None else row['liked']:
+            liked.add(row['comment_id'])
+    return liked
+
+
+async def mark_liked_posts(user_id: int | None, posts: list[dict]) -> bool:
+    # Fills "liked_by_viewer" on every post row in place
+    if user_id is None or not posts:
+        return True
+    liked: set[int] | None = await liked_posts(user_id, [post['post_id'] for post in posts])
+    if liked is None:
+        return False
+    for post in posts:
+        post['liked_by_viewer'] = post['post_id'] in liked
+    return True
@@ -0,0 +1,72 @@
+from dotenv import load_dotenv
+from src import database
+from src import jobs
+from src import storage
+from src import timeline
+import traceback
+import asyncio
+import os
+
+
+load_dotenv()
+
+
+POLL_INTERVAL: float = float(os.getenv("JOBS_POLL_INTERVAL", 1))
+STALE_TIMEOUT: float = float(os.getenv("JOBS_STALE_TIMEOUT", 600))
+MAINTENANCE_INTERVAL: float = float(os.getenv("JOBS_MAINTENANCE_INTERVAL", 60))
+DONE_RETENTION_DAYS: int = int(os.getenv("JOBS_DONE_RETENTION_DAYS", 7))
+
+
+async def run(job: dict) -> None:
+    job_type: jobs.JobType = jobs.JOB_TYPES[job['type']]
+    try:
+        await job_type.handler(job['payload'])
+    except Exception as e:
+        print(f"[JOB FAILED] -> [{job['type']} {job['job_id']}] [{e}]")
+        await jobs.fail(job, traceback.format_exc())
+        return
+    await jobs.complete(job['job_id'])
+
+
+async def consume(job_type: str) -> None:
+    # Keeps at most `concurrency` jobs of this type running in this process
+    concurrency: int = jobs.JOB_TYPES[job_type].concurrency
+    running: set[asyncio.Task] = set()
+    while True:
+        claimed: list[dict] | None = []
+        if len(running) < concurrency:
+            claimed = await jobs.claim(job_type, concurrency - len(running))
+        for job in claimed or []:
+            task = asyncio.create_task(run(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if not claimed:
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+async def maintain() -> None:
+    while True:
+        await jobs.release_stale(STALE_TIMEOUT)
+        await jobs.purge_done(DONE_RETENTION_DAYS)
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+
+async def main() -> None:
+    await database.db_open()
+    storage.create_storage(storage.storage_from_env())
+    storage.get_storage().open()
+    timeline.create_timeline_store(timeline.timeline_store_from_env())
+    await timeline.get_timeline_store().open()
+    try:
+        await asyncio.gather(
+            maintain(),
+            *(consume(job_type) for job_type in jobs.JOB_TYPES)
+        )
+    finally:
+        await timeline.get_timeline_store().close()
+        await database.db_close()
+        storage.get_storage().close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())